@@ -0,0 +1,125 @@
+from typing import Iterable, Iterator
+import mmap
+import os
+import struct
+
+MAGIC = b"NPSNAP01"
+HEADER = struct.Struct("<8sQQ")  # magic, record count, offset of the index
+INDEX_ENTRY = struct.Struct("<QII")  # offset of the key, key length, value length (the value follows the key)
+
+
+class BinarySnapshot:
+    """Read-only view of a snapshot file written by write_binary_snapshot, memory-mapped.
+
+    The file holds each record as its key bytes followed by its encoded value, then an index of fixed-size entries
+    sorted by key bytes. Opening it reads only the header; lookups binary search the mapped index, so nothing is
+    decoded until asked for."""
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.index_offset = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary snapshot")
+
+    def entry(self, i: int) -> tuple[int, int, int]:
+        return INDEX_ENTRY.unpack_from(self.map, self.index_offset + i * INDEX_ENTRY.size)
+
+    def key(self, i: int) -> bytes:
+        key_offset, key_length, _ = self.entry(i)
+        return self.map[key_offset:key_offset + key_length]
+
+    def position(self, key: bytes) -> int:
+        """Index of the first record whose key is not below key."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup(self, key: str) -> bytes | None:
+        """Encoded value stored under key, or None."""
+        target = key.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, value_length = self.entry(middle)
+            candidate = self.map[key_offset:key_offset + key_length]
+            if candidate < target:
+                low = middle + 1
+            elif candidate > target:
+                high = middle
+            else:
+                value_offset = key_offset + key_length
+                return self.map[value_offset:value_offset + value_length]
+        return None
+
+    def items(self) -> Iterator[tuple[bytes, bytes]]:
+        """(key bytes, encoded value) in key order."""
+        for i in range(self.count):
+            key_offset, key_length, value_length = self.entry(i)
+            value_offset = key_offset + key_length
+            yield self.map[key_offset:value_offset], self.map[value_offset:value_offset + value_length]
+
+    def close(self) -> None:
+        self.map.close()
+
+
+class BinarySnapshotWriter:
+    """Writes a snapshot through a temp file, renamed over path by finish(). Records must be added in key order."""
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.file = open(self.temp_path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, 0, 0))
+        self.offset = HEADER.size
+        self.index = bytearray()
+        self.count = 0
+
+    def add(self, key: bytes, value: bytes) -> None:
+        self.file.write(key)
+        self.file.write(value)
+        self.index += INDEX_ENTRY.pack(self.offset, len(key), len(value))
+        self.offset += len(key) + len(value)
+        self.count += 1
+
+    def copy(self, snapshot: BinarySnapshot, start: int, stop: int) -> None:
+        """Copy records start..stop-1 of another snapshot as they are: one write for their data, and their index
+        entries moved by how far the data moved."""
+        if start >= stop:
+            return
+        first_offset = snapshot.entry(start)[0]
+        key_offset, key_length, value_length = snapshot.entry(stop - 1)
+        end = key_offset + key_length + value_length
+        self.file.write(snapshot.map[first_offset:end])
+        entries = snapshot.map[snapshot.index_offset + start * INDEX_ENTRY.size:snapshot.index_offset + stop * INDEX_ENTRY.size]
+        shift = self.offset - first_offset
+        if shift == 0:
+            self.index += entries
+        else:
+            for key_offset, key_length, value_length in INDEX_ENTRY.iter_unpack(entries):
+                self.index += INDEX_ENTRY.pack(key_offset + shift, key_length, value_length)
+        self.offset += end - first_offset
+        self.count += stop - start
+
+    def finish(self) -> int:
+        """Write the index and header, sync, and rename the file into place. Returns the number of records."""
+        self.file.write(self.index)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, self.count, self.offset))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+        return self.count
+
+
+def write_binary_snapshot(path: str, items: Iterable[tuple[bytes, bytes]]) -> int:
+    """Write (key bytes, encoded value) pairs, which must come sorted by key. Returns the number of records."""
+    writer = BinarySnapshotWriter(path)
+    for key, value in items:
+        writer.add(key, value)
+    return writer.finish()
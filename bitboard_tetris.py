@@ -0,0 +1,196 @@
+from piece import Piece, PIECE_TEMPLATES
+from tetris import Tetris
+from typing import Iterable
+
+HEIGHT, WIDTH = Tetris.SIZE
+FULL = (1 << WIDTH) - 1  # a row mask with every cell filled; bit c is column c
+MOVES = {"left": (0, -1), "right": (0, 1), "down": (1, 0)}
+
+
+def shape_masks(cells: tuple[tuple[int, int], ...]) -> tuple[int, int, int, int, tuple[tuple[int, int], ...]]:
+    """(min_row, max_row, min_col, max_col, ((row, mask), ...)) of a piece's filled cells. Masks are shifted right by
+    min_col, so a piece at column col covers mask << (col + min_col) of its rows."""
+    min_col = min(c for _, c in cells)
+    masks = {}
+    for r, c in cells:
+        masks[r] = masks.get(r, 0) | 1 << (c - min_col)
+    return min(masks), max(masks), min_col, max(c for _, c in cells), tuple(sorted(masks.items()))
+
+
+PIECE_MASKS = {type_name: tuple(shape_masks(cells) for cells in template.cells) for type_name, template in PIECE_TEMPLATES.items()}
+"""shape_masks of every rotation state of every piece type: PIECE_MASKS[type_name][rotation]."""
+
+
+class BitboardTetris(Tetris):
+    """Tetris on bitboards, with the same behavior as Tetris.
+
+    Occupancy is one int per row (rows), bit c set if column c is filled, and each cell colour has its own plane of
+    row masks (planes), so board reads like a Tetris board. Collision tests use the precomputed row masks of the
+    piece's rotation state (PIECE_MASKS): a probe is a bounds check and one AND per piece row, with no Piece built,
+    and a full line is a row equal to FULL.
+
+    Nothing in a game reads board (the game sends board_string()); it is built from the planes on the first read
+    after a lock, clear or set_board and kept until the next one, so it must not be changed in place."""
+    def __init__(self, gravity_time: float, seed: int) -> None:
+        self.rows = [0] * HEIGHT
+        self.planes: dict[int, list[int]] = {}  # {colour: [row masks]}
+        self.board_cache: list[list[int]] | None = None
+        super().__init__(gravity_time, seed)
+
+    @property
+    def board(self) -> list[list[int]]:
+        if self.board_cache is None:
+            board = [[0] * WIDTH for _ in range(HEIGHT)]
+            for color, plane in self.planes.items():
+                for row, mask in enumerate(plane):
+                    while mask:
+                        bit = mask & -mask
+                        board[row][bit.bit_length() - 1] = color
+                        mask ^= bit
+            self.board_cache = board
+        return self.board_cache
+
+    @board.setter
+    def board(self, board: list[list[int]]) -> None:
+        self.rows = [0] * HEIGHT
+        self.planes = {}
+        for row in range(HEIGHT):
+            for col in range(WIDTH):
+                color = board[row][col]
+                if color != 0:
+                    self.rows[row] |= 1 << col
+                    plane = self.planes.setdefault(color, [0] * HEIGHT)
+                    plane[row] |= 1 << col
+        self.board_cache = None
+
+    def board_string(self) -> str:
+        lines = []
+        for row in range(HEIGHT):
+            cells = ["0"] * WIDTH
+            if self.rows[row]:
+                for color, plane in self.planes.items():
+                    mask = plane[row]
+                    while mask:
+                        bit = mask & -mask
+                        cells[bit.bit_length() - 1] = str(color)
+                        mask ^= bit
+            lines.append("".join(cells))
+        return "\n".join(lines) + "\n"
+
+    def clear_board(self) -> None:
+        self.rows = [0] * HEIGHT
+        self.planes = {}
+        self.board_cache = None
+        self.column_heights = [0] * WIDTH
+
+    def set_board(self, board: list[list[int]]) -> None:
+        self.board = board
+        self.recount_heights()
+
+    def recount_heights(self) -> None:
+        heights = [0] * WIDTH
+        seen = 0
+        for row in range(HEIGHT):
+            new = self.rows[row] & ~seen  # columns whose top cell is in this row
+            while new:
+                bit = new & -new
+                heights[bit.bit_length() - 1] = HEIGHT - row
+                new ^= bit
+            seen |= self.rows[row]
+            if seen == FULL:
+                break
+        self.column_heights = heights
+
+    def column_height_from(self, col: int, row: int) -> int:
+        bit = 1 << col
+        for r in range(row, HEIGHT):
+            if self.rows[r] & bit:
+                return HEIGHT - r
+        return 0
+
+    def collides(self, masks: tuple, row: int, col: int) -> bool:
+        min_row, max_row, min_col, max_col, cells = masks
+        if row + min_row < 0 or row + max_row >= HEIGHT or col + min_col < 0 or col + max_col >= WIDTH:
+            return True
+        shift = col + min_col
+        rows = self.rows
+        for r, mask in cells:
+            if rows[row + r] & (mask << shift):
+                return True
+        return False
+
+    def check_collide(self, piece: Piece) -> bool:
+        if piece is None:
+            return False
+        return self.collides(PIECE_MASKS[piece.type_name][piece.rotation], piece.position[0], piece.position[1])
+
+    def now_piece_masks(self, rotation: int = 0) -> tuple:
+        return PIECE_MASKS[self.now_piece.type_name][(self.now_piece.rotation + rotation) % 4]
+
+    def now_piece_can_rotate(self) -> bool:
+        row, col = self.now_piece.position
+        return not self.collides(self.now_piece_masks(1), row, col)
+
+    def try_rotate_now_piece(self) -> None:
+        masks = self.now_piece_masks(1)
+        row, col = self.now_piece.position
+        for shift in self.now_piece.template.kicks:
+            if not self.collides(masks, row, col + shift):
+                self.now_piece.position = (row, col + shift)
+                self.now_piece.rotate()
+                return
+
+    def now_piece_can_move(self, direction: str) -> bool:
+        row, col = self.now_piece.position
+        d_row, d_col = MOVES.get(direction, (0, 0))
+        return not self.collides(self.now_piece_masks(), row + d_row, col + d_col)
+
+    def now_piece_fits_at(self, row: int, col: int) -> bool:
+        return not self.collides(self.now_piece_masks(), row, col)
+
+    def lock_piece(self) -> None:
+        if self.now_piece is not None:
+            pre_color = self.now_piece.color
+            row, col = self.now_piece.position
+            _, _, min_col, _, cells = self.now_piece_masks()
+            shift = col + min_col
+            touched_rows = []
+            self.board_cache = None
+            for r, mask in cells:
+                board_row = row + r
+                if 0 <= board_row < HEIGHT:
+                    touched_rows.append(board_row)
+                    mask = (mask << shift if shift >= 0 else mask >> -shift) & FULL
+                    for plane in self.planes.values():
+                        plane[board_row] &= ~mask
+                    if pre_color != 0:  # colour 0 writes empty cells, as in Tetris
+                        self.planes.setdefault(pre_color, [0] * HEIGHT)[board_row] |= mask
+                        self.rows[board_row] |= mask
+                    else:
+                        self.rows[board_row] &= ~mask
+            if pre_color != 0:
+                self.raise_heights(self.now_piece.cells, self.now_piece.position)
+            else:
+                self.lower_heights(self.now_piece.cells, self.now_piece.position)  # colour 0 emptied the cells
+            self.clear_full_lines(touched_rows)
+            self.now_piece = self.next_piece_list.pop(0)
+            self.now_piece.color = pre_color
+            self.next_piece_list.append(self.rng.choice(Tetris.PIECE_LIST).copy())
+            if self.check_collide(self.now_piece):
+                self.board_dead = True
+            self.gravity_timer = 0.0
+
+    def clear_full_lines(self, rows: Iterable[int] | None = None) -> None:
+        """Clears the full lines among rows (all rows by default) and adds their cells to the recent cleared cells."""
+        full_rows = sorted(row for row in (range(HEIGHT) if rows is None else rows) if self.rows[row] == FULL)
+        if not full_rows:
+            return
+        for color, plane in self.planes.items():
+            if 1 <= color <= 3:  # only count score, heal, attack cells
+                self.recent_cleared_cells[color] += sum(plane[row].bit_count() for row in full_rows)
+        for masks in (self.rows, *self.planes.values()):
+            for row in reversed(full_rows):
+                del masks[row]
+            masks[0:0] = [0] * len(full_rows)
+        self.board_cache = None
+        self.drop_heights(full_rows)
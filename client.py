@@ -6,10 +6,13 @@ import threading
 import queue
 import getpass
 import time
+import copy
 
 class Client:
     def __init__(self) -> None:
         self.host = ""
+        self.port = 0
+        self.session_token: str | None = None
         self.lobby_msgfmt_passer = MessageFormatPasser(timeout=1.0)
         self.game_msgfmt_passer: MessageFormatPasser | None = None
         self.temp_username: str | None = None
@@ -24,6 +27,7 @@ class Client:
         self.player_id: str | None = None
         self.game_connected_event = threading.Event()
         self.game_window: GameWindow | None = None
+        self.list_cache: dict[str, tuple[str, dict]] = {}  # {list command: (version token, response data)}
 
     def print_prompt(self):
         print("\n\nCommands you can type:\n")
@@ -34,6 +38,8 @@ class Client:
             print("You are not logged in yet. Enter command: >>>>>>>>>> ", end="")
         else:
             print("logout: log out your account")
+            print("history: show finished matches")
+            print("leaderboard: show the top players and your rank")
             if self.info.current_room_id is None:
                 print("createroom: create a game room")
                 print("joinroom: join a public game room")
@@ -125,6 +131,7 @@ class Client:
                 if result == Words.Result.SUCCESS:
                     print("Login successful.")
                     self.info.name = username
+                    self.session_token = data.get(Words.DataParamKey.SESSION_TOKEN)
                     break
                 else:
                     message = data.get(Words.DataParamKey.MESSAGE, "Login failed.")
@@ -150,12 +157,75 @@ class Client:
             if result == Words.Result.SUCCESS:
                 print("Logout successful.")
                 self.info.reset()
+                self.session_token = None
             else:
                 message = data.get(Words.DataParamKey.MESSAGE, "Logout failed.")
                 print(message)
         except Exception as e:
             print(f"Error during logout: {e}")
 
+    def match_history(self):
+        try:
+            username = input("Whose matches? (empty for yours): ").strip() or self.info.name
+            cursor = None
+            while True:
+                self.send_to_lobby(Words.Command.MATCH_HISTORY, {Words.DataParamKey.USERNAME: username, Words.DataParamKey.LIMIT: 5, Words.DataParamKey.CURSOR: cursor})
+                response = self.get_response(timeout=5.0)
+                if response is None:
+                    print("No response from server.")
+                    return
+                responding_command, result, data = response
+                if responding_command != Words.Command.MATCH_HISTORY or result != Words.Result.SUCCESS:
+                    print(data.get(Words.DataParamKey.MESSAGE, "Failed to get match history."))
+                    return
+                matches = data.get(Words.DataParamKey.MATCHES, [])
+                if not matches and cursor is None:
+                    print(f"{username} has not finished any matches yet.")
+                    return
+                for match in matches:
+                    ended = time.strftime("%Y-%m-%d %H:%M", time.localtime(match.get(Words.DataParamKey.ENDED_AT, 0)))
+                    players = match.get(Words.DataParamKey.PLAYERS, [])
+                    scores = match.get(Words.DataParamKey.SCORES, {})
+                    score_text = " vs ".join(f"{player} ({scores.get(player, 0)})" for player in players)
+                    print(f"#{match.get(Words.DataParamKey.MATCH_ID)} {ended}  {score_text}  winner: {match.get(Words.DataParamKey.WINNER)}  {match.get(Words.DataParamKey.DURATION, 0):.0f}s")
+                cursor = data.get(Words.DataParamKey.NEXT_CURSOR)
+                if cursor is None or input("Show older matches? (y/n): ").strip().lower() != "y":
+                    return
+        except Exception as e:
+            print(f"Error getting match history: {e}")
+
+    def leaderboard(self):
+        try:
+            board = "win_rate" if input("Rank by (1) games won or (2) win rate? ").strip() == "2" else "wins"
+            self.send_to_lobby(Words.Command.LEADERBOARD, {Words.DataParamKey.BOARD: board, Words.DataParamKey.LIMIT: 10})
+            response = self.get_response(timeout=5.0)
+            if response is None:
+                print("No response from server.")
+                return
+            responding_command, result, data = response
+            if responding_command != Words.Command.LEADERBOARD or result != Words.Result.SUCCESS:
+                print(data.get(Words.DataParamKey.MESSAGE, "Failed to get leaderboard."))
+                return
+
+            def print_entry(entry: dict) -> None:
+                marker = "  <- you" if entry.get(Words.DataParamKey.USERNAME) == self.info.name else ""
+                print(f"{entry.get(Words.DataParamKey.RANK):>6}. {entry.get(Words.DataParamKey.USERNAME):<20} {entry.get(Words.DataParamKey.GAMES_WON):>5} won {entry.get(Words.DataParamKey.GAMES_PLAYED):>5} played {100 * entry.get(Words.DataParamKey.WIN_RATE, 0):>5.1f}%{marker}")
+
+            print(f"Top players by {'win rate' if board == 'win_rate' else 'games won'} ({data.get(Words.DataParamKey.TOTAL, 0)} ranked):")
+            entries = data.get(Words.DataParamKey.ENTRIES, [])
+            for entry in entries:
+                print_entry(entry)
+            rank = data.get(Words.DataParamKey.RANK)
+            if rank is None:
+                print("You are not ranked on this board yet.")
+            elif rank > len(entries):
+                print("...")
+                for entry in data.get(Words.DataParamKey.AROUND, []):
+                    if entry.get(Words.DataParamKey.RANK) > len(entries):
+                        print_entry(entry)
+        except Exception as e:
+            print(f"Error getting leaderboard: {e}")
+
     def create_room(self):
         try:
             privacy = ""
@@ -209,11 +279,28 @@ class Client:
         except Exception as e:
             print(f"Error during leave room: {e}")
 
+    def request_list(self, command: str) -> tuple[str, str, dict] | None:
+        """Send a list command (rooms, online users) with the version of the list we last got, so an unchanged list
+        comes back as a short not_modified and is taken from list_cache. Returns the response like get_response."""
+        token = self.list_cache[command][0] if command in self.list_cache else ""
+        self.send_to_lobby(command, {Words.DataParamKey.IF_VERSION_NEWER_THAN: token})
+        response = self.get_response(timeout=5.0)
+        if response is None or response[0] != command:
+            return response
+        responding_command, result, data = response
+        if result == Words.Result.NOT_MODIFIED and command in self.list_cache:
+            return responding_command, Words.Result.SUCCESS, copy.deepcopy(self.list_cache[command][1])
+        if result == Words.Result.SUCCESS and Words.DataParamKey.VERSION in data:
+            version = data.pop(Words.DataParamKey.VERSION)
+            if Words.DataParamKey.ROOMS in data:
+                data = data[Words.DataParamKey.ROOMS]
+            self.list_cache[command] = (version, copy.deepcopy(data))
+        return responding_command, result, data
+
     def join_room(self):
         try:
             # first, get public room list from server
-            self.send_to_lobby(Words.Command.CHECK_JOINABLE_ROOMS, {})
-            response = self.get_response(timeout=5.0)
+            response = self.request_list(Words.Command.CHECK_JOINABLE_ROOMS)
             if response is None:
                 print("No response from server. Join room failed.")
                 return
@@ -269,8 +356,7 @@ class Client:
 
     def join_room_as_spectator(self):
         try:
-            self.send_to_lobby(Words.Command.CHECK_SPECTATABLE_ROOMS, {})
-            response = self.get_response(timeout=5.0)
+            response = self.request_list(Words.Command.CHECK_SPECTATABLE_ROOMS)
             if response is None:
                 print("No response from server. Join room failed.")
                 return
@@ -326,8 +412,7 @@ class Client:
 
     def invite_player(self):
         try:
-            self.send_to_lobby(Words.Command.CHECK_ONLINE_USERS, {})
-            response = self.get_response(timeout=5.0)
+            response = self.request_list(Words.Command.CHECK_ONLINE_USERS)
             if response is None:
                 print("No response from server. Invite failed.")
                 return
@@ -570,6 +655,16 @@ class Client:
                             print("You are currently in a game. Cannot logout now.")
                             continue
                         self.logout()
+                    case "history":
+                        if not self.info.name:
+                            print("You are not logged in.")
+                            continue
+                        self.match_history()
+                    case "leaderboard":
+                        if not self.info.name:
+                            print("You are not logged in.")
+                            continue
+                        self.leaderboard()
                     case "createroom":
                         if not self.info.name:
                             print("You are not logged in.")
@@ -685,6 +780,7 @@ class Client:
 
     def start(self, host: str = "127.0.0.1", port: int = 21354) -> None:
         self.host = host
+        self.port = port
         self.lobby_msgfmt_passer.connect(host, port)
         
         self.lobby_msgfmt_passer.send_args(Protocols.ConnectionToLobby.HANDSHAKE, Words.ConnectionType.CLIENT)
@@ -725,6 +821,8 @@ class Client:
                 continue
             except Exception as e:
                 print(f"Error listening for messages: {e}")
+                if not self.shutdown_event.is_set() and self.resume_session():
+                    continue
                 # try:
                 #     self.lobby_msgfmt_passer.close()
                 # except Exception:
@@ -735,6 +833,55 @@ class Client:
                 #     pass
                 self.shutdown_event.set()
 
+    def resume_session(self, attempts: int = 5, retry_interval: float = 2.0) -> bool:
+        """Reconnect to the lobby and reattach to the logged-in session. Called from the listen thread only."""
+        if self.session_token is None:
+            return False
+        for attempt in range(1, attempts + 1):
+            print(f"Connection to lobby lost. Resuming session (attempt {attempt}/{attempts})...")
+            passer = MessageFormatPasser(timeout=1.0)
+            try:
+                passer.connect(self.host, self.port)
+                passer.send_args(Protocols.ConnectionToLobby.HANDSHAKE, Words.ConnectionType.CLIENT)
+                result, message = passer.receive_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE)
+                if result != Words.Result.CONFIRMED:
+                    raise ConnectionError(f"Handshake failed: {message}")
+                passer.send_args(Protocols.ClientToLobby.COMMAND, Words.Command.RESUME_SESSION, {Words.DataParamKey.SESSION_TOKEN: self.session_token})
+                while True:
+                    try:
+                        message_type, responding_command, event_type, result, data = passer.receive_args(Protocols.LobbyToClient.MESSAGE)
+                    except TimeoutError:
+                        continue
+                    if message_type == Words.MessageType.RESPONSE and responding_command == Words.Command.RESUME_SESSION:
+                        break
+                    self.handle_message([message_type, responding_command, event_type, result, data])
+            except Exception as e:
+                print(f"Error resuming session: {e}")
+                passer.close()
+                time.sleep(retry_interval)
+                continue
+            if result != Words.Result.SUCCESS:
+                print(data.get(Words.DataParamKey.MESSAGE, "Failed to resume session."))
+                passer.close()
+                self.session_token = None
+                self.info.reset()
+                return False
+            old_passer = self.lobby_msgfmt_passer
+            self.lobby_msgfmt_passer = passer
+            try:
+                old_passer.close()
+            except Exception:
+                pass
+            now_room_info = data.get(Words.DataParamKey.NOW_ROOM_INFO, {})
+            self.info.name = data.get(Words.DataParamKey.USERNAME)
+            self.info.current_room_id = data.get(Words.DataParamKey.ROOM_ID)
+            self.info.is_room_owner = self.info.current_room_id is not None and now_room_info.get(Words.DataParamKey.OWNER) == self.info.name
+            self.info.is_spectating = self.info.name in now_room_info.get(Words.DataParamKey.SPECTATORS, [])
+            self.info.users_inviting_me = set(data.get(Words.DataParamKey.INVITERS, []))
+            print("Session resumed.")
+            return True
+        return False
+
     def listen_for_events(self) -> None:
         while not self.shutdown_event.is_set():
             try:
@@ -0,0 +1,325 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable
+from database_bulk_tool import bulk_write, seed_users
+from database_driver import DatabaseDriver
+from database_server import DatabaseServer
+from json_storage_engine import JsonStorageEngine
+from match_log import MatchLog
+from sqlite_storage_engine import SqliteStorageEngine
+from storage_engine import StorageEngine
+from protocols import Words
+
+
+class Workload:
+    """What the operations of one client pick from: the preloaded users and rooms, and a counter for new usernames."""
+    def __init__(self, client: int, users: int, room_ids: list[str]) -> None:
+        self.rng = random.Random(client)
+        self.client = client
+        self.users = users
+        self.room_ids = room_ids
+        self.created = 0
+
+    def username(self) -> str:
+        return f"bench{self.rng.randrange(self.users)}"
+
+    def room_id(self) -> str:
+        return self.rng.choice(self.room_ids)
+
+    def new_username(self) -> str:
+        self.created += 1
+        return f"bench_c{self.client}_{self.created}"
+
+
+OPERATIONS: dict[str, Callable[[Workload], tuple[str, str, dict]]] = {
+    "user_get": lambda w: (Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: w.username()}),
+    "user_online": lambda w: (Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.ONLINE: True, Words.DataParamKey.LIMIT: 50}),
+    "user_update": lambda w: (Words.Collection.USER, Words.Action.UPDATE, {Words.DataParamKey.USERNAME: w.username(), Words.DataParamKey.ONLINE: w.rng.random() < 0.5}),
+    "user_create": lambda w: (Words.Collection.USER, Words.Action.CREATE, {Words.DataParamKey.USERNAME: w.new_username(), Words.DataParamKey.PASSWORD: "x"}),
+    "room_get": lambda w: (Words.Collection.ROOM, Words.Action.QUERY, {Words.DataParamKey.ROOM_ID: w.room_id()}),
+    "room_list": lambda w: (Words.Collection.ROOM, Words.Action.QUERY, {}),
+    "room_joinable": lambda w: (Words.Collection.ROOM, Words.Action.QUERY, {Words.DataParamKey.IS_PLAYING: False, Words.DataParamKey.PRIVACY: "public"}),
+    "room_update": lambda w: (Words.Collection.ROOM, Words.Action.UPDATE, {Words.DataParamKey.ROOM_ID: w.room_id(), Words.DataParamKey.IS_PLAYING: w.rng.random() < 0.5}),
+}
+"""Named operations a mix is made of: each builds a request (collection, action, data) from a client's Workload."""
+
+MIXES = {
+    "default": "user_get=64,room_get=16,user_update=10,room_update=10",
+    "read-heavy": "user_get=70,room_get=10,room_list=10,room_joinable=5,user_online=5",
+    "write-heavy": "user_update=40,room_update=30,user_create=10,user_get=20",
+    "lobby": "user_get=40,room_joinable=20,user_online=10,user_update=15,room_update=10,user_create=5",
+}
+"""Named mixes; --mix also takes NAME=WEIGHT,... directly."""
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    weights = {}
+    for part in MIXES.get(spec, spec).split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}; known: {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def disk_write_bytes(pid: int | str = "self") -> int | None:
+    """Bytes the process has caused to be written to storage, from /proc/PID/io, or None where that is unavailable."""
+    try:
+        with open(f"/proc/{pid}/io", 'r') as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def make_storage(engine: str, data_dir: str, durability: str):
+    if engine == "sqlite":
+        return SqliteStorageEngine(os.path.join(data_dir, "bench.sqlite3"), durability=durability)
+    return JsonStorageEngine(data_dir, durability=durability)
+
+
+def preload(storage, users: int, rooms: int) -> list[str]:
+    with storage.lock:
+        for i in range(users):
+            storage.put_user(f"bench{i}", {
+                Words.DataParamKey.PASSWORD: "x",
+                Words.DataParamKey.GAMES_PLAYED: 0,
+                Words.DataParamKey.GAMES_WON: 0,
+                Words.DataParamKey.ONLINE: False,
+                Words.DataParamKey.CURRENT_ROOM_ID: None,
+            })
+        for i in range(rooms):
+            storage.put_room(str(i), {
+                Words.DataParamKey.OWNER: f"bench{i}",
+                Words.DataParamKey.SETTINGS: {Words.DataParamKey.PRIVACY: "public"},
+                Words.DataParamKey.IS_PLAYING: False,
+                Words.DataParamKey.USERS: [f"bench{i}"],
+                Words.DataParamKey.SPECTATORS: [],
+            })
+    storage.flusher.flush()
+    return [str(i) for i in range(rooms)]
+
+
+def preload_remote(driver: DatabaseDriver, users: int, rooms: int) -> list[str]:
+    """Preload a server we only talk to: bulk create the users (those left from an earlier run are skipped) and
+    create the rooms, returning their ids."""
+    bulk_write(driver, Words.Action.BULK_CREATE, seed_users(users, "bench", "x"))
+    room_ids = []
+    for i in range(rooms):
+        result, data = driver.request(Words.Collection.ROOM, Words.Action.CREATE, {Words.DataParamKey.OWNER: f"bench{i % users}",
+                                                                                  Words.DataParamKey.SETTINGS: {Words.DataParamKey.PRIVACY: "public"}})
+        if result != Words.Result.SUCCESS:
+            raise RuntimeError(f"Could not create a benchmark room: {data.get(Words.DataParamKey.MESSAGE)}")
+        room_ids.append(data[Words.DataParamKey.ROOM_ID])
+    return room_ids
+
+
+def replay(driver: DatabaseDriver, mix: dict[str, float], clients: int, requests: int, duration: float | None, users: int,
+           room_ids: list[str]) -> dict:
+    """Run clients concurrent requesters, each sending its next request once the previous one is answered, until
+    they have sent requests in total or, with duration, for that many seconds. Returns the measurements."""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies: dict[str, list[float]] = {name: [] for name in names}
+    errors: dict[str, int] = {name: 0 for name in names}
+    merge_lock = threading.Lock()
+    deadline = None
+
+    def client(index: int) -> None:
+        workload = Workload(index, users, room_ids)
+        own = {name: [] for name in names}
+        own_errors = {name: 0 for name in names}
+        sent = 0
+        while (time.perf_counter() < deadline) if duration is not None else (sent < requests // clients):
+            name = workload.rng.choices(names, weights)[0]
+            collection, action, data = OPERATIONS[name](workload)
+            start_time = time.perf_counter()
+            result, _ = driver.request(collection, action, data)
+            own[name].append(time.perf_counter() - start_time)
+            if result in (Words.Result.ERROR, Words.Result.FAILURE):
+                own_errors[name] += 1
+            sent += 1
+        with merge_lock:
+            for name in names:
+                latencies[name].extend(own[name])
+                errors[name] += own_errors[name]
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start_time = time.perf_counter()
+    if duration is not None:
+        deadline = start_time + duration
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    every = sorted(latency for name in names for latency in latencies[name])
+    operations = {}
+    for name in names:
+        ordered = sorted(latencies[name])
+        operations[name] = {"count": len(ordered), "errors": errors[name], "p50_ms": 1000 * percentile(ordered, 0.50),
+                            "p99_ms": 1000 * percentile(ordered, 0.99)}
+    return {
+        "requests": len(every),
+        "seconds": elapsed,
+        "ops_per_second": len(every) / elapsed,
+        "mean_ms": 1000 * sum(every) / len(every) if every else 0.0,
+        "p50_ms": 1000 * percentile(every, 0.50),
+        "p99_ms": 1000 * percentile(every, 0.99),
+        "p999_ms": 1000 * percentile(every, 0.999),
+        "errors": sum(errors.values()),
+        "operations": operations,
+    }
+
+
+def run(engine: str, workers: int, durability: str, mix: dict[str, float], clients: int, requests: int, duration: float | None,
+        users: int, rooms: int) -> dict:
+    """One run against a server of our own on a fresh data directory. logged_bytes is what the flusher wrote (the
+    JSON engine's write-ahead log), disk_bytes all the process wrote to storage meanwhile, snapshots and SQLite pages
+    included."""
+    data_dir = tempfile.mkdtemp(prefix="db_bench_")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):  # the server and the passers print every message
+            storage = make_storage(engine, data_dir, durability)
+            room_ids = preload(storage, users, rooms)
+            server = DatabaseServer(storage, workers=workers, match_log=MatchLog(os.path.join(data_dir, "match_log")))
+            driver = DatabaseDriver()
+            accept_thread = threading.Thread(target=driver.accept)
+            accept_thread.start()
+            server.connect(driver.host, driver.port)
+            accept_thread.join()
+
+            logged_before = storage.stats()["bytes_written"]
+            disk_before = disk_write_bytes()
+            result = replay(driver, mix, clients, requests, duration, users, room_ids)
+            storage.flusher.flush()
+            logged_bytes = storage.stats()["bytes_written"] - logged_before
+            if type(storage).write_batch is StorageEngine.write_batch:
+                logged_bytes = None  # the engine writes in its own transactions (SQLite), not through the flusher
+            disk_after = disk_write_bytes()
+            driver.close()
+            server.shutdown()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    result.update({
+        "engine": engine,
+        "workers": workers,
+        "durability": durability,
+        "logged_bytes": logged_bytes,
+        "disk_bytes": disk_after - disk_before if disk_before is not None and disk_after is not None else None,
+    })
+    return result
+
+
+def run_remote(listen: tuple[str, int], server_pid: int | None, mix: dict[str, float], clients: int, requests: int,
+               duration: float | None, users: int, rooms: int) -> dict:
+    """One run against a database server started separately, which connects to us as it would to the lobby."""
+    driver = DatabaseDriver(*listen)
+    try:
+        print(f"Waiting for a database server started with --host {driver.host} --port {driver.port}.", flush=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            driver.accept(timeout=None)
+            room_ids = preload_remote(driver, users, rooms)
+            disk_before = disk_write_bytes(server_pid) if server_pid is not None else None
+            result = replay(driver, mix, clients, requests, duration, users, room_ids)
+            disk_after = disk_write_bytes(server_pid) if server_pid is not None else None
+    finally:
+        driver.close()
+    result.update({
+        "engine": "remote",
+        "workers": None,
+        "durability": None,
+        "logged_bytes": None,
+        "disk_bytes": disk_after - disk_before if disk_before is not None and disk_after is not None else None,
+    })
+    return result
+
+
+def run_key(result: dict) -> tuple:
+    return result["engine"], result["durability"], result["workers"], result["mix"]
+
+
+def format_bytes(count: int | None) -> str:
+    if count is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB"):
+        if count < 1024:
+            return f"{count:.0f}{unit}"
+        count /= 1024
+    return f"{count:.1f}GiB"
+
+
+def format_change(value: float, baseline: float | None) -> str:
+    if not baseline:
+        return ""
+    return f" ({100 * (value - baseline) / baseline:+.0f}%)"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput and latency of DatabaseServer under a synthetic lobby load: this tool takes the "
+                                                 "lobby's side of the connection and replays a mix of USER and ROOM operations at fixed concurrency.")
+    parser.add_argument("--engine", default="json", help="comma separated storage engines to compare (json, sqlite)")
+    parser.add_argument("--workers", default="0,4,16", help="comma separated worker counts to compare")
+    parser.add_argument("--durability", default="immediate,group", help="comma separated durability levels to compare")
+    parser.add_argument("--mix", default="default", help=f"operation mix: one of {', '.join(MIXES)}, or NAME=WEIGHT,... of {', '.join(OPERATIONS)}")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent requesters, each with one request in flight")
+    parser.add_argument("--requests", type=int, default=4000, help="requests per run")
+    parser.add_argument("--duration", type=float, default=None, help="run each configuration for this many seconds instead of --requests")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--rooms", type=int, default=500)
+    parser.add_argument("--listen", default=None, metavar="HOST:PORT",
+                        help="benchmark a database server started with --host/--port pointing at this address instead of one of our own")
+    parser.add_argument("--server-pid", type=int, default=None, help="with --listen: pid of that server, to read the bytes it writes to disk")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="a JSON file written by --output; show changes against its matching runs")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    baseline = {}
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = {run_key(result): result for result in json.load(f)["runs"]}
+
+    print(f"{'engine':<7} {'durability':<10} {'workers':>7} {'ops/s':>16} {'p50 ms':>7} {'p99 ms':>7} {'p999 ms':>8} {'logged':>9} {'disk':>9} {'errors':>6}")
+    results = []
+
+    def show(result: dict) -> None:
+        result["mix"] = args.mix
+        results.append(result)
+        before = baseline.get(run_key(result), {})
+        ops = f"{result['ops_per_second']:.0f}{format_change(result['ops_per_second'], before.get('ops_per_second'))}"
+        print(f"{result['engine']:<7} {result['durability'] or '-':<10} {result['workers'] if result['workers'] is not None else '-':>7} {ops:>16} "
+              f"{result['p50_ms']:>7.2f} {result['p99_ms']:>7.2f} {result['p999_ms']:>8.2f} {format_bytes(result['logged_bytes']):>9} "
+              f"{format_bytes(result['disk_bytes']):>9} {result['errors']:>6}", flush=True)
+
+    if args.listen is not None:
+        host, _, port = args.listen.rpartition(":")
+        show(run_remote((host or "127.0.0.1", int(port)), args.server_pid, mix, args.clients, args.requests, args.duration, args.users, args.rooms))
+    else:
+        for engine in args.engine.split(","):
+            for durability in args.durability.split(","):
+                for workers in (int(w) for w in args.workers.split(",")):
+                    show(run(engine, workers, durability, mix, args.clients, args.requests, args.duration, args.users, args.rooms))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({"started_at": time.time(), "settings": vars(args), "runs": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
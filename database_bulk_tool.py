@@ -0,0 +1,163 @@
+import argparse
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Iterable, Iterator
+from database_driver import DatabaseDriver
+from database_server import DatabaseServer
+from database_flusher import DURABILITY_GROUP, DURABILITY_IMMEDIATE, DURABILITY_ASYNC
+from json_storage_engine import JsonStorageEngine, SNAPSHOT_JSON, SNAPSHOT_BINARY
+from sqlite_storage_engine import SqliteStorageEngine, SQLITE_DB_FILE
+from match_log import MatchLog, MATCH_LOG_DIR
+from message_format_passer import LENGTH_LIMIT
+from protocols import Words
+
+CHUNK_BYTES = LENGTH_LIMIT - 4096
+"""Encoded size of the users in one bulk request, leaving room for the rest of the request message."""
+IN_FLIGHT = 4
+"""Chunks sent before waiting for the oldest one's response, so the server never waits for the next chunk."""
+
+
+def report(message: str) -> None:
+    print(message, file=sys.stderr, flush=True)  # stdout is muted: the server and the passers print every message
+
+
+def chunks(users: Iterable[tuple[str, dict]]) -> Iterator[dict]:
+    chunk = {}
+    size = 0
+    for username, record in users:
+        entry_size = len(json.dumps(username)) + len(json.dumps(record)) + 4
+        if chunk and size + entry_size > CHUNK_BYTES:
+            yield chunk
+            chunk = {}
+            size = 0
+        chunk[username] = record
+        size += entry_size
+    if chunk:
+        yield chunk
+
+
+def bulk_write(driver: DatabaseDriver, action: str, users: Iterable[tuple[str, dict]]) -> tuple[int, list[str]]:
+    """Send the users in chunks, IN_FLIGHT at a time. Returns how many were applied and the usernames skipped."""
+    count_key = Words.DataParamKey.CREATED if action == Words.Action.BULK_CREATE else Words.DataParamKey.UPDATED
+    in_flight = collections.deque()
+    applied = 0
+    skipped = []
+
+    def collect() -> None:
+        nonlocal applied
+        result, data = driver.wait(in_flight.popleft())
+        if result != Words.Result.SUCCESS:
+            raise RuntimeError(f"{action} failed: {data.get(Words.DataParamKey.MESSAGE)}")
+        applied += data[count_key]
+        skipped.extend(data[Words.DataParamKey.SKIPPED])
+
+    for chunk in chunks(users):
+        in_flight.append(driver.send(Words.Collection.USER, action, {Words.DataParamKey.USERS: chunk}))
+        if len(in_flight) >= IN_FLIGHT:
+            collect()
+    while in_flight:
+        collect()
+    return applied, skipped
+
+
+def export(driver: DatabaseDriver, path: str) -> int:
+    """Write every user to path as one JSON object, {username: record} like user_db.json, a page at a time."""
+    exported = 0
+    cursor = None
+    with open(path, 'w') as f:
+        f.write("{")
+        while True:
+            result, data = driver.request(Words.Collection.USER, Words.Action.EXPORT, {Words.DataParamKey.CURSOR: cursor})
+            if result != Words.Result.FOUND:
+                raise RuntimeError(f"export failed: {data.get(Words.DataParamKey.MESSAGE)}")
+            for username, user_info in data[Words.DataParamKey.USERS].items():
+                f.write(("\n" if exported == 0 else ",\n") + f"    {json.dumps(username)}: {json.dumps(user_info)}")
+                exported += 1
+            cursor = data[Words.DataParamKey.NEXT_CURSOR]
+            if cursor is None:
+                break
+        f.write("\n}\n")
+    return exported
+
+
+def seed_users(count: int, prefix: str, password: str) -> Iterator[tuple[str, dict]]:
+    for i in range(count):
+        yield f"{prefix}{i}", {Words.DataParamKey.PASSWORD: password}
+
+
+@contextlib.contextmanager
+def connect(args) -> Iterator[DatabaseDriver]:
+    """A driver for the database: a server of our own on the data files, or with --listen one that connects to us."""
+    driver = DatabaseDriver(*args.listen) if args.listen is not None else DatabaseDriver()
+    server = None
+    try:
+        if args.listen is not None:
+            report(f"Waiting for a database server started with --host {driver.host} --port {driver.port}.")
+            driver.accept(timeout=None)
+        else:
+            if args.engine == "sqlite":
+                storage = SqliteStorageEngine(args.sqlite_path, durability=args.durability)
+            else:
+                storage = JsonStorageEngine(args.data_dir, durability=args.durability, snapshot_format=args.snapshot_format)
+            server = DatabaseServer(storage, match_log=MatchLog(args.match_log_dir))
+            accept_thread = threading.Thread(target=driver.accept)
+            accept_thread.start()
+            server.connect(driver.host, driver.port)
+            accept_thread.join()
+        yield driver
+    finally:
+        driver.close()
+        if server is not None:
+            server.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk import, update and export of users through a database server's bulk actions.")
+    parser.add_argument("command", choices=["import", "update", "export", "seed"],
+                        help="import: create the users of FILE; update: change the users of FILE; export: write every user to FILE; seed: create COUNT users")
+    parser.add_argument("target", help="FILE, {username: record} like user_db.json, or COUNT for seed")
+    parser.add_argument("--prefix", default="loadtest", help="seed: usernames are PREFIX0, PREFIX1, ...")
+    parser.add_argument("--password", default="password", help="seed: password of every seeded user")
+    parser.add_argument("--listen", default=None, metavar="HOST:PORT",
+                        help="wait here for a database server (started with --host/--port pointing at this address) instead of opening the data files")
+    parser.add_argument("--engine", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--data-dir", default=".", help="directory of the JSON engine's files")
+    parser.add_argument("--sqlite-path", default=SQLITE_DB_FILE)
+    parser.add_argument("--snapshot-format", choices=[SNAPSHOT_JSON, SNAPSHOT_BINARY], default=SNAPSHOT_JSON)
+    parser.add_argument("--match-log-dir", default=MATCH_LOG_DIR)
+    parser.add_argument("--durability", choices=[DURABILITY_IMMEDIATE, DURABILITY_GROUP, DURABILITY_ASYNC], default=DURABILITY_GROUP)
+    args = parser.parse_args()
+    if args.listen is not None:
+        host, _, port = args.listen.rpartition(":")
+        args.listen = (host or "127.0.0.1", int(port))
+
+    if args.command == "seed":
+        users = seed_users(int(args.target), args.prefix, args.password)
+    elif args.command in ("import", "update"):
+        with open(args.target, 'r') as f:
+            users = json.load(f).items()
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')), connect(args) as driver:
+        if args.command == "export":
+            exported = export(driver, args.target)
+        else:
+            action = Words.Action.BULK_UPDATE if args.command == "update" else Words.Action.BULK_CREATE
+            applied, skipped = bulk_write(driver, action, users)
+    elapsed = time.perf_counter() - start_time
+    if args.command == "export":
+        report(f"Exported {exported} users to {args.target} in {elapsed:.2f}s.")
+    else:
+        verb = "Updated" if args.command == "update" else "Created"
+        reason = "missing" if args.command == "update" else "already existing"
+        report(f"{verb} {applied} users in {elapsed:.2f}s ({applied / elapsed:.0f} users/s); skipped {len(skipped)} {reason}.")
+        if skipped:
+            report("Skipped: " + ", ".join(skipped[:10]) + (" ..." if len(skipped) > 10 else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+from message_format_passer import MessageFormatPasser
+from protocols import Protocols, Words
+import socket
+import threading
+import uuid
+
+
+class DatabaseDriver:
+    """Stands in for the lobby on a database server's connection, for tools and benchmarks.
+
+    The database server connects to the lobby, so the driver listens, accepts the server's handshake and then sends
+    LobbyToDB requests. request() may be called from many threads; responses are matched by responding_request_id."""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_socket.bind((host, port))
+        self.listen_socket.listen(1)
+        self.host, self.port = self.listen_socket.getsockname()
+        self.msgfmt_passer: MessageFormatPasser | None = None
+        self.pending: dict[str, list] = {}  # {request_id: [event, result, data]}
+        self.pending_lock = threading.Lock()
+        self.receiver_thread: threading.Thread | None = None
+        self.closed = False
+
+    def accept(self, timeout: float | None = 10.0, expected_type: str = Words.ConnectionType.DATABASE_SERVER) -> None:
+        """expected_type is database_replica to drive a replica."""
+        self.listen_socket.settimeout(timeout)
+        sock, _ = self.listen_socket.accept()
+        self.msgfmt_passer = MessageFormatPasser(sock)
+        connection_type, = self.msgfmt_passer.receive_args(Protocols.ConnectionToLobby.HANDSHAKE)
+        if connection_type != expected_type:
+            self.msgfmt_passer.send_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE, Words.Result.ERROR, f"Expected a {expected_type} connection.")
+            raise ConnectionError(f"Unexpected connection type: {connection_type}")
+        self.msgfmt_passer.send_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE, Words.Result.CONFIRMED, "Database server connected successfully.")
+        self.receiver_thread = threading.Thread(target=self.receive_responses, daemon=True)
+        self.receiver_thread.start()
+
+    def receive_responses(self) -> None:
+        while not self.closed:
+            try:
+                request_id, result, data = self.msgfmt_passer.receive_args(Protocols.DBToLobby.RESPONSE)
+            except Exception as e:
+                if not self.closed:
+                    print(f"Database driver stopped receiving: {e}")
+                break
+            with self.pending_lock:
+                slot = self.pending.get(request_id)
+            if slot is not None:
+                slot[1], slot[2] = result, data
+                slot[0].set()
+
+    def send(self, collection: str, action: str, data: dict) -> str:
+        """Send a request without waiting. Returns its id; pass it to wait()."""
+        request_id = str(uuid.uuid4())
+        with self.pending_lock:
+            self.pending[request_id] = [threading.Event(), None, None]
+        self.msgfmt_passer.send_args(Protocols.LobbyToDB.REQUEST, request_id, collection, action, data)
+        return request_id
+
+    def wait(self, request_id: str, timeout: float | None = 30.0) -> tuple[str, dict]:
+        with self.pending_lock:
+            slot = self.pending[request_id]
+        if not slot[0].wait(timeout):
+            raise TimeoutError(f"No response to request {request_id}")
+        with self.pending_lock:
+            del self.pending[request_id]
+        return slot[1], slot[2]
+
+    def request(self, collection: str, action: str, data: dict, timeout: float | None = 30.0) -> tuple[str, dict]:
+        return self.wait(self.send(collection, action, data), timeout)
+
+    def close(self) -> None:
+        self.closed = True
+        if self.msgfmt_passer is not None:
+            self.msgfmt_passer.close()
+        self.listen_socket.close()
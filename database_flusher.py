@@ -0,0 +1,146 @@
+from typing import Callable, Any
+import threading
+import time
+
+DURABILITY_IMMEDIATE = "immediate"
+DURABILITY_GROUP = "group"
+DURABILITY_ASYNC = "async"
+
+
+class DatabaseFlusher:
+    """Decouples storage engine mutations from disk I/O.
+
+    Mutations only mark a record dirty. Writing the same record again before the next flush replaces the pending value,
+    so a burst of updates to one user costs one log entry. A background thread persists all dirty records as one batch
+    every flush_interval seconds, or sooner once max_dirty records are pending. The engine supplies two steps:
+    prepare(batch) runs under data_lock (e.g. encode log lines, or commit an SQLite transaction) and
+    write(prepared) runs outside it and returns the number of bytes written.
+
+    Durability levels, i.e. when the lobby gets its response to a mutating request:
+        immediate: the server flushes right after the request and then responds. No window; one disk write per request.
+        group:     the response is held until the batch that contains the mutation is on disk (group commit).
+                   No window for acknowledged requests; adds up to flush_interval of latency.
+        async:     the response is sent at once. A crash can lose mutations acknowledged in the last flush_interval
+                   seconds (plus the log's fsync_interval if its fsync policy is "interval").
+
+    stats() reports marked, coalesced and written entries, flushes, bytes written, the largest batch, the last flush
+    duration and the current number of dirty records.
+
+    Listeners (see add_listener) see every batch, in order; replication uses them to ship what was written."""
+    def __init__(self, prepare: Callable[[list[tuple[str, str, dict | None]]], Any], write: Callable[[Any], int], data_lock,
+                 durability: str = DURABILITY_GROUP, flush_interval: float = 0.01, max_dirty: int = 512) -> None:
+        if durability not in (DURABILITY_IMMEDIATE, DURABILITY_GROUP, DURABILITY_ASYNC):
+            raise ValueError(f"Unknown durability level: {durability}")
+        self.prepare = prepare
+        self.write = write
+        self.data_lock = data_lock
+        """Held by the server while it mutates records; taken here while the batch is prepared."""
+        self.io_lock = threading.Lock()
+        """Serializes writes with snapshots. Always taken before data_lock."""
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.dirty: dict[tuple[str, str], dict | None] = {}  # {(collection, key): latest value, None for deleted}
+        self.waiting_callbacks: list[Callable[[], None]] = []
+        self.listeners: list[tuple[Callable[[list[tuple[str, str, dict | None]]], None], Callable[[], None]]] = []
+        self.dirty_lock = threading.Lock()
+        """Writers of different collections may mark records at the same time. Taken after data_lock."""
+        self.condition = threading.Condition()
+        self.shutdown_event = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.marked_count = 0
+        self.written_count = 0
+        self.flush_count = 0
+        self.bytes_written = 0
+        self.max_batch = 0
+        self.last_flush_seconds = 0.0
+
+    def start(self) -> None:
+        if self.durability == DURABILITY_IMMEDIATE:
+            return  # flushes happen on the request thread
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.shutdown_event.set()
+        with self.condition:
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def add_listener(self, stage: Callable[[list[tuple[str, str, dict | None]]], None], publish: Callable[[], None]) -> None:
+        """stage(batch) runs under data_lock right after the batch is prepared, so it can read the records consistently;
+        publish() runs once the batch is written."""
+        with self.io_lock:
+            self.listeners.append((stage, publish))
+
+    def mark_dirty(self, collection: str, key: str, value: dict | None) -> None:
+        """Must be called with the collection's part of data_lock held."""
+        with self.dirty_lock:
+            self.dirty[(collection, key)] = value
+            self.marked_count += 1
+            dirty_count = len(self.dirty)
+        if dirty_count >= self.max_dirty:
+            with self.condition:
+                self.condition.notify()
+
+    def after_durable(self, callback: Callable[[], None]) -> None:
+        """Run callback once every mutation marked so far is on disk. Must be called with data_lock (or part of it) held."""
+        with self.dirty_lock:
+            if self.dirty:
+                self.waiting_callbacks.append(callback)
+                return
+        callback()
+
+    def run(self) -> None:
+        while not self.shutdown_event.is_set():
+            with self.condition:
+                self.condition.wait(timeout=self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing database: {e}")
+
+    def flush(self) -> None:
+        with self.io_lock:
+            with self.data_lock:
+                with self.dirty_lock:
+                    if not self.dirty and not self.waiting_callbacks:
+                        return
+                    batch = [(collection, key, value) for (collection, key), value in self.dirty.items()]
+                    callbacks = self.waiting_callbacks
+                    self.dirty = {}
+                    self.waiting_callbacks = []
+                start_time = time.perf_counter()
+                prepared = self.prepare(batch) if batch else None
+                if batch:
+                    for stage, _ in self.listeners:
+                        stage(batch)
+            bytes_written = self.write(prepared) if batch else 0
+            if batch:
+                for _, publish in self.listeners:
+                    publish()
+            self.last_flush_seconds = time.perf_counter() - start_time
+            self.flush_count += 1
+            self.written_count += len(batch)
+            self.bytes_written += bytes_written
+            self.max_batch = max(self.max_batch, len(batch))
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error running post-flush callback: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "durability": self.durability,
+            "marked": self.marked_count,
+            "coalesced": self.marked_count - self.written_count - len(self.dirty),
+            "written": self.written_count,
+            "flushes": self.flush_count,
+            "bytes_written": self.bytes_written,
+            "max_batch": self.max_batch,
+            "last_flush_seconds": self.last_flush_seconds,
+            "dirty": len(self.dirty),
+        }
@@ -1,163 +1,696 @@
+import copy
 import json
 import message_format_passer
 from protocols import Protocols, Words
+from storage_engine import StorageEngine, USER_FIELD_GETTERS, ROOM_FIELD_GETTERS, META_COLLECTION, ROOM_ID_ALLOCATOR_KEY
+from db_query import Query
+from secondary_index import is_condition
+from json_storage_engine import JsonStorageEngine
+from match_log import MatchLog
+from leaderboard import Leaderboard, BOARD_WINS
+from database_flusher import DURABILITY_GROUP, DURABILITY_ASYNC
+from replication import ReplicationSource, ReplicaClient
+from shard_map import ShardMap
+from response_cache import ResponseCache
+from record_versions import RecordVersions, VERSIONED_COLLECTIONS
+from message_format import EncodedJson
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import threading
-import os
-
-USER_DB_FILE = 'user_db.json'
-ROOM_DB_FILE = 'room_db.json'
+import uuid
 
 class DatabaseServer:
-    """A simple database server that handles requests from the lobby server. It connects to lobby server just like client."""
-    def __init__(self) -> None:
+    """A simple database server that handles requests from the lobby server. It connects to lobby server just like client.
+
+    Records live in a StorageEngine (JsonStorageEngine unless another one is given). Engine writes are batched by a
+    DatabaseFlusher; its durability level selects when responses to mutations are sent (see database_flusher.py).
+
+    With workers > 0 requests run on a thread pool. Each request holds read locks on the collections it only reads and
+    write locks on the ones it changes (see lock_scope), so queries run in parallel and writes are serialized per
+    collection. Responses can then leave in a different order than the requests came in; the lobby matches them by
+    responding_request_id. With an engine that has scan snapshots, USER and ROOM queries and EXPORT hold no lock: a
+    lookup by key reads a copy under a brief read lock, and a scan reads a ScanSnapshot (see scan_snapshot.py),
+    opened under a brief read lock and closed once the response is sent, so long scans do not hold writers back.
+
+    BULK_CREATE and BULK_UPDATE apply a chunk of users, {username: record}, in one request, so a whole chunk shares
+    one commit; EXPORT returns all users in username order, a page under the message length limit at a time.
+
+    USER and ROOM queries accept operator conditions, projection, sort, limit and count-only mode (see db_query.Query),
+    so the lobby receives only the rows and fields it asked for. Their responses are kept encoded in a ResponseCache
+    until a write to the collection makes them stale, so a repeated query, like the room list every lobby refresh
+    asks for, is answered without filtering or encoding again.
+
+    USER and ROOM records and collections have version numbers (see record_versions.py). A query that carries
+    if_version_newer_than, a version token from an earlier answer, gets not_modified with that token when nothing it
+    covers has changed since: the record for a lookup by key, the whole collection otherwise. Otherwise its response
+    is {version: token, records: the usual response data}.
+
+    LOGIN, LOGOUT_CLEANUP, RECORD_RESULT (users) and START_MATCH (rooms) are composite actions: each checks and changes
+    everything a lobby flow needs under one set of locks, so the lobby makes one round trip and concurrent flows cannot
+    interleave between the check and the change.
+
+    Finished matches (the gamelog collection) go to a separate append-only MatchLog.
+
+    The leaderboard collection is answered from the storage engine's indexes when it has them (indexed_leaderboard),
+    and otherwise from a Leaderboard kept current by put_user, so ADD_WIN, ADD_GAME_PLAYED and every other user write
+    move the user to their new rank in O(log n). That Leaderboard is built from every user on a background thread, so
+    startup does not wait for a read of the users collection; it is incomplete until the build is done.
+
+    Replication (see replication.py): with replication_port a primary streams every write to replicas that connect
+    there. Given primary=(host, port) the server is a replica instead: it follows that primary, joins the lobby as a
+    database_replica and answers only queries, refusing them with replica_unavailable while more than max_replica_lag
+    seconds behind. promote() turns a replica into the primary once the old one is gone.
+
+    Sharding (see shard_map.py): given a shard_map the server is shard shard_index of several, joins the lobby as a
+    database_shard and refuses requests for users, rooms or matches stored on another shard. Users then live apart
+    from their rooms, so room actions change only the room and the lobby's ShardRouter updates the users on their
+    own shards (CLAIM_ROOM, RELEASE_ROOM); LOGOUT_CLEANUP reports the user's room instead of leaving it."""
+    MAX_MATCH_PAGE = 50
+    """Largest page of a gamelog query, to keep responses under the message length limit."""
+    MAX_LEADERBOARD_PAGE = 50
+    """Largest top-K or around-me window of a leaderboard query."""
+    MAX_EXPORT_PAGE = 2000
+    """Most users read for one EXPORT page; the page is cut shorter to stay under EXPORT_PAGE_BYTES."""
+    EXPORT_PAGE_BYTES = message_format_passer.LENGTH_LIMIT - 4096
+    """Encoded size of the users in an EXPORT page, leaving room for the rest of the response message."""
+
+    def __init__(self, storage: StorageEngine | None = None, workers: int = 0, match_log: MatchLog | None = None,
+                 replication_port: int | None = None, primary: tuple[str, int] | None = None, max_replica_lag: float = 5.0,
+                 shard_map: ShardMap | None = None, shard_index: int = 0) -> None:
         self.msgfmt_passer = message_format_passer.MessageFormatPasser(timeout=1.0)
         self.lobby_request_receiver_thread = threading.Thread(target=self.receive_lobby_request, daemon=True)
         self.shutdown_event = threading.Event()
-        self.user_db = self.load_user_db()
-        self.room_db = self.load_room_db()
-
-    def load_user_db(self):
-        if not os.path.exists(USER_DB_FILE):
-            return {}
-        with open(USER_DB_FILE, 'r') as f:
-            return json.load(f)
-        
-    def save_user_db(self):
-        with open(USER_DB_FILE, 'w') as f:
-            json.dump(self.user_db, f, indent=2)
-
-    def load_room_db(self):
-        if not os.path.exists(ROOM_DB_FILE):
-            return {}
-        with open(ROOM_DB_FILE, 'r') as f:
-            return json.load(f)
-
-    def save_room_db(self):
-        with open(ROOM_DB_FILE, 'w') as f:
-            json.dump(self.room_db, f, indent=2)
+        self.storage = storage if storage is not None else JsonStorageEngine()
+        self.match_log = match_log if match_log is not None else MatchLog()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db-worker") if workers > 0 else None
+        self.request_context = threading.local()
+        """Per thread: outbox, the responses of the request being processed, sent once its mutations are as durable as
+        the durability level asks, dirty, whether the request changed anything, and snapshots, the ScanSnapshots it
+        reads, closed after its responses are sent."""
+        self.versions = RecordVersions()
+        self.response_cache = ResponseCache(self.versions)
+        self.leaderboard = self.storage.indexed_leaderboard()
+        if self.leaderboard is None:
+            # Reading every user would hold up startup; the board fills in once the warm-up thread is done.
+            self.leaderboard = Leaderboard()
+            threading.Thread(target=self.storage.warm_user_view, args=(self.leaderboard.load, self.leaderboard.refresh),
+                             name="leaderboard-warmup", daemon=True).start()
+        self.lobby_address: tuple[str, int] | None = None
+        self.replication_port = replication_port
+        self.replication_source: ReplicationSource | None = None
+        self.replica_id = uuid.uuid4().hex[:8]
+        self.replica = ReplicaClient(self, primary[0], primary[1], self.replica_id) if primary is not None else None
+        self.max_replica_lag = max_replica_lag
+        self.shard_map = shard_map
+        self.shard_index = shard_index
+        self.sharded = shard_map is not None
+        """Room actions leave user records to the lobby's ShardRouter."""
+
+    def put_user(self, username: str, user_info: dict) -> None:
+        self.storage.put_user(username, user_info)
+        self.leaderboard.update(username, user_info)
+        self.versions.bump(Words.Collection.USER, username)
+        self.request_context.dirty = True
+
+    @staticmethod
+    def new_user(password) -> dict:
+        return {
+            Words.DataParamKey.PASSWORD: password,
+            Words.DataParamKey.GAMES_PLAYED: 0,
+            Words.DataParamKey.GAMES_WON: 0,
+            Words.DataParamKey.ONLINE: False,
+            Words.DataParamKey.CURRENT_ROOM_ID: None,
+        }
+
+    @staticmethod
+    def number_param(data: dict, key: str, default=None, kinds: tuple[type, ...] = (int,)):
+        """data[key], or default when it is absent or None. Raises ValueError unless it is a non-negative number of one
+        of kinds: the value comes from a client, through the lobby."""
+        value = data.get(key)
+        if value is None:
+            return default
+        if isinstance(value, bool) or not isinstance(value, kinds) or value < 0:
+            raise ValueError(f"{key} must be a non-negative {'integer' if kinds == (int,) else 'number'}.")
+        return value
+
+    def owns_user(self, username) -> bool:
+        return isinstance(username, str) and (not self.sharded or self.shard_map.shard_of(username) == self.shard_index)
+
+    def put_room(self, room_id: str, room_info: dict) -> None:
+        self.storage.put_room(room_id, room_info)
+        self.versions.bump(Words.Collection.ROOM, room_id)
+        self.request_context.dirty = True
+
+    def delete_room(self, room_id: str) -> None:
+        self.storage.delete_room(room_id)
+        self.versions.bump(Words.Collection.ROOM, room_id, deleted=True)
+        self.request_context.dirty = True
+
+    def publish_match(self, entry: dict) -> None:
+        if self.replication_source is not None:
+            self.replication_source.publish_match(entry)
+
+    def apply_replicated(self, entries: list) -> None:
+        """Apply [collection, key, value] entries streamed from the primary; value None deletes."""
+        with self.storage.lock:
+            for collection, key, value in entries:
+                if collection == Words.Collection.USER:
+                    if value is not None:
+                        self.put_user(key, value)
+                    elif self.storage.get_user(key) is not None:
+                        self.storage.delete_user(key)
+                        self.leaderboard.remove(key)
+                        self.versions.bump(Words.Collection.USER, key, deleted=True)
+                elif collection == Words.Collection.ROOM:
+                    if value is not None:
+                        self.put_room(key, value)
+                    elif self.storage.get_room(key) is not None:
+                        self.delete_room(key)
+                elif collection == Words.Collection.GAMELOG:
+                    if not self.match_log.append_replicated(value) and value[Words.DataParamKey.MATCH_ID] > len(self.match_log):
+                        print(f"Replicated match {key} skipped: the gamelog only has {len(self.match_log)} matches.")
+                elif collection == META_COLLECTION and key == ROOM_ID_ALLOCATOR_KEY:
+                    self.storage.room_ids.state.update(value)
+                    self.storage.mark_dirty(META_COLLECTION, key, self.storage.room_ids.state)
+
+    def replication_status(self) -> dict:
+        if self.replica is not None:
+            return self.replica.stats()
+        if self.replication_source is not None:
+            return self.replication_source.stats()
+        return {"role": "primary", "replicas": []}
+
+    def remove_user_from_room(self, room_id: str, room_info: dict, username: str) -> dict:
+        """Take a player or spectator out of a room, handing ownership on or deleting the room when its last player
+        leaves. Returns the room as it is now. The caller holds write locks on users and rooms. When sharded only the
+        room changes; the router releases the user, and the spectators of a deleted room, on their shards."""
+        room_info[Words.DataParamKey.ROOM_ID] = room_id  # include room_id in the info sent back
+        if username in room_info[Words.DataParamKey.SPECTATORS]:
+            room_info[Words.DataParamKey.SPECTATORS].remove(username)
+        else: # username in room_info[Words.DataParamKey.USERS]
+            room_info[Words.DataParamKey.USERS].remove(username)
+            if room_info[Words.DataParamKey.OWNER] == username:
+                if room_info[Words.DataParamKey.USERS]:
+                    room_info[Words.DataParamKey.OWNER] = room_info[Words.DataParamKey.USERS][0]
+                else: # no users left, delete room
+                    room_info[Words.DataParamKey.OWNER] = None
+                    # no user => delete room. But maybe there are spectators?
+                    for spectator in room_info[Words.DataParamKey.SPECTATORS] if not self.sharded else []:
+                        spectator_info = self.storage.get_user(spectator)
+                        spectator_info[Words.DataParamKey.CURRENT_ROOM_ID] = None
+                        self.put_user(spectator, spectator_info)
+                    self.delete_room(room_id)
+        if self.storage.get_room(room_id) is not None:
+            self.put_room(room_id, room_info)
+        if not self.sharded:
+            user_info = self.storage.get_user(username)
+            user_info[Words.DataParamKey.CURRENT_ROOM_ID] = None
+            self.put_user(username, user_info)
+        return room_info
+
+    def owning_shard(self, collection: str, data: dict) -> int | None:
+        """The shard a request must go to, or None if any shard may answer it (queries over all users, the
+        leaderboard, the replication status)."""
+        if collection in (Words.Collection.ROOM, Words.Collection.GAMELOG):
+            return self.shard_map.room_shard
+        username = data.get(Words.DataParamKey.USERNAME)
+        if collection == Words.Collection.USER and isinstance(username, str):
+            return self.shard_map.shard_of(username)
+        return None
+
+    def lock_scope(self, collection: str, action: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+        """Collections a request reads and collections it writes."""
+        if collection in (Words.Collection.GAMELOG, Words.Collection.LEADERBOARD, Words.Collection.REPLICATION):
+            return (), ()  # the match log and the leaderboard have their own locks, the replication status needs none
+        if action in (Words.Action.QUERY, Words.Action.EXPORT):
+            if self.storage.snapshot_scans:
+                return (), ()  # lookups lock briefly (reading), scans read a snapshot (scan_view)
+            return (collection,), ()
+        if action == Words.Action.LOGOUT_CLEANUP:
+            return (), (Words.Collection.USER, Words.Collection.ROOM)
+        if collection == Words.Collection.ROOM and action not in (Words.Action.UPDATE, Words.Action.DELETE):
+            return (), (Words.Collection.USER, Words.Collection.ROOM)  # these also move users in or out of the room
+        return (), (collection,)
+
+    def handle_request(self, request_id: str, collection: str, action: str, data: dict) -> None:
+        flusher = self.storage.flusher
+        read, write = self.lock_scope(collection, action)
+        self.request_context.snapshots = []
+        try:
+            with self.storage.lock.hold(read=read, write=write):
+                self.request_context.outbox = []
+                self.request_context.dirty = False
+                self.process_message(request_id, collection, action, data)
+                responses = self.request_context.outbox
+                dirty = self.request_context.dirty
+                self.request_context.outbox = None
+                if not dirty or flusher.durability == DURABILITY_ASYNC:
+                    # Nothing to wait for. Send while the locks (or snapshots) still keep writers away from the records in the responses.
+                    self.send_responses(responses)
+                    return
+                # Copy now: later requests may change the records these responses point to before the flush completes.
+                responses = copy.deepcopy(responses)
+                if flusher.durability == DURABILITY_GROUP:
+                    flusher.after_durable(lambda: self.send_responses(responses))
+                    return
+            flusher.flush()
+            self.send_responses(responses)
+        finally:
+            for snapshot in self.request_context.snapshots:
+                self.storage.close_snapshot(snapshot)
+            self.request_context.snapshots = []
+
+    @contextmanager
+    def reading(self, collection: str):
+        """The collection's read lock, for a query that looks records up by key. Without scan snapshots the whole
+        request already holds it (lock_scope)."""
+        if self.storage.snapshot_scans:
+            with self.storage.lock.hold(read=(collection,)):
+                yield
+        else:
+            yield
+
+    def scan_view(self, collection: str, criteria: dict):
+        """A ScanSnapshot of the records of collection that may match criteria, open until the request's responses
+        are sent, or None if the engine has none; the scan then reads the engine under the request's read lock."""
+        if not self.storage.snapshot_scans:
+            return None
+        with self.storage.lock.hold(read=(collection,)):
+            snapshot = self.storage.open_snapshot(collection, criteria)
+        self.request_context.snapshots.append(snapshot)
+        return snapshot
+
+    def run_request(self, request_id: str, collection: str, action: str, data: dict) -> None:
+        """handle_request, answering FAILURE if the request raises: the lobby waits for every response, and one bad
+        request must not stop the receiver."""
+        try:
+            self.handle_request(request_id, collection, action, data)
+        except Exception as e:
+            print(f"Error handling request {request_id} ({collection} {action}): {e}")
+            self.request_context.outbox = None  # drop the responses the failed request had collected
+            try:
+                self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: f"Request failed: {e}"})
+            except Exception as send_error:
+                print(f"Error answering request {request_id}: {send_error}")
+
+    def send_responses(self, responses: list[tuple[str, str, dict]]) -> None:
+        for request_id, result, data in responses:
+            self.send_response(request_id, result, data)
 
     def receive_lobby_request(self) -> None:
         while not self.shutdown_event.is_set():
+            msgfmt_passer = self.msgfmt_passer
             try:
-                request_id, collection, action, data = self.msgfmt_passer.receive_args(Protocols.LobbyToDB.REQUEST)
-                self.process_message(request_id, collection, action, data)
+                request_id, collection, action, data = msgfmt_passer.receive_args(Protocols.LobbyToDB.REQUEST)
+                if self.executor is not None:
+                    self.executor.submit(self.run_request, request_id, collection, action, data)
+                else:
+                    self.run_request(request_id, collection, action, data)
+                self.storage.maintenance()
             except TimeoutError:
+                self.storage.maintenance()
+                continue
+            except (KeyError, TypeError, UnicodeDecodeError, json.JSONDecodeError) as e:
+                print(f"Skipped a malformed request: {e}")  # read whole, so the connection is still in step
                 continue
             except Exception as e:
+                if msgfmt_passer is not self.msgfmt_passer:
+                    continue  # promoted: the replica connection was replaced by the primary one
                 print(f"Error in database server: {e}")
                 break
 
-    def start(self, host: str = "127.0.0.1", port: int = 21354) -> None:
-        self.msgfmt_passer.connect(host, port)
-        self.msgfmt_passer.send_args(Protocols.ConnectionToLobby.HANDSHAKE, Words.ConnectionType.DATABASE_SERVER)
-        result, message = self.msgfmt_passer.receive_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE)  # Wait for handshake response
+    def handshake(self, msgfmt_passer: message_format_passer.MessageFormatPasser, host: str, port: int, connection_type: str) -> None:
+        msgfmt_passer.connect(host, port)
+        msgfmt_passer.send_args(Protocols.ConnectionToLobby.HANDSHAKE, connection_type)
+        if connection_type == Words.ConnectionType.DATABASE_SHARD:
+            msgfmt_passer.send_args(Protocols.ShardToLobby.HELLO, self.shard_index, self.shard_map.shard_count, self.shard_map.room_shard)
+        result, message = msgfmt_passer.receive_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE)  # Wait for handshake response
         if result != Words.Result.CONFIRMED:
             raise ConnectionError(f"Handshake failed: {message}")
-        print("Database server connected to lobby server.")
 
+    def connect(self, host: str = "127.0.0.1", port: int = 21354) -> None:
+        """Connect and handshake with the lobby, then start the storage engine, replication and the request receiver."""
+        self.lobby_address = (host, port)
+        if self.replica is not None:
+            connection_type = Words.ConnectionType.DATABASE_REPLICA
+        elif self.sharded:
+            connection_type = Words.ConnectionType.DATABASE_SHARD
+        else:
+            connection_type = Words.ConnectionType.DATABASE_SERVER
+        self.handshake(self.msgfmt_passer, host, port, connection_type)
+        print(f"Database server connected to lobby server as {connection_type}.")
+
+        if self.replica is None and self.replication_port is not None:
+            self.start_replication_source()
+        self.storage.start()
+        if self.replica is not None:
+            self.replica.start()
         self.lobby_request_receiver_thread.start()
+
+    def start_replication_source(self) -> None:
+        self.replication_source = ReplicationSource(self, port=self.replication_port)
+        self.replication_source.start()
+
+    def promote(self) -> bool:
+        """Stop replicating and take over as the lobby's database server, which works only while the lobby has none.
+        On failure the replica resumes following its primary."""
+        if self.replica is None:
+            print("This database server is already the primary.")
+            return False
+        replica = self.replica
+        replica.stop()
+        msgfmt_passer = message_format_passer.MessageFormatPasser(timeout=1.0)
+        try:
+            self.handshake(msgfmt_passer, *self.lobby_address, Words.ConnectionType.DATABASE_SERVER)
+        except Exception as e:
+            print(f"Promotion failed, still a replica: {e}")
+            msgfmt_passer.close()
+            self.follow(replica.host, replica.port)
+            return False
+        old_passer = self.msgfmt_passer
+        self.msgfmt_passer = msgfmt_passer
+        self.replica = None
+        old_passer.close()
+        if self.replication_port is not None:
+            self.start_replication_source()
+        print(f"Promoted to primary after applying batch {replica.applied_sequence}.")
+        return True
+
+    def follow(self, host: str, port: int) -> None:
+        """Replicate from another primary, e.g. the one promoted after a failover."""
+        previous = self.replica
+        if previous is not None:
+            previous.stop()
+        self.replica = ReplicaClient(self, host, port, self.replica_id)
+        if previous is not None and (previous.host, previous.port) == (host, port):
+            self.replica.resume_after(previous)
+        self.replica.start()
+
+    def shutdown(self) -> None:
+        self.shutdown_event.set()
+        self.lobby_request_receiver_thread.join()
+        if self.replica is not None:
+            self.replica.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        if self.replication_source is not None:
+            self.replication_source.close()
+        self.storage.close()
+        self.match_log.close()
+        self.msgfmt_passer.close()
+
+    def start(self, host: str = "127.0.0.1", port: int = 21354) -> None:
+        self.connect(host, port)
         while not self.shutdown_event.is_set():
             try:
-                command = input("Enter 'stop' to stop database server: ")  # Keep the main thread alive
-                if command.strip().lower() == "stop":
+                command = input("Enter 'stop' to stop database server, 'stats' to print persistence and replication stats, 'promote' to make this replica the primary, 'follow <host> <port>' to replicate from another primary: ")  # Keep the main thread alive
+                words = command.strip().lower().split()
+                if words == ["stats"]:
+                    print(self.storage.stats())
+                    print(self.replication_status())
+                    print({"response_cache": self.response_cache.stats(), "versions": self.versions.stats()})
+                elif words == ["stop"]:
                     print("Shutting down database server.")
                     self.shutdown_event.set()
+                elif words == ["promote"]:
+                    self.promote()
+                elif len(words) == 3 and words[0] == "follow" and words[2].isdigit():
+                    if self.replication_source is not None:
+                        print("A primary with replicas cannot follow another primary.")
+                    else:
+                        self.follow(words[1], int(words[2]))
                 else:
-                    print("Unknown command. Type 'stop' to stop the server.")
+                    print("Unknown command. Type 'stop' to stop the server, 'stats' for stats, 'promote' or 'follow <host> <port>'.")
             except KeyboardInterrupt:
                 print("Shutting down database server.")
                 self.shutdown_event.set()
-        self.save_user_db()
-        self.save_room_db()
-        self.lobby_request_receiver_thread.join()
-        self.msgfmt_passer.close()
+        self.shutdown()
 
     def process_message(self, request_id: str, collection: str, action: str, data: dict) -> None:
+        if self.replica is not None and collection != Words.Collection.REPLICATION:
+            if action not in (Words.Action.QUERY, Words.Action.EXPORT):
+                self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.REASON: Words.Reason.READ_ONLY, Words.DataParamKey.MESSAGE: "This database server is a read-only replica."})
+                return
+            if not self.replica.fresh(self.max_replica_lag):
+                self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.REASON: Words.Reason.REPLICA_UNAVAILABLE, Words.DataParamKey.MESSAGE: "This replica is too far behind its primary."})
+                return
+        if self.sharded:
+            owner = self.owning_shard(collection, data)
+            if owner is not None and owner != self.shard_index:
+                self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.REASON: Words.Reason.WRONG_SHARD, Words.DataParamKey.MESSAGE: f"This request belongs to database shard {owner}, not {self.shard_index}."})
+                return
+        token = None
+        if action == Words.Action.QUERY and collection in VERSIONED_COLLECTIONS and Words.DataParamKey.IF_VERSION_NEWER_THAN in data:
+            data = dict(data)
+            condition = data.pop(Words.DataParamKey.IF_VERSION_NEWER_THAN)
+            version = self.query_version(collection, data)
+            token = self.versions.token(version)
+            if self.versions.unchanged(condition, version):
+                self.send_response(request_id, Words.Result.NOT_MODIFIED, {Words.DataParamKey.VERSION: token})
+                return
+        cache_key = ResponseCache.key_of(collection, action, data)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.send_response(request_id, *cached)
+            else:
+                version = self.versions.of(collection)
+                self.answer(request_id, collection, action, data)
+                outbox = self.request_context.outbox
+                if outbox and outbox[-1][1] in (Words.Result.FOUND, Words.Result.NOT_FOUND):
+                    _, result, response = outbox[-1]
+                    outbox[-1] = (request_id, result, self.response_cache.put(cache_key, version, result, response))
+        else:
+            self.answer(request_id, collection, action, data)
+        outbox = self.request_context.outbox
+        if token is not None and outbox and outbox[-1][1] in (Words.Result.FOUND, Words.Result.NOT_FOUND):
+            _, result, response = outbox[-1]
+            encoded = response if isinstance(response, EncodedJson) else json.dumps(response)
+            outbox[-1] = (request_id, result, EncodedJson(f"{{{json.dumps(Words.DataParamKey.VERSION)}: {json.dumps(token)}, {json.dumps(Words.DataParamKey.RECORDS)}: {encoded}}}"))
+
+    def query_version(self, collection: str, data: dict) -> int:
+        """The version of what a query covers: the record for a lookup by key, the whole collection otherwise."""
+        key_field = Words.DataParamKey.USERNAME if collection == Words.Collection.USER else Words.DataParamKey.ROOM_ID
+        key = data.get(key_field)
+        if not isinstance(key, str):
+            return self.versions.of(collection)
+        with self.reading(collection):
+            record = self.storage.get_user(key) if collection == Words.Collection.USER else self.storage.get_room(key)
+            return self.versions.of_record(collection, key, record is not None)
+
+    def answer(self, request_id: str, collection: str, action: str, data: dict) -> None:
         match collection:
             case Words.Collection.USER:
                 match action:
                     case Words.Action.QUERY:
-                        if Words.DataParamKey.USERNAME in data:
+                        try:
+                            query = Query(data, Words.DataParamKey.USERNAME)
+                        except ValueError as e:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: str(e)})
+                            return
+                        if Words.DataParamKey.USERNAME in data and not is_condition(data[Words.DataParamKey.USERNAME]):
                             username = data.get(Words.DataParamKey.USERNAME)
-                            user_info = self.user_db.get(username)
+                            with self.reading(collection):
+                                user_info = copy.deepcopy(self.storage.get_user(username))
                             if user_info is not None:
-                                self.send_response(request_id, Words.Result.FOUND, user_info)
+                                self.send_response(request_id, Words.Result.FOUND, query.project(user_info))
                             else:
                                 self.send_response(request_id, Words.Result.NOT_FOUND, {})
                         else:
                             # here data may contain other filtering criteria
-                            limited_user_info = {username: user_info for username, user_info in self.user_db.items() \
-                                                  if not any(data.get(key) != user_info.get(key) for key in data.keys())}
+                            snapshot = self.scan_view(collection, query.criteria)
+                            if snapshot is not None:
+                                limited_user_info = query.run(snapshot.get, snapshot.select, USER_FIELD_GETTERS)
+                            else:
+                                limited_user_info = query.run(self.storage.get_user, self.storage.query_users, USER_FIELD_GETTERS)
                             self.send_response(request_id, Words.Result.FOUND, limited_user_info)
                     case Words.Action.CREATE:
                         username = data.get(Words.DataParamKey.USERNAME)
-                        if username in self.user_db:
+                        if not isinstance(username, str) or not username:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "A username is required."})
+                        elif self.storage.get_user(username) is not None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Username already exists."})
                         else:
-                            user_dict = {}
-                            user_dict[Words.DataParamKey.PASSWORD] = data.get(Words.DataParamKey.PASSWORD)
-                            user_dict[Words.DataParamKey.GAMES_PLAYED] = 0
-                            user_dict[Words.DataParamKey.GAMES_WON] = 0
-                            user_dict[Words.DataParamKey.ONLINE] = False
-                            user_dict[Words.DataParamKey.CURRENT_ROOM_ID] = None
-                            self.user_db[username] = user_dict
-                            self.save_user_db()
+                            self.put_user(username, self.new_user(data.get(Words.DataParamKey.PASSWORD)))
                             self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "User created successfully."})
                     case Words.Action.UPDATE:
                         username = data.get(Words.DataParamKey.USERNAME)
-                        if username not in self.user_db:
+                        user_info = self.storage.get_user(username)
+                        if user_info is None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not found."})
                         else:
                             for key, value in data.items():
                                 if key != Words.DataParamKey.USERNAME:
-                                    self.user_db[username][key] = value
+                                    user_info[key] = value
+                            self.put_user(username, user_info)
                             self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "User updated successfully."})
-                        self.save_user_db()
                     case Words.Action.ADD_WIN:
                         username = data.get(Words.DataParamKey.USERNAME)
-                        if username not in self.user_db:
+                        user_info = self.storage.get_user(username)
+                        if user_info is None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not found."})
                         else:
-                            self.user_db[username][Words.DataParamKey.GAMES_WON] += 1
-                            self.user_db[username][Words.DataParamKey.GAMES_PLAYED] += 1
-                            self.save_user_db()
+                            user_info[Words.DataParamKey.GAMES_WON] += 1
+                            user_info[Words.DataParamKey.GAMES_PLAYED] += 1
+                            self.put_user(username, user_info)
                             self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Win recorded successfully."})
                     case Words.Action.ADD_GAME_PLAYED:
                         username = data.get(Words.DataParamKey.USERNAME)
-                        if username not in self.user_db:
+                        user_info = self.storage.get_user(username)
+                        if user_info is None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not found."})
                         else:
-                            self.user_db[username][Words.DataParamKey.GAMES_PLAYED] += 1
-                            self.save_user_db()
+                            user_info[Words.DataParamKey.GAMES_PLAYED] += 1
+                            self.put_user(username, user_info)
                             self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Game played recorded successfully."})
+                    case Words.Action.LOGIN:
+                        username = data.get(Words.DataParamKey.USERNAME)
+                        user_info = self.storage.get_user(username)
+                        if user_info is None or user_info.get(Words.DataParamKey.PASSWORD) != data.get(Words.DataParamKey.PASSWORD):
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.REASON: Words.Reason.INVALID_CREDENTIALS, Words.DataParamKey.MESSAGE: "Incorrect username or password."})
+                        elif user_info.get(Words.DataParamKey.ONLINE):
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.REASON: Words.Reason.ACCOUNT_USING, Words.DataParamKey.MESSAGE: "User already logged in elsewhere."})
+                        else:
+                            user_info[Words.DataParamKey.ONLINE] = True
+                            self.put_user(username, user_info)
+                            self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Login successful."})
+                    case Words.Action.LOGOUT_CLEANUP:
+                        username = data.get(Words.DataParamKey.USERNAME)
+                        user_info = self.storage.get_user(username)
+                        if user_info is None:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not found."})
+                        else:
+                            room_id = user_info.get(Words.DataParamKey.CURRENT_ROOM_ID)
+                            room_info = self.storage.get_room(room_id) if room_id is not None else None
+                            response = {Words.DataParamKey.MESSAGE: "User logged out successfully.", Words.DataParamKey.ROOM_ID: None, Words.DataParamKey.NOW_ROOM_INFO: {}}
+                            if self.sharded:
+                                response[Words.DataParamKey.ROOM_ID] = room_id  # the router takes the user out of it on the room shard
+                            elif room_info is not None and (username in room_info[Words.DataParamKey.USERS] or username in room_info[Words.DataParamKey.SPECTATORS]):
+                                response[Words.DataParamKey.ROOM_ID] = room_id
+                                response[Words.DataParamKey.NOW_ROOM_INFO] = self.remove_user_from_room(room_id, room_info, username)
+                            user_info = self.storage.get_user(username)
+                            user_info[Words.DataParamKey.ONLINE] = False
+                            user_info[Words.DataParamKey.CURRENT_ROOM_ID] = None
+                            self.put_user(username, user_info)
+                            self.send_response(request_id, Words.Result.SUCCESS, response)
+                    case Words.Action.RECORD_RESULT:
+                        players = data.get(Words.DataParamKey.PLAYERS)
+                        winner = data.get(Words.DataParamKey.WINNER)
+                        player_infos = {player: self.storage.get_user(player) for player in players} if isinstance(players, list) and players else {}
+                        if not player_infos or None in player_infos.values():
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "A match needs a list of existing players."})
+                        else:
+                            for player, player_info in player_infos.items():
+                                player_info[Words.DataParamKey.GAMES_PLAYED] += 1
+                                if player == winner:
+                                    player_info[Words.DataParamKey.GAMES_WON] += 1
+                                self.put_user(player, player_info)
+                            entry = self.match_log.append(data)
+                            self.publish_match(entry)
+                            self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MATCH_ID: entry[Words.DataParamKey.MATCH_ID], Words.DataParamKey.MESSAGE: "Match result recorded successfully."})
+                    case Words.Action.BULK_CREATE | Words.Action.BULK_UPDATE:
+                        users = data.get(Words.DataParamKey.USERS)
+                        if not isinstance(users, dict) or not all(isinstance(record, dict) for record in users.values()):
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "users must map usernames to records."})
+                            return
+                        applied = 0
+                        skipped = []  # existing users for bulk_create, missing ones for bulk_update, and users of other shards
+                        for username, record in users.items():
+                            user_info = self.storage.get_user(username) if self.owns_user(username) else None
+                            if not self.owns_user(username) or (user_info is None) == (action == Words.Action.BULK_UPDATE):
+                                skipped.append(username)
+                                continue
+                            if user_info is None:
+                                user_info = self.new_user(record.get(Words.DataParamKey.PASSWORD))
+                            user_info.update(record)
+                            self.put_user(username, user_info)
+                            applied += 1
+                        count_key = Words.DataParamKey.CREATED if action == Words.Action.BULK_CREATE else Words.DataParamKey.UPDATED
+                        self.send_response(request_id, Words.Result.SUCCESS, {count_key: applied, Words.DataParamKey.SKIPPED: skipped, Words.DataParamKey.MESSAGE: f"{applied} users {count_key}."})
+                    case Words.Action.EXPORT:
+                        try:
+                            limit = min(self.number_param(data, Words.DataParamKey.LIMIT, self.MAX_EXPORT_PAGE), self.MAX_EXPORT_PAGE)
+                            cursor = data.get(Words.DataParamKey.CURSOR)
+                            if cursor is not None and not isinstance(cursor, str):
+                                raise ValueError("cursor must be a username.")
+                        except ValueError as e:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: str(e)})
+                            return
+                        snapshot = self.scan_view(collection, {})
+                        if snapshot is not None:
+                            rows = snapshot.after(cursor, limit)
+                        else:
+                            rows = self.storage.users_after(cursor, limit)
+                        page = {}
+                        size = 0
+                        for username, user_info in rows:
+                            size += len(json.dumps(username)) + len(json.dumps(user_info)) + 4  # ": " and ", " around each entry
+                            if page and size > self.EXPORT_PAGE_BYTES:
+                                break
+                            page[username] = user_info
+                        more = len(page) < len(rows) or len(rows) == limit
+                        self.send_response(request_id, Words.Result.FOUND, {Words.DataParamKey.USERS: page, Words.DataParamKey.NEXT_CURSOR: next(reversed(page)) if more and page else None})
+                    case Words.Action.CLAIM_ROOM:
+                        username = data.get(Words.DataParamKey.USERNAME)
+                        room_id = data.get(Words.DataParamKey.ROOM_ID)
+                        user_info = self.storage.get_user(username)
+                        if user_info is None:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not found."})
+                        elif user_info[Words.DataParamKey.CURRENT_ROOM_ID] == room_id:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User already in room."})
+                        elif user_info[Words.DataParamKey.CURRENT_ROOM_ID] is not None:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User already in another room."})
+                        elif user_info[Words.DataParamKey.ONLINE] is False:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User is not online."})
+                        else:
+                            user_info[Words.DataParamKey.CURRENT_ROOM_ID] = room_id
+                            self.put_user(username, user_info)
+                            self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Room claimed successfully."})
+                    case Words.Action.RELEASE_ROOM:
+                        username = data.get(Words.DataParamKey.USERNAME)
+                        user_info = self.storage.get_user(username)
+                        if user_info is None:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not found."})
+                        else:
+                            if user_info[Words.DataParamKey.CURRENT_ROOM_ID] == data.get(Words.DataParamKey.ROOM_ID):
+                                user_info[Words.DataParamKey.CURRENT_ROOM_ID] = None
+                                self.put_user(username, user_info)
+                            self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Room released successfully."})
                     case _:
                         self.send_response(request_id, Words.Result.ERROR, {Words.DataParamKey.MESSAGE: f"Unknown action: {action}"})
             case Words.Collection.ROOM:
                 match action:
                     case Words.Action.QUERY:
+                        try:
+                            query = Query(data, Words.DataParamKey.ROOM_ID)
+                        except ValueError as e:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: str(e)})
+                            return
                         if not data:
-                            all_room_info = {room_id: info for room_id, info in self.room_db.items()}
+                            snapshot = self.scan_view(collection, {})
+                            all_room_info = dict(snapshot.items() if snapshot is not None else self.storage.iter_rooms())
                             self.send_response(request_id, Words.Result.FOUND, all_room_info)
-                        elif Words.DataParamKey.ROOM_ID in data:
+                        elif Words.DataParamKey.ROOM_ID in data and not is_condition(data[Words.DataParamKey.ROOM_ID]):
                             room_id = data.get(Words.DataParamKey.ROOM_ID)
-                            room_info = self.room_db.get(room_id)
+                            with self.reading(collection):
+                                room_info = copy.deepcopy(self.storage.get_room(room_id))
                             if room_info is not None:
-                                self.send_response(request_id, Words.Result.FOUND, room_info)
+                                self.send_response(request_id, Words.Result.FOUND, query.project(room_info))
                             else:
                                 self.send_response(request_id, Words.Result.NOT_FOUND, {})
                         else:
                             # here data may contain other filtering criteria
-                            limited_room_info = {room_id: room_info for room_id, room_info in self.room_db.items() \
-                                                  if all(data.get(key) == room_info.get(key) for key in data.keys())}
+                            snapshot = self.scan_view(collection, query.criteria)
+                            if snapshot is not None:
+                                limited_room_info = query.run(snapshot.get, snapshot.select, ROOM_FIELD_GETTERS)
+                            else:
+                                limited_room_info = query.run(self.storage.get_room, self.storage.query_rooms, ROOM_FIELD_GETTERS)
                             self.send_response(request_id, Words.Result.FOUND, limited_room_info)
                     case Words.Action.CREATE:
                         owner = data.get(Words.DataParamKey.OWNER)
                         settings = data.get(Words.DataParamKey.SETTINGS, {})
                         users = [owner]
-                        room_id = 0
-                        while str(room_id) in self.room_db:
-                            room_id += 1
-                        room_id_str = str(room_id)
+                        room_id_str = self.storage.allocate_room_id()
                         room_info = {
                             Words.DataParamKey.OWNER: owner,
                             Words.DataParamKey.SETTINGS: settings,
@@ -165,18 +698,18 @@ class DatabaseServer:
                             Words.DataParamKey.USERS: users,
                             Words.DataParamKey.SPECTATORS: []
                         }
-                        self.room_db[room_id_str] = room_info
-                        self.save_room_db()
-                        self.user_db[owner][Words.DataParamKey.CURRENT_ROOM_ID] = room_id_str
-                        self.save_user_db()
+                        self.put_room(room_id_str, room_info)
+                        if not self.sharded:
+                            owner_info = self.storage.get_user(owner)
+                            owner_info[Words.DataParamKey.CURRENT_ROOM_ID] = room_id_str
+                            self.put_user(owner, owner_info)
                         self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.ROOM_ID: room_id_str, Words.DataParamKey.MESSAGE: "Room created successfully."})
                     case Words.Action.DELETE:
                         room_id = data.get(Words.DataParamKey.ROOM_ID)
-                        if room_id not in self.room_db:
+                        if self.storage.get_room(room_id) is None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Room not found."})
                         else:
-                            del self.room_db[room_id]
-                            self.save_room_db()
+                            self.delete_room(room_id)
                             self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Room deleted successfully."})
                     case Words.Action.ADD_USER:
                         room_id = None
@@ -186,94 +719,167 @@ class DatabaseServer:
                         if Words.DataParamKey.ROOM_ID in data:
                             room_id = data.get(Words.DataParamKey.ROOM_ID)
                             username = data.get(Words.DataParamKey.USERNAME)
+                            inviter_username = data.get(Words.DataParamKey.INVITER_USERNAME)  # set by the shard router for invites
                         else:
                             inviter_username = data.get(Words.DataParamKey.INVITER_USERNAME)
                             invitee_username = data.get(Words.DataParamKey.INVITEE_USERNAME)
-                            room_id = self.user_db[inviter_username][Words.DataParamKey.CURRENT_ROOM_ID]
+                            room_id = self.storage.get_user(inviter_username)[Words.DataParamKey.CURRENT_ROOM_ID]
                             username = invitee_username
 
-                        room_info = self.room_db.get(room_id)
-                        
+                        room_info = self.storage.get_room(room_id)
+                        user_info = self.storage.get_user(username) if not self.sharded else None  # sharded: claimed on its shard
+
                         if room_info is None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Room not found."})
                         elif username in room_info[Words.DataParamKey.USERS]:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User already in room."})
-                        elif self.user_db[username][Words.DataParamKey.CURRENT_ROOM_ID] is not None:
+                        elif user_info is not None and user_info[Words.DataParamKey.CURRENT_ROOM_ID] is not None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User already in another room."})
                         elif len(room_info[Words.DataParamKey.USERS]) == 2: # this is a 2-player game room
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Room is full."})
-                        elif self.user_db[username][Words.DataParamKey.ONLINE] is False:
+                        elif user_info is not None and user_info[Words.DataParamKey.ONLINE] is False:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User is not online."})
                         elif inviter_username is not None and inviter_username not in room_info[Words.DataParamKey.USERS]:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Inviter is not in the room."})
                         else:
                             # room_info[Words.DataParamKey.ROOM_ID] = room_id  # include room_id in the info sent back
                             room_info[Words.DataParamKey.USERS].append(username)
-                            self.save_room_db()
-                            self.user_db[username][Words.DataParamKey.CURRENT_ROOM_ID] = room_id
-                            self.save_user_db()
+                            self.put_room(room_id, room_info)
+                            if user_info is not None:
+                                user_info[Words.DataParamKey.CURRENT_ROOM_ID] = room_id
+                                self.put_user(username, user_info)
                             self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "User added to room successfully.", Words.DataParamKey.ROOM_ID: room_id, Words.DataParamKey.NOW_ROOM_INFO: room_info})
                     case Words.Action.ADD_SPECTATOR:
                         room_id = data.get(Words.DataParamKey.ROOM_ID)
                         username = data.get(Words.DataParamKey.USERNAME)
-                        room_info = self.room_db.get(room_id)
+                        room_info = self.storage.get_room(room_id)
+                        user_info = self.storage.get_user(username) if not self.sharded else None  # sharded: claimed on its shard
                         if room_info is None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Room not found."})
                         elif username in room_info[Words.DataParamKey.SPECTATORS]:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User already spectating in room."})
-                        elif self.user_db[username][Words.DataParamKey.CURRENT_ROOM_ID] is not None:
+                        elif user_info is not None and user_info[Words.DataParamKey.CURRENT_ROOM_ID] is not None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User already in another room."})
-                        elif self.user_db[username][Words.DataParamKey.ONLINE] is False:
+                        elif user_info is not None and user_info[Words.DataParamKey.ONLINE] is False:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User is not online."})
                         else:
                             room_info[Words.DataParamKey.SPECTATORS].append(username)
-                            self.save_room_db()
-                            self.user_db[username][Words.DataParamKey.CURRENT_ROOM_ID] = room_id
-                            self.save_user_db()
+                            self.put_room(room_id, room_info)
+                            if user_info is not None:
+                                user_info[Words.DataParamKey.CURRENT_ROOM_ID] = room_id
+                                self.put_user(username, user_info)
                             self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "User added as spectator to room successfully.", Words.DataParamKey.ROOM_ID: room_id, Words.DataParamKey.NOW_ROOM_INFO: room_info})
                     case Words.Action.REMOVE_USER:
                         room_id = data.get(Words.DataParamKey.ROOM_ID)
                         username = data.get(Words.DataParamKey.USERNAME)
-                        room_info = self.room_db.get(room_id)
+                        room_info = self.storage.get_room(room_id)
                         if room_info is None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Room not found."})
                         elif username not in room_info[Words.DataParamKey.USERS] and username not in room_info[Words.DataParamKey.SPECTATORS]:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not in room."})
                         else:
-                            room_info[Words.DataParamKey.ROOM_ID] = room_id  # include room_id in the info sent back
-                            if username in room_info[Words.DataParamKey.SPECTATORS]:
-                                room_info[Words.DataParamKey.SPECTATORS].remove(username)
-                            else: # username in room_info[Words.DataParamKey.USERS]
-                                room_info[Words.DataParamKey.USERS].remove(username)
-                                if room_info[Words.DataParamKey.OWNER] == username:
-                                    if room_info[Words.DataParamKey.USERS]:
-                                        room_info[Words.DataParamKey.OWNER] = room_info[Words.DataParamKey.USERS][0]
-                                    else: # no users left, delete room
-                                        room_info[Words.DataParamKey.OWNER] = None
-                                        # no user => delete room. But maybe there are spectators?
-                                        for spectator in room_info[Words.DataParamKey.SPECTATORS]:
-                                            self.user_db[spectator][Words.DataParamKey.CURRENT_ROOM_ID] = None
-                                        del self.room_db[room_id]
-                            self.save_room_db()
-                            self.user_db[username][Words.DataParamKey.CURRENT_ROOM_ID] = None
-                            self.save_user_db()
+                            room_info = self.remove_user_from_room(room_id, room_info, username)
                             self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "User removed from room successfully.", Words.DataParamKey.ROOM_ID: room_id, Words.DataParamKey.NOW_ROOM_INFO: room_info})
+                    case Words.Action.START_MATCH:
+                        username = data.get(Words.DataParamKey.USERNAME)
+                        if self.sharded:
+                            user_info = {}  # the router looked the user up on their shard and sends their room
+                            room_id = data.get(Words.DataParamKey.ROOM_ID)
+                        else:
+                            user_info = self.storage.get_user(username)
+                            room_id = user_info.get(Words.DataParamKey.CURRENT_ROOM_ID) if user_info is not None else None
+                        room_info = self.storage.get_room(room_id) if room_id is not None else None
+                        if user_info is None:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not found."})
+                        elif room_info is None:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not in a room."})
+                        elif room_info[Words.DataParamKey.OWNER] != username:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Only the room owner can start the game."})
+                        elif len(room_info[Words.DataParamKey.USERS]) < 2:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Not enough players to start the game."})
+                        elif room_info[Words.DataParamKey.IS_PLAYING]:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.REASON: Words.Reason.GAME_ALREADY_STARTED, Words.DataParamKey.MESSAGE: "The game has already started."})
+                        else:
+                            room_info[Words.DataParamKey.IS_PLAYING] = True
+                            self.put_room(room_id, room_info)
+                            self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.ROOM_ID: room_id, Words.DataParamKey.USERS: room_info[Words.DataParamKey.USERS], Words.DataParamKey.SPECTATORS: room_info[Words.DataParamKey.SPECTATORS]})
                     case Words.Action.UPDATE:
                         room_id = data.get(Words.DataParamKey.ROOM_ID)
-                        room_info = self.room_db.get(room_id)
+                        room_info = self.storage.get_room(room_id)
                         if room_info is None:
                             self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Room not found."})
                         else:
                             for key, value in data.items():
                                 if key != Words.DataParamKey.ROOM_ID:
                                     room_info[key] = value
-                            self.save_room_db()
+                            self.put_room(room_id, room_info)
                             self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Room updated successfully."})
                     case _:
                         self.send_response(request_id, Words.Result.ERROR, {Words.DataParamKey.MESSAGE: f"Unknown action: {action}"})
+            case Words.Collection.GAMELOG:
+                match action:
+                    case Words.Action.CREATE:
+                        players = data.get(Words.DataParamKey.PLAYERS)
+                        if not isinstance(players, list) or not players or not all(isinstance(player, str) for player in players):
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "A match needs a list of players."})
+                        else:
+                            entry = self.match_log.append(data)
+                            self.publish_match(entry)
+                            self.send_response(request_id, Words.Result.SUCCESS, {Words.DataParamKey.MATCH_ID: entry[Words.DataParamKey.MATCH_ID], Words.DataParamKey.MESSAGE: "Match recorded successfully."})
+                    case Words.Action.QUERY:
+                        try:
+                            username = data.get(Words.DataParamKey.USERNAME)
+                            if username is not None and not isinstance(username, str):
+                                raise ValueError("username must be a string.")
+                            limit = min(self.number_param(data, Words.DataParamKey.LIMIT, 20), self.MAX_MATCH_PAGE)
+                            cursor = self.number_param(data, Words.DataParamKey.CURSOR)
+                            since = self.number_param(data, Words.DataParamKey.SINCE, kinds=(int, float))
+                            until = self.number_param(data, Words.DataParamKey.UNTIL, kinds=(int, float))
+                        except ValueError as e:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: str(e)})
+                            return
+                        matches, next_cursor = self.match_log.query(username, limit, cursor, since, until)
+                        self.send_response(request_id, Words.Result.FOUND, {Words.DataParamKey.MATCHES: matches, Words.DataParamKey.NEXT_CURSOR: next_cursor})
+                    case _:
+                        self.send_response(request_id, Words.Result.ERROR, {Words.DataParamKey.MESSAGE: f"Unknown action: {action}"})
+            case Words.Collection.LEADERBOARD:
+                match action:
+                    case Words.Action.QUERY:
+                        try:
+                            board = data.get(Words.DataParamKey.BOARD, BOARD_WINS)
+                            if not isinstance(board, str) or board not in self.leaderboard.boards:
+                                raise ValueError(f"Unknown leaderboard: {board}")
+                            limit = min(self.number_param(data, Words.DataParamKey.LIMIT, 10), self.MAX_LEADERBOARD_PAGE)
+                            username = data.get(Words.DataParamKey.USERNAME)
+                            if username is not None and not isinstance(username, str):
+                                raise ValueError("username must be a string.")
+                            radius = min(self.number_param(data, Words.DataParamKey.RADIUS, 2), self.MAX_LEADERBOARD_PAGE // 2)
+                            record = None
+                            if data.get(Words.DataParamKey.GAMES_WON) is not None:  # a user on any shard: rank and neighbours on this one
+                                record = (self.number_param(data, Words.DataParamKey.GAMES_WON), self.number_param(data, Words.DataParamKey.GAMES_PLAYED, 0))
+                        except ValueError as e:
+                            self.send_response(request_id, Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: str(e)})
+                            return
+                        response = {Words.DataParamKey.BOARD: board, Words.DataParamKey.ENTRIES: self.leaderboard.top(board, limit), Words.DataParamKey.TOTAL: self.leaderboard.size(board)}
+                        if username is not None:
+                            response[Words.DataParamKey.RANK] = self.leaderboard.rank(board, username, record)
+                            response[Words.DataParamKey.AROUND] = self.leaderboard.around(board, username, radius, record)
+                        self.send_response(request_id, Words.Result.FOUND, response)
+                    case _:
+                        self.send_response(request_id, Words.Result.ERROR, {Words.DataParamKey.MESSAGE: f"Unknown action: {action}"})
+            case Words.Collection.REPLICATION:
+                match action:
+                    case Words.Action.QUERY:
+                        self.send_response(request_id, Words.Result.FOUND, {Words.DataParamKey.STATS: self.replication_status()})
+                    case _:
+                        self.send_response(request_id, Words.Result.ERROR, {Words.DataParamKey.MESSAGE: f"Unknown action: {action}"})
             case _:
                 self.send_response(request_id, Words.Result.ERROR, {Words.DataParamKey.MESSAGE: f"Unknown collection: {collection}"})
 
     def send_response(self, request_id: str, result: str, data: dict) -> None:
+        outbox = getattr(self.request_context, "outbox", None)
+        if outbox is not None:
+            outbox.append((request_id, result, data))
+            return
         self.msgfmt_passer.send_args(Protocols.DBToLobby.RESPONSE, request_id, result, data)
         print(f"Sent response: request_id={request_id}, result={result}, data={data}")
@@ -1,3 +1,47 @@
+import argparse
 from database_server import DatabaseServer
-server = DatabaseServer()
-server.start(host="127.0.0.1", port=21354)
\ No newline at end of file
+from database_flusher import DURABILITY_GROUP, DURABILITY_IMMEDIATE, DURABILITY_ASYNC
+from json_storage_engine import JsonStorageEngine, SNAPSHOT_JSON, SNAPSHOT_BINARY
+from sqlite_storage_engine import SqliteStorageEngine, SQLITE_DB_FILE
+from match_log import MatchLog, MATCH_LOG_DIR
+from shard_map import ShardMap
+
+parser = argparse.ArgumentParser(description="Database server for the lobby.")
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=21354)
+parser.add_argument("--engine", choices=["json", "sqlite"], default="json")
+parser.add_argument("--data-dir", default=".", help="directory of the JSON engine's files")
+parser.add_argument("--sqlite-path", default=SQLITE_DB_FILE)
+parser.add_argument("--durability", choices=[DURABILITY_IMMEDIATE, DURABILITY_GROUP, DURABILITY_ASYNC], default=DURABILITY_GROUP)
+parser.add_argument("--reuse-room-ids", action="store_true", help="hand out ids of deleted rooms again before new ones")
+parser.add_argument("--workers", type=int, default=0, help="threads executing requests concurrently (0: one at a time on the receiving thread)")
+parser.add_argument("--match-log-dir", default=MATCH_LOG_DIR)
+parser.add_argument("--plain-user-records", action="store_true", help="keep JSON engine users as plain dicts instead of compact records")
+parser.add_argument("--snapshot-format", choices=[SNAPSHOT_JSON, SNAPSHOT_BINARY], default=SNAPSHOT_JSON,
+                    help="JSON engine user snapshot: json, or binary for a memory-mapped file read lazily (fast startup with many users)")
+parser.add_argument("--user-cache-size", type=int, default=100_000, help="users decoded from a binary snapshot kept in memory")
+parser.add_argument("--replication-port", type=int, default=None, help="as primary (or once promoted), stream writes to replicas connecting on this port")
+parser.add_argument("--replica-of", default=None, metavar="HOST:PORT", help="run as a read replica of the primary replicating on HOST:PORT")
+parser.add_argument("--max-replica-lag", type=float, default=5.0, help="seconds a replica may fall behind before it refuses queries")
+parser.add_argument("--shard-map", default=None, metavar="PATH", help="run as one shard of the database split by this shard map file")
+parser.add_argument("--shard", type=int, default=0, help="index of this shard in the shard map")
+args = parser.parse_args()
+shard_map = ShardMap.load(args.shard_map) if args.shard_map is not None else None
+if shard_map is not None and args.replica_of is not None:
+    parser.error("--shard-map and --replica-of cannot be combined")
+if shard_map is not None and not 0 <= args.shard < shard_map.shard_count:
+    parser.error(f"--shard must be between 0 and {shard_map.shard_count - 1}")
+primary = None
+if args.replica_of is not None:
+    primary_host, _, primary_port = args.replica_of.rpartition(":")
+    primary = (primary_host or "127.0.0.1", int(primary_port))
+
+if args.engine == "sqlite":
+    storage = SqliteStorageEngine(args.sqlite_path, durability=args.durability, reuse_room_ids=args.reuse_room_ids)
+else:
+    storage = JsonStorageEngine(args.data_dir, durability=args.durability, reuse_room_ids=args.reuse_room_ids, compact_users=not args.plain_user_records,
+                                snapshot_format=args.snapshot_format, user_cache_size=args.user_cache_size)
+server = DatabaseServer(storage, workers=args.workers, match_log=MatchLog(args.match_log_dir),
+                        replication_port=args.replication_port, primary=primary, max_replica_lag=args.max_replica_lag,
+                        shard_map=shard_map, shard_index=args.shard)
+server.start(host=args.host, port=args.port)
@@ -0,0 +1,110 @@
+from protocols import Words
+from secondary_index import OPERATORS, is_condition, index_values, record_field, record_matches, value_matches
+from typing import Callable
+import heapq
+
+OPTION_KEYS = (Words.DataParamKey.FIELDS, Words.DataParamKey.EXCLUDE, Words.DataParamKey.SORT, Words.DataParamKey.LIMIT, Words.DataParamKey.COUNT_ONLY)
+
+
+def sort_key(value) -> tuple:
+    """Orders values of any types without raising: numbers, then strings, then other values (lists, objects) grouped
+    by type and compared by their repr, then None."""
+    if value is None:
+        return (3, "", 0)
+    if isinstance(value, (int, float)):
+        return (0, "", value)
+    if isinstance(value, str):
+        return (1, "", value)
+    return (2, type(value).__name__, repr(value))
+
+
+class Query:
+    """A USER or ROOM QUERY: criteria the records must match, and options that shape the response.
+
+    Every key of the request data that is not an option is a criterion on the field of that name, either a value to
+    compare equal or an operator condition such as {"$gte": 5} (see Words.Operator). A criterion on key_field
+    (username or room_id) is matched against the record key. Options:
+        fields: only these top-level fields of each record are returned; exclude: these fields are left out
+        sort: field names, prefixed with "-" for descending order
+        limit: at most this many records
+        count_only: the response is {count: n} instead of the records
+    Raises ValueError for malformed requests."""
+    def __init__(self, data: dict, key_field: str) -> None:
+        self.key_field = key_field
+        self.has_key_condition = key_field in data
+        self.key_condition = data.get(key_field)
+        self.criteria = {field: condition for field, condition in data.items() if field not in OPTION_KEYS and field != key_field}
+        self.fields = data.get(Words.DataParamKey.FIELDS)
+        self.exclude = data.get(Words.DataParamKey.EXCLUDE)
+        self.sort = data.get(Words.DataParamKey.SORT) or []
+        self.limit = data.get(Words.DataParamKey.LIMIT)
+        self.count_only = bool(data.get(Words.DataParamKey.COUNT_ONLY, False))
+        self.validate()
+
+    def validate(self) -> None:
+        conditions = dict(self.criteria)
+        if self.has_key_condition:
+            conditions[self.key_field] = self.key_condition
+        for field, condition in conditions.items():
+            if isinstance(condition, dict) and any(str(key).startswith("$") for key in condition):
+                unknown = [key for key in condition if key not in OPERATORS]
+                if unknown:
+                    raise ValueError(f"Unknown operator {unknown[0]} on {field}.")
+            if is_condition(condition):
+                for operator in (Words.Operator.IN, Words.Operator.NIN):
+                    if operator in condition and not isinstance(condition[operator], list):
+                        raise ValueError(f"{operator} on {field} needs a list.")
+        for option in (self.fields, self.exclude):
+            if option is not None and not (isinstance(option, list) and all(isinstance(field, str) for field in option)):
+                raise ValueError("fields and exclude must be lists of field names.")
+        if self.fields is not None and self.exclude is not None:
+            raise ValueError("Use either fields or exclude, not both.")
+        if not isinstance(self.sort, list) or not all(isinstance(field, str) and field.lstrip("-") for field in self.sort):
+            raise ValueError("sort must be a list of field names.")
+        if self.limit is not None and (isinstance(self.limit, bool) or not isinstance(self.limit, int) or self.limit < 0):
+            raise ValueError("limit must be a non-negative integer.")
+
+    def run(self, get: Callable[[str], dict | None], select: Callable[[dict], dict[str, dict]],
+            field_getters: dict[str, Callable[[dict], object]]) -> dict:
+        """The response data. get fetches one record by key; select returns the records matching some criteria."""
+        keys = index_values(self.key_condition) if self.has_key_condition else None
+        if keys is not None:
+            records = {}
+            for key in dict.fromkeys(keys):
+                record = get(key)
+                if record is not None and record_matches(record, self.criteria, field_getters):
+                    records[key] = record
+        else:
+            records = select(self.criteria)
+            if self.has_key_condition:
+                records = {key: record for key, record in records.items() if value_matches(key, self.key_condition)}
+        return self.shape(records, field_getters)
+
+    def shape(self, records: dict[str, dict], field_getters: dict[str, Callable[[dict], object]]) -> dict:
+        if self.count_only:
+            return {Words.DataParamKey.COUNT: len(records)}
+        rows = list(records.items())
+        if self.sort:
+            def row_key(field: str) -> Callable[[tuple[str, dict]], tuple]:
+                if field == self.key_field:
+                    return lambda row: sort_key(row[0])
+                return lambda row: sort_key(record_field(row[1], field, field_getters))
+
+            if len(self.sort) == 1 and self.limit is not None and self.limit < len(rows):
+                # Top-k without sorting everything.
+                field = self.sort[0]
+                select_rows = heapq.nlargest if field.startswith("-") else heapq.nsmallest
+                rows = select_rows(self.limit, rows, key=row_key(field.lstrip("-")))
+            else:
+                for field in reversed(self.sort):  # stable sorts, least significant field first
+                    rows.sort(key=row_key(field.lstrip("-")), reverse=field.startswith("-"))
+        if self.limit is not None:
+            rows = rows[:self.limit]
+        return {key: self.project(record) for key, record in rows}
+
+    def project(self, record: dict) -> dict:
+        if self.fields is not None:
+            return {field: record[field] for field in self.fields if field in record}
+        if self.exclude is not None:
+            return {field: value for field, value in record.items() if field not in self.exclude}
+        return record
@@ -1,13 +1,13 @@
 from player import Player
-from tetris import Tetris
+from bitboard_tetris import BitboardTetris
 from protocols import Words
 
 class Game:
     def __init__(self, seed: int) -> None:
         self.player1: Player = Player("player1")
         self.player2: Player = Player("player2")
-        self.tetris1: Tetris = Tetris(gravity_time=1.0, seed=seed)
-        self.tetris2: Tetris = Tetris(gravity_time=1.0, seed=seed)
+        self.tetris1: BitboardTetris = BitboardTetris(gravity_time=1.0, seed=seed)
+        self.tetris2: BitboardTetris = BitboardTetris(gravity_time=1.0, seed=seed)
         self.goal_score: int = 50
         self.seed: int = seed
         self.gameover: bool = False
@@ -95,6 +95,6 @@ class Game:
             tetris = self.tetris1
         else:
             tetris = self.tetris2
-        return Tetris.to_board_string(tetris.board)
+        return tetris.board_string()
 
         
\ No newline at end of file
@@ -40,6 +40,7 @@ class GameServer:
         self.player2_ready = threading.Event()
         self.player1_disconnected = threading.Event()
         self.player2_disconnected = threading.Event()
+        self.started_at: float | None = None
         
 
     def wait_until_started(self) -> None:
@@ -303,6 +304,7 @@ class GameServer:
             #                         self.game.goal_score)
             
             print("Both players are ready. Starting the game loop.")
+            self.started_at = time.time()
 
             while self.running.is_set():
                 # Process all queued actions
@@ -328,9 +330,11 @@ class GameServer:
                 # Send updated game state to both players
                 state1 = {
                     'board': self.game.get_board_string("player1"),
-                    'now_piece': self.game.tetris1.now_piece.shape if self.game.tetris1.now_piece else None,
+                    'now_piece': self.game.tetris1.now_piece.type_name if self.game.tetris1.now_piece else None,
+                    'rotation': self.game.tetris1.now_piece.rotation if self.game.tetris1.now_piece else None,
                     'color': self.game.tetris1.now_piece.color if self.game.tetris1.now_piece else None,
                     'position': self.game.tetris1.now_piece.position if self.game.tetris1.now_piece else None,
+                    'landing_row': self.game.tetris1.landing_row(),
                     'next_pieces': [piece.type_name for piece in self.game.tetris1.next_piece_list],
                     'score': self.game.player1.score,
                     'health': self.game.player1.health,
@@ -338,9 +342,11 @@ class GameServer:
                 }
                 state2 = {
                     'board': self.game.get_board_string("player2"),
-                    'now_piece': self.game.tetris2.now_piece.shape if self.game.tetris2.now_piece else None,
+                    'now_piece': self.game.tetris2.now_piece.type_name if self.game.tetris2.now_piece else None,
+                    'rotation': self.game.tetris2.now_piece.rotation if self.game.tetris2.now_piece else None,
                     'color': self.game.tetris2.now_piece.color if self.game.tetris2.now_piece else None,
                     'position': self.game.tetris2.now_piece.position if self.game.tetris2.now_piece else None,
+                    'landing_row': self.game.tetris2.landing_row(),
                     'next_pieces': [piece.type_name for piece in self.game.tetris2.next_piece_list],
                     'score': self.game.player2.score,
                     'health': self.game.player2.health,
@@ -402,6 +408,22 @@ class GameServer:
             print(f"Error in game session: {e}")
         print("Game session ended.")
 
+    def match_record(self) -> dict:
+        """Summary of the finished match for the match history."""
+        usernames = {"player1": self.player1_username, "player2": self.player2_username}
+        players = {"player1": self.game.player1, "player2": self.game.player2}
+        return {
+            Words.DataParamKey.PLAYERS: [self.player1_username, self.player2_username],
+            Words.DataParamKey.WINNER: usernames.get(self.game.winner),
+            Words.DataParamKey.SCORES: {usernames[p]: players[p].score for p in usernames},
+            Words.DataParamKey.DURATION: time.time() - self.started_at if self.started_at is not None else 0.0,
+            Words.DataParamKey.SEED: self.seed,
+            Words.DataParamKey.ROOM_ID: self.room_id,
+            Words.DataParamKey.STATS: {usernames[p]: {"deaths": players[p].death_count,
+                                                      "final_health": players[p].health,
+                                                      "cleared_cells": players[p].cleared_cells_total} for p in usernames},
+        }
+
     def stop(self) -> None:
         self.running.clear()
         try:
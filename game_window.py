@@ -4,7 +4,7 @@ from message_format_passer import MessageFormatPasser
 from protocols import Protocols, Words
 from player_info import PlayerInfo
 from tetris import Tetris
-from piece import Pieces
+from piece import Pieces, PIECE_TEMPLATES
 import threading
 import time
 
@@ -101,7 +101,13 @@ class GameWindow:
                 pygame.draw.rect(self.screen, color, rect) # draw cell
                 pygame.draw.rect(self.screen, (15, 15, 15), rect, 1) # cell border
 
-    def draw_piece(self, shape: list[list[int]], position: tuple[int, int], color_idx: int, topleft: tuple[int, int]):
+    @staticmethod
+    def piece_shape(type_name: str | None, rotation: int | None):
+        if type_name not in PIECE_TEMPLATES or rotation is None:
+            return None
+        return PIECE_TEMPLATES[type_name].shapes[rotation % 4]
+
+    def draw_piece(self, shape: tuple[tuple[int, ...], ...] | None, position: tuple[int, int], color_idx: int, topleft: tuple[int, int]):
         if shape is None or position is None:
             return
         board_cx, board_cy = topleft
@@ -117,6 +123,22 @@ class GameWindow:
                     pygame.draw.rect(self.screen, color, rect)
                     pygame.draw.rect(self.screen, (15, 15, 15), rect, 1)
 
+    def draw_ghost_piece(self, shape: tuple[tuple[int, ...], ...] | None, position: tuple[int, int], color_idx: int, topleft: tuple[int, int]):
+        # outline of where the piece would land if hard dropped
+        if shape is None:
+            return
+        board_cx, board_cy = topleft
+        cell = self.CELL_SIZE
+        pad = self.CELL_PADDING
+        color = self._color_from_index(color_idx or 1)
+        for r in range(len(shape)):
+            for c in range(len(shape[0])):
+                if shape[r][c]:
+                    br = position[0] + r
+                    bc = position[1] + c
+                    rect = (board_cx + bc * cell + pad, board_cy + br * cell + pad, cell - 2*pad, cell - 2*pad)
+                    pygame.draw.rect(self.screen, color, rect, 2)
+
     def draw_next_pieces(self, next_pieces: list[str], topleft: tuple[int, int]):
         if not next_pieces:
             return
@@ -222,8 +244,11 @@ class GameWindow:
                 now_piece1 = state1.get('now_piece')
                 now_piece1_color = state1.get('color', 1)
                 now_piece1_pos = state1.get('position')
-                # now_piece1 is just a list like [[0,1,0],[1,1,1],[0,0,0]]
-                self.draw_piece(now_piece1, now_piece1_pos, now_piece1_color, board_left)
+                # now_piece1 is a piece type like "T", drawn in its rotation state
+                now_piece1_shape = self.piece_shape(now_piece1, state1.get('rotation'))
+                if now_piece1_pos is not None and state1.get('landing_row') is not None:
+                    self.draw_ghost_piece(now_piece1_shape, (state1['landing_row'], now_piece1_pos[1]), now_piece1_color, board_left)
+                self.draw_piece(now_piece1_shape, now_piece1_pos, now_piece1_color, board_left)
                 self.draw_next_pieces(state1.get('next_pieces'), (20 + 10 * self.CELL_SIZE, 50))
 
                 board_rows = len(p1_board.splitlines())
@@ -247,7 +272,10 @@ class GameWindow:
                 now_piece2 = state2.get('now_piece')
                 now_piece2_color = state2.get('color', 1)
                 now_piece2_pos = state2.get('position')
-                self.draw_piece(now_piece2, now_piece2_pos, now_piece2_color, board_right)
+                now_piece2_shape = self.piece_shape(now_piece2, state2.get('rotation'))
+                if now_piece2_pos is not None and state2.get('landing_row') is not None:
+                    self.draw_ghost_piece(now_piece2_shape, (state2['landing_row'], now_piece2_pos[1]), now_piece2_color, board_right)
+                self.draw_piece(now_piece2_shape, now_piece2_pos, now_piece2_color, board_right)
                 self.draw_next_pieces(state2.get('next_pieces'), (420 + 10 * self.CELL_SIZE, 50))
 
                 board_rows = len(p2_board.splitlines())
@@ -0,0 +1,241 @@
+from storage_engine import StorageEngine, USER_FIELD_GETTERS, ROOM_FIELD_GETTERS, META_COLLECTION, ROOM_ID_ALLOCATOR_KEY
+from secondary_index import QueryPlanner
+from scan_snapshot import ScanSnapshot, SnapshotRegistry
+from compact_records import CompactUserStore
+from lazy_user_store import LazyUserStore
+from protocols import Words
+from write_ahead_log import WriteAheadLog, atomic_write_json, FSYNC_ALWAYS
+from database_flusher import DURABILITY_GROUP
+from typing import Callable, Iterator, MutableMapping
+import copy
+import heapq
+import json
+import threading
+import time
+import os
+
+USER_DB_FILE = 'user_db.json'
+ROOM_DB_FILE = 'room_db.json'
+META_FILE = 'db_meta.json'
+WAL_FILE = 'db_wal.log'
+USER_SNAPSHOT_FILE = 'user_db.snap'
+
+SNAPSHOT_JSON = "json"
+SNAPSHOT_BINARY = "binary"  # users in a memory-mapped binary snapshot, decoded on first access
+
+
+class JsonStorageEngine(StorageEngine):
+    """Keeps both collections in memory as dicts.
+
+    Every mutation is appended to a write-ahead log. The JSON files are snapshots, rewritten (atomically) only when the
+    log grows past snapshot_wal_bytes, every snapshot_interval seconds, and on shutdown. On startup the log is replayed onto the snapshots.
+    Filtered queries go through secondary indexes on online and current_room_id (users) and is_playing and privacy (rooms).
+    With compact_users (the default) users are held in a CompactUserStore instead of a dict of dicts.
+
+    With snapshot_format "binary" users are snapshotted to user_db.snap instead and read through a LazyUserStore, so
+    startup does not decode them; the user indexes (and the server's leaderboard) are built in the background, queries
+    scanning until they are ready. Rooms stay in JSON. The first start in this format converts user_db.json.
+
+    Scans can read a ScanSnapshot (open_snapshot) instead of holding the collection lock. While one is open, writes
+    preserve the records they replace for it, and get_user/get_room return copies of records that are stored as live
+    dicts (rooms, and users without compact_users), so callers changing them in place cannot reach the snapshot. The
+    binary snapshot format has no scan snapshots: its store reorganizes itself on save() and must be read locked."""
+    def __init__(self, data_dir: str = ".", fsync_policy: str = FSYNC_ALWAYS, fsync_interval: float = 1.0, snapshot_interval: float = 300.0,
+                 snapshot_wal_bytes: int = 4 * 1024 * 1024, durability: str = DURABILITY_GROUP, flush_interval: float = 0.01, max_dirty: int = 512,
+                 reuse_room_ids: bool = False, compact_users: bool = True, snapshot_format: str = SNAPSHOT_JSON, user_cache_size: int = 100_000) -> None:
+        super().__init__(durability, flush_interval, max_dirty, reuse_room_ids)
+        self.user_db_file = os.path.join(data_dir, USER_DB_FILE)
+        self.room_db_file = os.path.join(data_dir, ROOM_DB_FILE)
+        self.meta_file = os.path.join(data_dir, META_FILE)
+        self.wal_file = os.path.join(data_dir, WAL_FILE)
+        self.lazy_users = snapshot_format == SNAPSHOT_BINARY
+        self.snapshot_scans = not self.lazy_users
+        self.snapshots = SnapshotRegistry()
+        converted = False
+        if self.lazy_users:
+            self.user_db: MutableMapping[str, dict] = LazyUserStore(os.path.join(data_dir, USER_SNAPSHOT_FILE), user_cache_size)
+            if self.user_db.base is None and os.path.exists(self.user_db_file):
+                for username, user_info in self.load_json(self.user_db_file, {}).items():
+                    self.user_db[username] = user_info
+                converted = True
+        else:
+            self.user_db = self.load_json(self.user_db_file, {})
+            if compact_users:
+                self.user_db = CompactUserStore(self.user_db)
+        self.room_db: dict[str, dict] = self.load_json(self.room_db_file, {})
+        meta = self.load_json(self.meta_file, {})
+        self.snapshot_lsn = meta.get("lsn", 0)
+        self.room_ids.load(meta.get(ROOM_ID_ALLOCATOR_KEY))
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_wal_bytes = snapshot_wal_bytes
+        replayed_lsn = self.replay_wal()
+        self.wal = WriteAheadLog(self.wal_file, fsync_policy, fsync_interval, start_lsn=replayed_lsn)
+        self.user_planner = QueryPlanner(self.user_db, [Words.DataParamKey.ONLINE, Words.DataParamKey.CURRENT_ROOM_ID], USER_FIELD_GETTERS, build=not self.lazy_users)
+        self.room_planner = QueryPlanner(self.room_db, [Words.DataParamKey.IS_PLAYING, Words.DataParamKey.PRIVACY], ROOM_FIELD_GETTERS)
+        self.last_snapshot_time = time.time()
+        if replayed_lsn > self.snapshot_lsn or converted:
+            self.save_snapshot()
+        if self.lazy_users:
+            threading.Thread(target=self.warm_user_view, args=(self.user_planner.load, self.user_planner.refresh, self.user_planner.mark_ready),
+                             name="user-index-warmup", daemon=True).start()
+
+    @staticmethod
+    def load_json(path: str, default):
+        if not os.path.exists(path):
+            return default
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def replay_wal(self) -> int:
+        """Apply logged mutations newer than the snapshot. Returns the last LSN seen."""
+        last_lsn = self.snapshot_lsn
+        replayed = 0
+        for entry in WriteAheadLog.read_entries(self.wal_file):
+            last_lsn = max(last_lsn, entry["lsn"])
+            if entry["lsn"] <= self.snapshot_lsn:
+                continue
+            if entry["collection"] == META_COLLECTION:
+                if entry["key"] == ROOM_ID_ALLOCATOR_KEY:
+                    self.room_ids.load(entry["value"])
+                replayed += 1
+                continue
+            db = self.user_db if entry["collection"] == Words.Collection.USER else self.room_db
+            if entry["value"] is None:
+                db.pop(entry["key"], None)
+            else:
+                db[entry["key"]] = entry["value"]
+            replayed += 1
+        if replayed:
+            print(f"Replayed {replayed} write-ahead log entries.")
+        return last_lsn
+
+    def save_snapshot(self) -> None:
+        """Write both collections atomically, then the LSN they include, then empty the log."""
+        self.flusher.flush()
+        with self.flusher.io_lock, self.lock:
+            if self.lazy_users:
+                self.user_db.save()
+            else:
+                atomic_write_json(self.user_db_file, self.user_db)
+            atomic_write_json(self.room_db_file, self.room_db)
+            atomic_write_json(self.meta_file, {"lsn": self.wal.last_lsn, ROOM_ID_ALLOCATOR_KEY: self.room_ids.state})
+            self.snapshot_lsn = self.wal.last_lsn
+            self.wal.reset()
+            self.last_snapshot_time = time.time()
+
+    def maintenance(self) -> None:
+        with self.flusher.io_lock:
+            self.wal.sync_if_due()
+            wal_size = self.wal.size()
+        if wal_size == 0:
+            return
+        if wal_size >= self.snapshot_wal_bytes or time.time() - self.last_snapshot_time >= self.snapshot_interval:
+            self.save_snapshot()
+
+    def warm_user_view(self, load: Callable[[Iterator[tuple[str, dict]]], None], refresh: Callable[[str, dict | None], None],
+                       done: Callable[[], None] | None = None) -> None:
+        if not self.lazy_users:
+            super().warm_user_view(load, refresh, done)
+            return
+        # Read the snapshot without the lock, then catch up on what changed meanwhile under it.
+        with self.lock.hold(write=(Words.Collection.USER,)):
+            base, tracker = self.user_db.start_tracking()
+        try:
+            load(LazyUserStore.base_items(base))
+        finally:
+            with self.lock.hold(write=(Words.Collection.USER,)):
+                changed = self.user_db.stop_tracking(tracker)
+                for username in changed:
+                    refresh(username, self.user_db.get(username))
+                if done is not None:
+                    done()
+
+    def get_user(self, username: str) -> dict | None:
+        user_info = self.user_db.get(username)
+        if user_info is not None and type(self.user_db) is dict and self.snapshots.active(Words.Collection.USER):
+            return copy.deepcopy(user_info)
+        return user_info
+
+    def put_user(self, username: str, user_info: dict) -> None:
+        self.snapshots.preserve(Words.Collection.USER, username, self.user_db)
+        self.user_db[username] = user_info
+        self.user_planner.update(username, user_info)
+        self.mark_dirty(Words.Collection.USER, username, user_info)
+
+    def delete_user(self, username: str) -> None:
+        self.snapshots.preserve(Words.Collection.USER, username, self.user_db)
+        del self.user_db[username]
+        self.user_planner.remove(username)
+        self.mark_dirty(Words.Collection.USER, username, None)
+
+    def query_users(self, criteria: dict) -> dict[str, dict]:
+        return self.user_planner.query(criteria)
+
+    def iter_users(self) -> Iterator[tuple[str, dict]]:
+        return iter(self.user_db.items())
+
+    def users_after(self, cursor: str | None, limit: int) -> list[tuple[str, dict]]:
+        # Select on the keys alone; only the page's records are read.
+        usernames = heapq.nsmallest(limit, (username for username in self.user_db if cursor is None or username > cursor))
+        return [(username, self.user_db[username]) for username in usernames]
+
+    def get_room(self, room_id: str) -> dict | None:
+        room_info = self.room_db.get(room_id)
+        if room_info is not None and self.snapshots.active(Words.Collection.ROOM):
+            return copy.deepcopy(room_info)
+        return room_info
+
+    def put_room(self, room_id: str, room_info: dict) -> None:
+        self.snapshots.preserve(Words.Collection.ROOM, room_id, self.room_db)
+        self.room_db[room_id] = room_info
+        self.room_planner.update(room_id, room_info)
+        self.mark_dirty(Words.Collection.ROOM, room_id, room_info)
+
+    def delete_room(self, room_id: str) -> None:
+        self.snapshots.preserve(Words.Collection.ROOM, room_id, self.room_db)
+        del self.room_db[room_id]
+        self.room_planner.remove(room_id)
+        self.mark_dirty(Words.Collection.ROOM, room_id, None)
+        self.release_room_id(room_id)
+
+    def query_rooms(self, criteria: dict) -> dict[str, dict]:
+        return self.room_planner.query(criteria)
+
+    def iter_rooms(self) -> Iterator[tuple[str, dict]]:
+        return iter(self.room_db.items())
+
+    def open_snapshot(self, collection: str, criteria: dict) -> ScanSnapshot:
+        if collection == Words.Collection.USER:
+            records, planner, field_getters = self.user_db, self.user_planner, USER_FIELD_GETTERS
+        else:
+            records, planner, field_getters = self.room_db, self.room_planner, ROOM_FIELD_GETTERS
+        candidates = planner.candidate_keys(criteria)
+        keys = list(candidates if candidates is not None else records)
+        planner.count(candidates is not None, len(keys))
+        snapshot = ScanSnapshot(collection, records, keys, field_getters)
+        self.snapshots.add(snapshot)
+        return snapshot
+
+    def close_snapshot(self, snapshot: ScanSnapshot) -> None:
+        self.snapshots.remove(snapshot)
+
+    def prepare_batch(self, batch: list[tuple[str, str, dict | None]]) -> str:
+        return self.wal.encode_batch(batch)
+
+    def write_batch(self, prepared: str) -> int:
+        return self.wal.write(prepared)
+
+    def close(self) -> None:
+        super().close()
+        self.save_snapshot()
+        self.wal.close()
+        if self.lazy_users:
+            self.user_db.close()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({"users": len(self.user_db), "rooms": len(self.room_db), "wal_bytes": self.wal.size(), "snapshot_lsn": self.snapshot_lsn,
+                      "user_queries": self.user_planner.stats(), "room_queries": self.room_planner.stats(), "scan_snapshots": self.snapshots.stats()})
+        if self.lazy_users:
+            stats["user_snapshot"] = self.user_db.stats()
+        return stats
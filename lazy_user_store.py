@@ -0,0 +1,175 @@
+from binary_snapshot import BinarySnapshot, BinarySnapshotWriter
+from collections.abc import MutableMapping
+from compact_records import CompactUserStore
+from typing import Iterator
+import json
+import os
+import threading
+
+
+def encode_record(record: dict) -> bytes:
+    return json.dumps(record, separators=(",", ":")).encode("utf-8")
+
+
+class LazyUserStore(MutableMapping):
+    """username -> user dict over a memory-mapped BinarySnapshot, decoding records only when they are read.
+
+    Users written since the snapshot live in dirty, deleted ones in deleted; both win over the snapshot. Records read
+    from the snapshot are promoted to a bounded cache (least recently used first out), so hot users are decoded once.
+    Opening the store costs the same at any size. save() writes a new snapshot that folds dirty and deleted in.
+
+    Like CompactUserStore, reads return fresh dicts. Callers hold the engine's user lock; base_items() is the exception
+    and may run without it, which is how views of all users (indexes, the leaderboard) are built in the background:
+    start_tracking(), base_items() without the lock, then stop_tracking() names the users to look at again."""
+    def __init__(self, path: str, cache_size: int = 100_000) -> None:
+        self.path = path
+        self.cache_size = cache_size
+        self.base = BinarySnapshot(path) if os.path.exists(path) else None
+        self.dirty = CompactUserStore()
+        self.cache = CompactUserStore()
+        self.deleted: set[str] = set()
+        self.count = self.base.count if self.base is not None else 0
+        self.retired: list[BinarySnapshot] = []  # replaced snapshots, possibly still read by base_items()
+        self.trackers: list[set[str]] = []
+        self.cache_lock = threading.Lock()  # readers share the user lock but all move records around in the cache
+        self.cache_hits = 0
+        self.snapshot_reads = 0
+
+    def read_base(self, username: str) -> dict | None:
+        if self.base is None or username in self.deleted:
+            return None
+        encoded = self.base.lookup(username)
+        return json.loads(encoded) if encoded is not None else None
+
+    def __getitem__(self, username: str) -> dict:
+        if username in self.dirty:
+            return self.dirty[username]
+        with self.cache_lock:
+            row = self.cache.rows.pop(username, None)
+            if row is not None:
+                self.cache.rows[username] = row  # most recently used goes last
+                self.cache_hits += 1
+                return row.unpack()
+        record = self.read_base(username)
+        if record is None:
+            raise KeyError(username)
+        with self.cache_lock:
+            self.snapshot_reads += 1
+            self.cache[username] = record
+            if len(self.cache) > self.cache_size:
+                del self.cache.rows[next(iter(self.cache.rows))]
+        return record
+
+    def __contains__(self, username) -> bool:
+        if username in self.dirty or username in self.cache:
+            return True
+        return self.base is not None and username not in self.deleted and self.base.lookup(username) is not None
+
+    def __setitem__(self, username: str, user_info: dict) -> None:
+        if username not in self:
+            self.count += 1
+        self.dirty[username] = user_info
+        self.deleted.discard(username)
+        for tracker in self.trackers:
+            tracker.add(username)
+        with self.cache_lock:
+            self.cache.rows.pop(username, None)
+
+    def __delitem__(self, username: str) -> None:
+        if username not in self:
+            raise KeyError(username)
+        self.dirty.rows.pop(username, None)
+        with self.cache_lock:
+            self.cache.rows.pop(username, None)
+        self.deleted.add(username)
+        self.count -= 1
+        for tracker in self.trackers:
+            tracker.add(username)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[str]:
+        for username, _ in self.items():
+            yield username
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        """Every user, the changed ones first, without promoting anything to the cache."""
+        yield from self.dirty.items()
+        if self.base is None:
+            return
+        for key, encoded in self.base.items():
+            username = key.decode("utf-8")
+            if username not in self.dirty and username not in self.deleted:
+                yield username, json.loads(encoded)
+
+    def start_tracking(self) -> tuple[BinarySnapshot | None, set[str]]:
+        """The current snapshot, and a set that collects the users that differ from it: those changed since it was
+        saved and, until stop_tracking(), every user written or deleted from now on."""
+        tracker = set(self.dirty) | self.deleted
+        self.trackers.append(tracker)
+        return self.base, tracker
+
+    def stop_tracking(self, tracker: set[str]) -> set[str]:
+        self.trackers.remove(tracker)
+        self.close_retired()
+        return tracker
+
+    def close_retired(self) -> None:
+        """Unmap replaced snapshots once no background reader can still be using them, freeing their disk space."""
+        if not self.trackers:
+            for snapshot in self.retired:
+                snapshot.close()
+            self.retired = []
+
+    @staticmethod
+    def base_items(base: BinarySnapshot | None) -> Iterator[tuple[str, dict]]:
+        """Every user in a snapshot from start_tracking(), as it was saved. Safe without the user lock, even across
+        save(): replaced snapshots stay mapped until close()."""
+        if base is None:
+            return
+        for key, encoded in base.items():
+            yield key.decode("utf-8"), json.loads(encoded)
+
+    def save(self) -> None:
+        """Fold dirty and deleted into a new snapshot. Unchanged records between changed ones are copied as raw runs."""
+        writer = BinarySnapshotWriter(self.path)
+        changed = sorted(username.encode("utf-8") for username in self.dirty.rows.keys() | self.deleted)
+        position = 0
+        for key in changed:
+            if self.base is not None:
+                stop = self.base.position(key)
+                writer.copy(self.base, position, stop)
+                position = stop
+                if stop < self.base.count and self.base.key(stop) == key:
+                    position += 1  # replaced or deleted
+            username = key.decode("utf-8")
+            if username in self.dirty:
+                writer.add(key, encode_record(self.dirty[username]))
+        if self.base is not None:
+            writer.copy(self.base, position, self.base.count)
+        writer.finish()
+        if self.base is not None:
+            self.retired.append(self.base)
+        self.base = BinarySnapshot(self.path)
+        self.close_retired()
+        with self.cache_lock:
+            for username, row in self.dirty.rows.items():
+                self.cache.rows[username] = row  # just written, likely to be read again
+            while len(self.cache) > self.cache_size:
+                del self.cache.rows[next(iter(self.cache.rows))]
+        self.dirty = CompactUserStore()
+        self.deleted = set()
+
+    def stats(self) -> dict:
+        reads = self.cache_hits + self.snapshot_reads
+        return {
+            "snapshot_users": self.base.count if self.base is not None else 0,
+            "dirty_users": len(self.dirty),
+            "cached_users": len(self.cache),
+            "cache_hit_rate": self.cache_hits / reads if reads else 0.0,
+        }
+
+    def close(self) -> None:
+        for snapshot in self.retired + ([self.base] if self.base is not None else []):
+            snapshot.close()
@@ -0,0 +1,247 @@
+from protocols import Words
+import random
+import threading
+
+BOARD_WINS = "wins"
+BOARD_WIN_RATE = "win_rate"
+MIN_RATED_GAMES = 5  # games a user must have played to appear on the win rate board
+
+
+class _Infinity:
+    """Sorts after every key; the value of the skip list's tail sentinel."""
+    def __lt__(self, other) -> bool:
+        return False
+
+    def __le__(self, other) -> bool:
+        return self is other
+
+    def __gt__(self, other) -> bool:
+        return self is not other
+
+    def __ge__(self, other) -> bool:
+        return True
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, next_nodes: list, widths: list) -> None:
+        self.key = key
+        self.next = next_nodes
+        self.width = widths  # width[level]: how many positions next[level] is ahead of this node
+
+
+class IndexableSkipList:
+    """Sorted collection of distinct keys with O(log n) insert, remove, rank and access by position.
+
+    Each forward pointer also stores how many elements it skips, so walking down from the top level can count
+    positions as it goes."""
+    MAX_LEVELS = 24  # enough for tens of millions of keys at p = 1/2
+
+    def __init__(self, seed: int | None = None) -> None:
+        self.size = 0
+        self.rng = random.Random(seed)
+        self.tail = _Node(_Infinity(), [], [])
+        self.head = _Node(None, [self.tail] * self.MAX_LEVELS, [1] * self.MAX_LEVELS)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVELS and self.rng.random() < 0.5:
+            level += 1
+        return level
+
+    def build(self, keys: list) -> None:
+        """Replace the contents with keys, which must be sorted and distinct. O(n), unlike n inserts."""
+        self.tail = _Node(self.tail.key, [], [])
+        self.head = _Node(None, [self.tail] * self.MAX_LEVELS, [1] * self.MAX_LEVELS)
+        last = [self.head] * self.MAX_LEVELS
+        last_position = [0] * self.MAX_LEVELS
+        for position, key in enumerate(keys, 1):
+            height = self.random_level()
+            node = _Node(key, [self.tail] * height, [0] * height)
+            for level in range(height):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+        for level in range(self.MAX_LEVELS):
+            last[level].width[level] = len(keys) + 1 - last_position[level]
+        self.size = len(keys)
+
+    def insert(self, key) -> None:
+        chain = [None] * self.MAX_LEVELS
+        steps_at_level = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        height = self.random_level()
+        new_node = _Node(key, [None] * height, [0] * height)
+        steps = 0
+        for level in range(height):
+            previous = chain[level]
+            new_node.next[level] = previous.next[level]
+            previous.next[level] = new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key) -> None:
+        chain = [None] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        if target is self.tail or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key) -> int:
+        """Number of keys smaller than key, i.e. its 0-based position if present."""
+        node = self.head
+        position = 0
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def slice(self, start: int, count: int) -> list:
+        """Up to count keys from 0-based position start on."""
+        if start < 0:
+            start = 0
+        if start >= self.size or count <= 0:
+            return []
+        node = self.head
+        remaining = start + 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.width[level] <= remaining and node.next[level] is not self.tail:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not self.tail and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+def leaderboard_entry(username: str, position: int, games_won: int, games_played: int) -> dict:
+    """A leaderboard entry as sent to clients; position is 0-based."""
+    return {
+        Words.DataParamKey.USERNAME: username,
+        Words.DataParamKey.RANK: position + 1,
+        Words.DataParamKey.GAMES_WON: games_won,
+        Words.DataParamKey.GAMES_PLAYED: games_played,
+        Words.DataParamKey.WIN_RATE: games_won / games_played if games_played else 0.0,
+    }
+
+
+class Leaderboard:
+    """Rankings of users by games won and by win rate, updated one user at a time.
+
+    Keys sort best first. On the wins board equal wins rank the user with fewer games played higher; on the win rate
+    board equal rates rank the user with more games played higher. The username breaks the remaining ties, so every
+    key is distinct. Only users with at least min_rated_games played appear on the win rate board."""
+    def __init__(self, min_rated_games: int = MIN_RATED_GAMES) -> None:
+        self.min_rated_games = min_rated_games
+        self.boards = {BOARD_WINS: IndexableSkipList(), BOARD_WIN_RATE: IndexableSkipList()}
+        self.records: dict[str, tuple[int, int]] = {}  # username -> (games_won, games_played)
+        self.lock = threading.Lock()
+
+    def keys_for(self, username: str, games_won: int, games_played: int) -> dict:
+        keys = {BOARD_WINS: (-games_won, games_played, username)}
+        if games_played >= self.min_rated_games:
+            keys[BOARD_WIN_RATE] = (-games_won / games_played, -games_played, username)
+        return keys
+
+    def load(self, users) -> None:
+        """Rebuild every board from (username, user_info) pairs, e.g. StorageEngine.iter_users(). The new boards are
+        built aside and swapped in, so queries and updates are only held up for the swap."""
+        records = {username: (user_info.get(Words.DataParamKey.GAMES_WON, 0), user_info.get(Words.DataParamKey.GAMES_PLAYED, 0))
+                   for username, user_info in users}
+        board_keys = {board: [] for board in self.boards}
+        for username, record in records.items():
+            for board, key in self.keys_for(username, *record).items():
+                board_keys[board].append(key)
+        boards = {}
+        for board, keys in board_keys.items():
+            keys.sort()
+            boards[board] = IndexableSkipList()
+            boards[board].build(keys)
+        with self.lock:
+            self.records = records
+            self.boards = boards
+
+    def refresh(self, username: str, user_info: dict | None) -> None:
+        if user_info is None:
+            self.remove(username)
+        else:
+            self.update(username, user_info)
+
+    def update(self, username: str, user_info: dict) -> None:
+        record = (user_info.get(Words.DataParamKey.GAMES_WON, 0), user_info.get(Words.DataParamKey.GAMES_PLAYED, 0))
+        with self.lock:
+            old_record = self.records.get(username)
+            if old_record == record:
+                return
+            if old_record is not None:
+                for board, key in self.keys_for(username, *old_record).items():
+                    self.boards[board].remove(key)
+            for board, key in self.keys_for(username, *record).items():
+                self.boards[board].insert(key)
+            self.records[username] = record
+
+    def remove(self, username: str) -> None:
+        with self.lock:
+            old_record = self.records.pop(username, None)
+            if old_record is not None:
+                for board, key in self.keys_for(username, *old_record).items():
+                    self.boards[board].remove(key)
+
+    def entry(self, key, position: int) -> dict:
+        username = key[-1]
+        return leaderboard_entry(username, position, *self.records[username])
+
+    def top(self, board: str, limit: int) -> list[dict]:
+        with self.lock:
+            return [self.entry(key, i) for i, key in enumerate(self.boards[board].slice(0, limit))]
+
+    def key_of(self, board: str, username: str, record: tuple[int, int] | None):
+        record = record if record is not None else self.records.get(username)
+        return self.keys_for(username, *record).get(board) if record is not None else None
+
+    def rank(self, board: str, username: str, record: tuple[int, int] | None = None) -> int | None:
+        """1-based rank, or None if the user is not on the board. Given record, (games_won, games_played), the rank a
+        user with those stats would have, even one stored elsewhere: how a sharded leaderboard is merged."""
+        with self.lock:
+            key = self.key_of(board, username, record)
+            return self.boards[board].rank(key) + 1 if key is not None else None
+
+    def around(self, board: str, username: str, radius: int, record: tuple[int, int] | None = None) -> list[dict]:
+        """The user's entry with up to radius entries above and below it. Empty if the user is not on the board.
+        With record, as for rank(): a user stored elsewhere is left out and the radius entries after them follow."""
+        with self.lock:
+            key = self.key_of(board, username, record)
+            if key is None:
+                return []
+            start = max(self.boards[board].rank(key) - radius, 0)
+            return [self.entry(key, start + i) for i, key in enumerate(self.boards[board].slice(start, 2 * radius + 1))]
+
+    def size(self, board: str) -> int:
+        return len(self.boards[board])
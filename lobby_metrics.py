@@ -0,0 +1,208 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values: dict[tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """A gauge that is either set directly or read from a callback at scrape time."""
+    def __init__(self, name: str, help_text: str, callback: Callable[[], float] | None = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        with self.lock:
+            self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self.lock:
+            self.value -= amount
+
+    def get(self) -> float:
+        if self.callback is not None:
+            try:
+                return float(self.callback())
+            except Exception as e:
+                print(f"Error reading gauge {self.name}: {e}")
+                return 0.0
+        with self.lock:
+            return self.value
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {_format_value(self.get())}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.series: dict[tuple[str, ...], list] = {}  # {label_values: [bucket_counts, sum, count]}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self.series[label_values] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, (bucket_counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    le = 'le="' + _format_value(bound) + '"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, label_values, le)} {cumulative}")
+                labels = _format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class LobbyMetrics:
+    """All metrics the lobby exposes. Gauges describing lobby state read it through callbacks at scrape time."""
+    def __init__(self) -> None:
+        self.metrics: list[Counter | Gauge | Histogram] = []
+        self.command_total = self.register(Counter("lobby_command_total", "Client commands processed.", ("command",)))
+        self.command_duration = self.register(Histogram("lobby_command_duration_seconds", "Time spent handling a client command.", ("command",)))
+        self.db_request_total = self.register(Counter("lobby_db_request_total", "Requests sent to the database server.", ("collection", "action")))
+        self.db_request_duration = self.register(Histogram("lobby_db_request_duration_seconds", "Round trip of a database request, from send until the waiting handler picks up the response.", ("collection", "action")))
+        self.db_response_pickup_delay = self.register(Histogram("lobby_db_response_pickup_delay_seconds", "Time a database response waits in the pending dict before its handler picks it up."))
+        self.db_requests_in_flight = self.register(Gauge("lobby_db_requests_in_flight", "Database requests sent and not yet answered."))
+        self.db_in_flight: dict[str, tuple[float, str, str]] = {}  # {request_id: (sent_time, collection, action)}
+        self.db_response_arrivals: dict[str, float] = {}  # {request_id: arrival_time}
+        self.in_flight_lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_gauge(self, name: str, help_text: str, callback: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, help_text, callback))
+
+    def observe_command(self, command: str, duration: float) -> None:
+        self.command_total.inc(command)
+        self.command_duration.observe(duration, command)
+
+    def db_request_sent(self, request_id: str, collection: str, action: str) -> None:
+        self.db_request_total.inc(collection, action)
+        with self.in_flight_lock:
+            self.db_in_flight[request_id] = (time.perf_counter(), collection, action)
+            self.db_requests_in_flight.set(len(self.db_in_flight))
+
+    def db_response_arrived(self, request_id: str) -> None:
+        with self.in_flight_lock:
+            if request_id in self.db_in_flight:
+                self.db_response_arrivals[request_id] = time.perf_counter()
+
+    def db_response_consumed(self, request_id: str) -> None:
+        now = time.perf_counter()
+        with self.in_flight_lock:
+            sent = self.db_in_flight.pop(request_id, None)
+            arrival = self.db_response_arrivals.pop(request_id, None)
+            self.db_requests_in_flight.set(len(self.db_in_flight))
+        if sent is not None:
+            sent_time, collection, action = sent
+            self.db_request_duration.observe(now - sent_time, collection, action)
+        if arrival is not None:
+            self.db_response_pickup_delay.observe(now - arrival)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsHttpServer:
+    """Serves LobbyMetrics in Prometheus text format on GET /metrics. Meant to be bound to a local admin address."""
+    def __init__(self, metrics: LobbyMetrics, host: str = "127.0.0.1", port: int = 21399) -> None:
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.httpd: ThreadingHTTPServer | None = None
+        self.thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                pass  # keep scrapes out of the lobby log
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        print(f"Lobby metrics available at http://{self.host}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -5,10 +5,19 @@ import socket
 import time
 import uuid
 import random
+import secrets
 from game_server import GameServer
+from session_info import SessionInfo
+from lobby_metrics import LobbyMetrics, MetricsHttpServer
+from shard_map import ShardMap
+from shard_router import ShardRouter
+
+REPLICA_READ_COLLECTIONS = (Words.Collection.USER, Words.Collection.ROOM, Words.Collection.GAMELOG, Words.Collection.LEADERBOARD)
+
 
 class LobbyServer:
-    def __init__(self) -> None:
+    def __init__(self, session_grace_period: float = 30.0, metrics_host: str = "127.0.0.1", metrics_port: int | None = 21399, replica_reads: bool = True,
+                 shard_map: ShardMap | None = None) -> None:
         self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.host = ""
         self.port = 0
@@ -24,12 +33,39 @@ class LobbyServer:
         self.pending_db_response_dict: dict[str, tuple[bool, str, dict]] = {}
         """The dict contains all sent db_requests, after processing, received responses will be popped. {request_id: (response_received, result, data)}"""
         self.pending_db_response_lock = threading.Lock()
+        self.db_replica_passers: list[MessageFormatPasser] = []
+        self.replica_reads = replica_reads
+        """Send queries round-robin to connected database replicas. Every mutation goes to the primary, which checks
+        its own state, so a replica a moment behind only makes a listing or lookup slightly stale."""
+        self.replica_routed: dict[str, tuple[MessageFormatPasser, str, str, dict]] = {}
+        """Queries sent to a replica and not answered yet, resent to the primary if the replica refuses or drops them. {request_id: (replica, collection, action, data)}"""
+        self.replica_lock = threading.Lock()
+        self.next_replica = 0
+        self.shard_router = ShardRouter(shard_map) if shard_map is not None else None
+        """Given a shard map, the database is split over database_shard connections instead of one database server,
+        and every request goes through the router (see shard_router.py). Replicas are not used then."""
         self.invitee_inviter_set_pair: set[tuple] = set()  # {(invitee_username, inviter_username)}
         self.invitation_lock = threading.Lock()
         self.game_servers: dict[str, GameServer] = {}  # {room_id: GameServer}
         self.game_server_threads: dict[str, threading.Thread] = {}  # {room_id: Thread}
         self.game_server_win_recorded: dict[str, bool] = {}  # {room_id: bool}
         self.game_server_lock = threading.Lock()
+        self.session_grace_period = session_grace_period
+        """Seconds a session survives after its connection drops. 0 disables resuming."""
+        self.sessions: dict[str, SessionInfo] = {}  # {session_token: SessionInfo}
+        self.session_lock = threading.Lock()
+        self.metrics = LobbyMetrics()
+        self.metrics.add_gauge("lobby_active_connections", "Open connections of any type.", lambda: len(self.connections))
+        self.metrics.add_gauge("lobby_logged_in_users", "Connections with a logged-in user.", lambda: sum(1 for username in list(self.mfpassers_username.values()) if username is not None))
+        self.metrics.add_gauge("lobby_suspended_sessions", "Sessions waiting in their reconnect grace period.", lambda: sum(1 for session in list(self.sessions.values()) if session.msgfmt_passer is None))
+        self.metrics.add_gauge("lobby_running_game_servers", "Game servers currently managed by the lobby.", lambda: len(self.game_servers))
+        self.metrics.add_gauge("lobby_db_replicas", "Connected database replicas serving queries.", lambda: len(self.db_replica_passers))
+        if self.shard_router is not None:
+            self.metrics.add_gauge("lobby_db_shards", "Connected database shards.", lambda: sum(1 for shard in self.shard_router.passers if shard is not None))
+        self.metrics.add_gauge("lobby_pending_db_responses", "Entries in the pending database response dict.", lambda: len(self.pending_db_response_dict))
+        self.metrics.add_gauge("lobby_game_action_queue_depth", "Player actions queued in all game servers.", lambda: sum(game_server.action_queue.qsize() for game_server in list(self.game_servers.values())))
+        self.metrics.add_gauge("lobby_game_output_queue_depth", "Game updates queued for players and spectators in all game servers.", self.game_output_queue_depth)
+        self.metrics_server = MetricsHttpServer(self.metrics, metrics_host, metrics_port) if metrics_port is not None else None
         
         #self.send_to_DB_queue = queue.Queue()
         #self.accept_thread = threading.Thread(target=self.accept_connections, daemon=True)
@@ -58,6 +94,10 @@ class LobbyServer:
                 self.handle_client(msgfmt_passer)
             elif connection_type == Words.ConnectionType.DATABASE_SERVER:
                 self.handle_database_server(msgfmt_passer)
+            elif connection_type == Words.ConnectionType.DATABASE_REPLICA:
+                self.handle_database_replica(msgfmt_passer)
+            elif connection_type == Words.ConnectionType.DATABASE_SHARD:
+                self.handle_database_shard(msgfmt_passer)
             else:
                 print(f"Unknown connection type: {connection_type}")
         except Exception as e:
@@ -68,6 +108,10 @@ class LobbyServer:
         msgfmt_passer.close()
 
     def handle_database_server(self, msgfmt_passer: MessageFormatPasser) -> None:
+        if self.shard_router is not None:
+            print("This lobby uses database shards. Rejecting database server connection.")
+            msgfmt_passer.send_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE, Words.Result.ERROR, "This lobby uses database shards.")
+            return
         if self.db_server_passer is not None:
             print("A database server is already connected. Rejecting new connection.")
             msgfmt_passer.send_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE, Words.Result.ERROR, "Database server already connected.")
@@ -80,8 +124,11 @@ class LobbyServer:
             try:
                 response = msgfmt_passer.receive_args(Protocols.DBToLobby.RESPONSE)
                 responding_request_id = response[0]
+                with self.replica_lock:
+                    self.replica_routed.pop(responding_request_id, None)  # answered by a replica that has been promoted
                 with self.pending_db_response_lock:
                     self.pending_db_response_dict[responding_request_id] = (True, response[1], response[2])
+                self.metrics.db_response_arrived(responding_request_id)
             except TimeoutError:
                 continue
             except Exception as e:
@@ -90,6 +137,76 @@ class LobbyServer:
         self.db_server_passer = None
         print("Database server disconnected.")
 
+    def handle_database_replica(self, msgfmt_passer: MessageFormatPasser) -> None:
+        if self.shard_router is not None:
+            msgfmt_passer.send_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE, Words.Result.ERROR, "This lobby uses database shards, which take no replicas.")
+            return
+        msgfmt_passer.settimeout(2.0)
+        msgfmt_passer.send_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE, Words.Result.CONFIRMED, "Database replica connected successfully.")
+        with self.replica_lock:
+            self.db_replica_passers.append(msgfmt_passer)
+        print("Database replica connected.")
+        while not self.shutdown_event.is_set():
+            try:
+                responding_request_id, result, data = msgfmt_passer.receive_args(Protocols.DBToLobby.RESPONSE)
+            except TimeoutError:
+                continue
+            except Exception as e:
+                print(f"Error receiving response from database replica: {e}")
+                break
+            with self.replica_lock:
+                routed = self.replica_routed.pop(responding_request_id, None)
+            if result == Words.Result.FAILURE and data.get(Words.DataParamKey.REASON) in (Words.Reason.REPLICA_UNAVAILABLE, Words.Reason.READ_ONLY) and routed is not None:
+                self.resend_to_primary(responding_request_id, routed)
+                continue
+            with self.pending_db_response_lock:
+                self.pending_db_response_dict[responding_request_id] = (True, result, data)
+            self.metrics.db_response_arrived(responding_request_id)
+        with self.replica_lock:
+            self.db_replica_passers.remove(msgfmt_passer)
+            orphaned = [(request_id, routed) for request_id, routed in self.replica_routed.items() if routed[0] is msgfmt_passer]
+            for request_id, _ in orphaned:
+                del self.replica_routed[request_id]
+        for request_id, routed in orphaned:
+            self.resend_to_primary(request_id, routed)
+        print("Database replica disconnected.")
+
+    def handle_database_shard(self, msgfmt_passer: MessageFormatPasser) -> None:
+        shard_index, shard_count, room_shard = msgfmt_passer.receive_args(Protocols.ShardToLobby.HELLO)
+        if self.shard_router is None:
+            refusal = "This lobby uses a single database server."
+        else:
+            refusal = self.shard_router.attach(shard_index, shard_count, room_shard, msgfmt_passer)
+        if refusal is not None:
+            print(f"Rejecting database shard {shard_index}: {refusal}")
+            msgfmt_passer.send_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE, Words.Result.ERROR, refusal)
+            return
+        msgfmt_passer.settimeout(2.0)
+        msgfmt_passer.send_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE, Words.Result.CONFIRMED, f"Database shard {shard_index} connected successfully.")
+        print(f"Database shard {shard_index} connected.")
+        while not self.shutdown_event.is_set():
+            try:
+                responding_request_id, result, data = msgfmt_passer.receive_args(Protocols.DBToLobby.RESPONSE)
+            except TimeoutError:
+                continue
+            except Exception as e:
+                print(f"Error receiving response from database shard {shard_index}: {e}")
+                break
+            self.shard_router.deliver(responding_request_id, result, data)
+        self.shard_router.detach(shard_index)
+        print(f"Database shard {shard_index} disconnected.")
+
+    def resend_to_primary(self, request_id: str, routed: tuple[MessageFormatPasser, str, str, dict]) -> None:
+        _, collection, action, data = routed
+        db_server_passer = self.db_server_passer
+        try:
+            if db_server_passer is None:
+                raise ConnectionError("No database server connected.")
+            db_server_passer.send_args(Protocols.LobbyToDB.REQUEST, request_id, collection, action, data)
+        except Exception as e:
+            with self.pending_db_response_lock:
+                self.pending_db_response_dict[request_id] = (True, Words.Result.ERROR, {Words.DataParamKey.MESSAGE: str(e)})
+
     def manage_game_servers(self) -> None:
         while not self.shutdown_event.is_set():
             cleanup_room_ids = []
@@ -109,32 +226,17 @@ class LobbyServer:
 
                         print(f"Game over in room {room_id}. Winner: {winner} ({winner_username})")
 
-                        # record win
+                        # count the match for both players and append it to the match history in one step
                         request_id = str(uuid.uuid4())
                         with self.pending_db_response_lock:
                             self.pending_db_response_dict[request_id] = (False, "", {})
-                        self.send_to_database(request_id, Words.Collection.USER, Words.Action.ADD_WIN, {Words.DataParamKey.USERNAME: winner_username})
+                        self.send_to_database(request_id, Words.Collection.USER, Words.Action.RECORD_RESULT, game_server.match_record())
                         # Wait for response
-                        result, _ = self.receive_from_database(request_id)
+                        result, data = self.receive_from_database(request_id)
                         if result == Words.Result.SUCCESS:
-                            print(f"Recorded win for winner {winner_username} successfully.")
+                            print(f"Recorded match {data.get(Words.DataParamKey.MATCH_ID)} of room {room_id} (winner {winner_username}, loser {loser_username}) successfully.")
                         else:
-                            print(f"Failed to record win for winner {winner_username}.")
-
-                        # record game played for loser
-                        request_id = str(uuid.uuid4())
-                        with self.pending_db_response_lock:
-                            self.pending_db_response_dict[request_id] = (False, "", {})
-                        self.send_to_database(request_id, Words.Collection.USER, Words.Action.ADD_GAME_PLAYED, {Words.DataParamKey.USERNAME: loser_username})
-                        # Wait for response
-                        result, _ = self.receive_from_database(request_id)
-                        if result == Words.Result.SUCCESS:
-                            print(f"Recorded game result for {loser_username} successfully.")
-                        else:
-                            print(f"Failed to record game result for {loser_username}.")
-
-                        
-                        
+                            print(f"Failed to record match of room {room_id}: {data.get(Words.DataParamKey.MESSAGE)}")
 
                         self.game_server_win_recorded[room_id] = True
                     
@@ -179,7 +281,8 @@ class LobbyServer:
                 continue
             except Exception as e:
                 print(f"Error handling client {msgfmt_passer}: {e}")
-                self.db_set_offline_by_mfpasser(msgfmt_passer)
+                if not self.suspend_session(msgfmt_passer):
+                    self.db_set_offline_by_mfpasser(msgfmt_passer)
                 break
 
         if self.shutdown_event.is_set():
@@ -193,6 +296,14 @@ class LobbyServer:
         #self.remove_client(msgfmt_passer)
 
     def process_message(self, msg: list, msgfmt_passer: MessageFormatPasser) -> int:
+        command = msg[0]
+        start_time = time.perf_counter()
+        try:
+            return self.dispatch_command(msg, msgfmt_passer)
+        finally:
+            self.metrics.observe_command(command, time.perf_counter() - start_time)
+
+    def dispatch_command(self, msg: list, msgfmt_passer: MessageFormatPasser) -> int:
         command, params = msg
         print(f"Received command: {command} with params: {params}")
         # Here you would add logic to process different commands
@@ -230,50 +341,37 @@ class LobbyServer:
                 self.help_accept_invite(params, msgfmt_passer)
             case Words.Command.START_GAME:
                 self.help_start_game(params, msgfmt_passer)
+            case Words.Command.RESUME_SESSION:
+                self.help_resume_session(params, msgfmt_passer)
+            case Words.Command.MATCH_HISTORY:
+                self.help_match_history(params, msgfmt_passer)
+            case Words.Command.LEADERBOARD:
+                self.help_leaderboard(params, msgfmt_passer)
             case _:
                 msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, command, "", Words.Result.INVALID, {})
         return 0
     
     def db_set_offline_by_mfpasser(self, msgfmt_passer: MessageFormatPasser) -> None:
         username = self.mfpassers_username.get(msgfmt_passer)
-        if username is not None:
-            # Query user info from database to see if in a room
-            request_id = str(uuid.uuid4())
-            with self.pending_db_response_lock:
-                self.pending_db_response_dict[request_id] = (False, "", {})
-            self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: username})
-            # If user is in a room, leave the room first
-            query_result, query_data = self.receive_from_database(request_id)
-            if query_result == Words.Result.FOUND:
-                current_room_id = query_data.get("current_room_id")
-                if current_room_id is not None:
-                    # Leave room
-                    request_id = str(uuid.uuid4())
-                    with self.pending_db_response_lock:
-                        self.pending_db_response_dict[request_id] = (False, "", {})
-                    self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.REMOVE_USER, {Words.DataParamKey.ROOM_ID: current_room_id, Words.DataParamKey.USERNAME: username})
-                    # wait for response
-                    result, data = self.receive_from_database(request_id)
-                    # notify other users in the room
-                    if result == Words.Result.SUCCESS:
-                        now_room_info = data.get(Words.DataParamKey.NOW_ROOM_INFO, {})
-                        for user in now_room_info.get("users", []):
-                            for passer, usname in self.mfpassers_username.items():
-                                if usname == user and passer != msgfmt_passer:
-                                    passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.EVENT, "", Words.EventType.USER_LEFT, "", {Words.DataParamKey.USERNAME: self.mfpassers_username[msgfmt_passer], Words.DataParamKey.NOW_ROOM_INFO: now_room_info})
-                    # also notify spectators
-                    for spectator in now_room_info.get("spectators", []):
-                        for passer, usname in self.mfpassers_username.items():
-                            if usname == spectator and passer != msgfmt_passer:
-                                passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.EVENT, "", Words.EventType.USER_LEFT, "", {Words.DataParamKey.USERNAME: self.mfpassers_username[msgfmt_passer], Words.DataParamKey.NOW_ROOM_INFO: now_room_info})
-                            
+        self.drop_session(username)
+        self.db_set_offline_by_username(username, msgfmt_passer)
 
+    def db_set_offline_by_username(self, username: str | None, msgfmt_passer: MessageFormatPasser | None = None) -> None:
+        if username is not None:
+            # Leave the current room, if any, and go offline in one step
             request_id = str(uuid.uuid4())
             with self.pending_db_response_lock:
                 self.pending_db_response_dict[request_id] = (False, "", {})
-            self.send_to_database(request_id, Words.Collection.USER, Words.Action.UPDATE, {Words.DataParamKey.USERNAME: username, "online": False, "current_room_id": None})
+            self.send_to_database(request_id, Words.Collection.USER, Words.Action.LOGOUT_CLEANUP, {Words.DataParamKey.USERNAME: username})
             # wait for response
-            self.receive_from_database(request_id)
+            result, data = self.receive_from_database(request_id)
+            # notify other users and spectators in the room that was left
+            if result == Words.Result.SUCCESS and data.get(Words.DataParamKey.ROOM_ID) is not None:
+                now_room_info = data.get(Words.DataParamKey.NOW_ROOM_INFO, {})
+                for user in now_room_info.get("users", []) + now_room_info.get("spectators", []):
+                    for passer, usname in self.mfpassers_username.items():
+                        if usname == user and passer != msgfmt_passer:
+                            passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.EVENT, "", Words.EventType.USER_LEFT, "", {Words.DataParamKey.USERNAME: username, Words.DataParamKey.NOW_ROOM_INFO: now_room_info})
         # username = self.mfpassers_username.get(msgfmt_passer)
         # # if user is logged in, set offline in database
         # if username is not None:
@@ -289,8 +387,130 @@ class LobbyServer:
     def help_exit(self, msgfmt_passer: MessageFormatPasser) -> None:
         self.db_set_offline_by_mfpasser(msgfmt_passer)
 
+    def create_session(self, username: str, msgfmt_passer: MessageFormatPasser) -> str:
+        token = secrets.token_urlsafe(24)
+        with self.session_lock:
+            self.sessions[token] = SessionInfo(token, username, msgfmt_passer)
+        return token
+
+    def drop_session(self, username: str | None) -> None:
+        if username is None:
+            return
+        with self.session_lock:
+            for token, session in list(self.sessions.items()):
+                if session.username == username:
+                    del self.sessions[token]
+
+    def suspend_session(self, msgfmt_passer: MessageFormatPasser) -> bool:
+        """Keep the session of a dropped connection alive for the grace period. Returns False if there is nothing to keep."""
+        username = self.mfpassers_username.get(msgfmt_passer)
+        if username is None or self.session_grace_period <= 0:
+            return False
+        with self.session_lock:
+            for session in self.sessions.values():
+                if session.username == username and session.msgfmt_passer is msgfmt_passer:
+                    session.detach()
+                    print(f"Session of {username} suspended for {self.session_grace_period} seconds.")
+                    return True
+        return False
+
+    def send_event(self, username: str, event_type: str, data: dict) -> None:
+        """Send an event to every connection of username. While the user's session is suspended, the event is kept in
+        it and replayed on RESUME_SESSION."""
+        sent = False
+        for passer, passer_username in list(self.mfpassers_username.items()):
+            if passer_username == username:
+                passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.EVENT, "", event_type, "", data)
+                sent = True
+        if not sent:
+            with self.session_lock:
+                for session in self.sessions.values():
+                    if session.username == username and session.msgfmt_passer is None:
+                        session.pending_events.append((event_type, data))
+
+    def take_over_suspended_session(self, username: str) -> bool:
+        """A fresh login for a user whose session is suspended replaces that session. The old one is cleaned up first."""
+        with self.session_lock:
+            suspended = [token for token, session in self.sessions.items() if session.username == username and session.msgfmt_passer is None]
+            if not suspended:
+                return False
+            for token in suspended:
+                del self.sessions[token]
+        self.db_set_offline_by_username(username)
+        return True
+
+    def manage_sessions(self) -> None:
+        """Set users offline once their suspended session outlives the grace period."""
+        while not self.shutdown_event.is_set():
+            expired_usernames = []
+            with self.session_lock:
+                for token, session in list(self.sessions.items()):
+                    if session.is_expired(self.session_grace_period):
+                        del self.sessions[token]
+                        expired_usernames.append(session.username)
+            for username in expired_usernames:
+                print(f"Session of {username} expired.")
+                try:
+                    self.db_set_offline_by_username(username)
+                except Exception as e:
+                    print(f"Error expiring session of {username}: {e}")
+            time.sleep(1)
+
+    def help_resume_session(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
+        token = params.get(Words.DataParamKey.SESSION_TOKEN)
+        with self.session_lock:
+            session = self.sessions.get(token) if isinstance(token, str) else None
+            if session is None:
+                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.RESUME_SESSION, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Session expired or unknown."})
+                return
+            old_passer = session.msgfmt_passer
+            pending_events = session.attach(msgfmt_passer)
+        username = session.username
+        # The old connection may not have noticed the drop yet; unbind it so its cleanup does not touch this session.
+        if old_passer is not None and old_passer in self.mfpassers_username:
+            self.mfpassers_username[old_passer] = None
+        self.mfpassers_username[msgfmt_passer] = username
+
+        # Restore room state with reads only; the user stayed online and in the room while suspended.
+        room_id = None
+        now_room_info = {}
+        if self.database_connected():
+            request_id = str(uuid.uuid4())
+            with self.pending_db_response_lock:
+                self.pending_db_response_dict[request_id] = (False, "", {})
+            self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: username, Words.DataParamKey.FIELDS: [Words.DataParamKey.CURRENT_ROOM_ID]})
+            result, data = self.receive_from_database(request_id)
+            if result == Words.Result.FOUND:
+                room_id = data.get(Words.DataParamKey.CURRENT_ROOM_ID)
+            if room_id is not None:
+                request_id = str(uuid.uuid4())
+                with self.pending_db_response_lock:
+                    self.pending_db_response_dict[request_id] = (False, "", {})
+                self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.QUERY, {Words.DataParamKey.ROOM_ID: room_id})
+                result, data = self.receive_from_database(request_id)
+                if result == Words.Result.FOUND:
+                    now_room_info = data
+                else:
+                    room_id = None
+        with self.invitation_lock:
+            inviters = [inviter for invitee, inviter in self.invitee_inviter_set_pair if invitee == username]
+        print(f"Session of {username} resumed.")
+        msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.RESUME_SESSION, "", Words.Result.SUCCESS, {
+            Words.DataParamKey.MESSAGE: "Session resumed.",
+            Words.DataParamKey.USERNAME: username,
+            Words.DataParamKey.ROOM_ID: room_id,
+            Words.DataParamKey.NOW_ROOM_INFO: now_room_info,
+            Words.DataParamKey.INVITERS: inviters,
+        })
+        # Then the game events missed while suspended, for games still running; room events are covered by the room above.
+        with self.game_server_lock:
+            running_ports = {game_server.port for game_server in self.game_servers.values()}
+        for event_type, data in pending_events:
+            if data.get(Words.DataParamKey.PORT) in running_ports:
+                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.EVENT, "", event_type, "", data)
+
     def help_login(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LOGIN, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         
@@ -303,36 +523,25 @@ class LobbyServer:
             request_id = str(uuid.uuid4())
             with self.pending_db_response_lock:
                 self.pending_db_response_dict[request_id] = (False, "", {})
-            self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: username})
+            self.send_to_database(request_id, Words.Collection.USER, Words.Action.LOGIN, {Words.DataParamKey.USERNAME: username, Words.DataParamKey.PASSWORD: password})
             # Wait for response
-            query_result, query_data = self.receive_from_database(request_id)
+            login_result, login_data = self.receive_from_database(request_id)
 
-            if query_result != Words.Result.FOUND:
-                print(f"User {username} not found in database.")
-                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LOGIN, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Incorrect username or password."})
-                return
-
-            user_info = query_data
+            if login_result == Words.Result.FAILURE and login_data.get(Words.DataParamKey.REASON) == Words.Reason.ACCOUNT_USING and self.take_over_suspended_session(username):
+                # The suspended session has been logged out; log in again in its place.
+                request_id = str(uuid.uuid4())
+                with self.pending_db_response_lock:
+                    self.pending_db_response_dict[request_id] = (False, "", {})
+                self.send_to_database(request_id, Words.Collection.USER, Words.Action.LOGIN, {Words.DataParamKey.USERNAME: username, Words.DataParamKey.PASSWORD: password})
+                login_result, login_data = self.receive_from_database(request_id)
 
-            if user_info.get(Words.DataParamKey.PASSWORD) != password:
-                print(f"Incorrect password for user {username}.")
-                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LOGIN, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Incorrect username or password."})
-                return
-            
-            if user_info.get("online") == True:
-                print(f"User {username} is already logged in elsewhere.")
-                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LOGIN, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User already logged in elsewhere."})
+            if login_result != Words.Result.SUCCESS:
+                print(f"Login of user {username} refused: {login_data.get(Words.DataParamKey.MESSAGE)}")
+                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LOGIN, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: login_data.get(Words.DataParamKey.MESSAGE, "Login failed.")})
                 return
 
-            request_id = str(uuid.uuid4())
-            with self.pending_db_response_lock:
-                self.pending_db_response_dict[request_id] = (False, "", {})
-            self.send_to_database(request_id, Words.Collection.USER, Words.Action.UPDATE, {Words.DataParamKey.USERNAME: username, "online": True})
-            # Wait for update response
-            update_result, _ = self.receive_from_database(request_id)
-            if update_result != Words.Result.SUCCESS:
-                print(f"Warning: Failed to update user online status for {username}")
-            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LOGIN, "", Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Login successful."})
+            session_token = self.create_session(username, msgfmt_passer)
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LOGIN, "", Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Login successful.", Words.DataParamKey.SESSION_TOKEN: session_token})
             self.mfpassers_username[msgfmt_passer] = username
             #self.user_infos[msgfmt_passer].name = username
                             
@@ -343,12 +552,12 @@ class LobbyServer:
     def help_check_username(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
         username = params.get(Words.DataParamKey.USERNAME)
         # Wait for response from database server
-        if self.db_server_passer is not None:
+        if self.database_connected():
             try:
                 request_id = str(uuid.uuid4())
                 with self.pending_db_response_lock:
                     self.pending_db_response_dict[request_id] = (False, "", {})
-                self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: username})
+                self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: username, Words.DataParamKey.FIELDS: []})
                 # Wait for response
                 result, _ = self.receive_from_database(request_id)
                 if result == Words.Result.FOUND:
@@ -364,16 +573,23 @@ class LobbyServer:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_USERNAME, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
     
     def help_check_online_users(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_ONLINE_USERS, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         request_id = str(uuid.uuid4())
         with self.pending_db_response_lock:
             self.pending_db_response_dict[request_id] = (False, "", {})
-        self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, {"online": True, "current_room_id": None})
+        query = {Words.DataParamKey.ONLINE: True, Words.DataParamKey.CURRENT_ROOM_ID: None, Words.DataParamKey.FIELDS: [], Words.DataParamKey.SORT: [Words.DataParamKey.USERNAME]}
+        conditional = self.add_version_condition(query, params)
+        self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, query)
         # Wait for response
         result, data = self.receive_from_database(request_id)
-        if result == Words.Result.FOUND:
+        if result == Words.Result.NOT_MODIFIED:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_ONLINE_USERS, "", Words.Result.NOT_MODIFIED, data)
+        elif result == Words.Result.FOUND and conditional:
+            online_users = list(data[Words.DataParamKey.RECORDS].keys())
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_ONLINE_USERS, "", Words.Result.SUCCESS, {Words.DataParamKey.USERS: online_users, Words.DataParamKey.VERSION: data[Words.DataParamKey.VERSION]})
+        elif result == Words.Result.FOUND:
             online_users = list(data.keys())
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_ONLINE_USERS, "", Words.Result.SUCCESS, {Words.DataParamKey.USERS: online_users})
         elif result == Words.Result.NOT_FOUND:
@@ -386,7 +602,7 @@ class LobbyServer:
         password = params.get(Words.DataParamKey.PASSWORD)    
 
         # Wait for response from database server
-        if self.db_server_passer is not None:
+        if self.database_connected():
             try:
                 request_id = str(uuid.uuid4())
                 with self.pending_db_response_lock:
@@ -407,7 +623,7 @@ class LobbyServer:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.REGISTER, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
 
     def help_logout(self, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LOGOUT, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         self.db_set_offline_by_mfpasser(msgfmt_passer)
@@ -415,7 +631,7 @@ class LobbyServer:
         msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LOGOUT, "", Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Logout successful."})
 
     def help_create_room(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CREATE_ROOM, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         if self.mfpassers_username.get(msgfmt_passer) is None:
@@ -436,7 +652,7 @@ class LobbyServer:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CREATE_ROOM, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "Database error."})
 
     def help_leave_room(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LEAVE_ROOM, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         if self.mfpassers_username.get(msgfmt_passer) is None:
@@ -469,13 +685,13 @@ class LobbyServer:
         pass
 
     def help_invite_user(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.INVITE_USER, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         request_id = str(uuid.uuid4())
         with self.pending_db_response_lock:
             self.pending_db_response_dict[request_id] = (False, "", {})
-        self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: params.get(Words.DataParamKey.USERNAME)})
+        self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: params.get(Words.DataParamKey.USERNAME), Words.DataParamKey.FIELDS: [Words.DataParamKey.ONLINE, Words.DataParamKey.CURRENT_ROOM_ID]})
         # Wait for response
         result, data = self.receive_from_database(request_id)
         if result == Words.Result.FOUND:
@@ -492,7 +708,7 @@ class LobbyServer:
                 msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.INVITE_USER, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Invited user not found among connected clients."})
         
     def help_accept_invite(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.ACCEPT_INVITE, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         inviter_username = params.get(Words.DataParamKey.USERNAME)
@@ -529,18 +745,82 @@ class LobbyServer:
         else:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.ACCEPT_INVITE, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "Database error."})
 
+    def help_match_history(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
+        if not self.database_connected():
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.MATCH_HISTORY, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
+            return
+        username = params.get(Words.DataParamKey.USERNAME) or self.mfpassers_username.get(msgfmt_passer)
+        if username is None:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.MATCH_HISTORY, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Not logged in."})
+            return
+        query = {Words.DataParamKey.USERNAME: username, Words.DataParamKey.LIMIT: params.get(Words.DataParamKey.LIMIT, 10)}
+        if params.get(Words.DataParamKey.CURSOR) is not None:
+            query[Words.DataParamKey.CURSOR] = params.get(Words.DataParamKey.CURSOR)
+        request_id = str(uuid.uuid4())
+        with self.pending_db_response_lock:
+            self.pending_db_response_dict[request_id] = (False, "", {})
+        self.send_to_database(request_id, Words.Collection.GAMELOG, Words.Action.QUERY, query)
+        # Wait for response
+        result, data = self.receive_from_database(request_id)
+        if result == Words.Result.FOUND:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.MATCH_HISTORY, "", Words.Result.SUCCESS, data)
+        elif result == Words.Result.FAILURE:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.MATCH_HISTORY, "", Words.Result.FAILURE, data)
+        else:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.MATCH_HISTORY, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "Database error."})
+
+    def help_leaderboard(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
+        if not self.database_connected():
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LEADERBOARD, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
+            return
+        query = {Words.DataParamKey.BOARD: params.get(Words.DataParamKey.BOARD, "wins"), Words.DataParamKey.LIMIT: params.get(Words.DataParamKey.LIMIT, 10)}
+        username = params.get(Words.DataParamKey.USERNAME) or self.mfpassers_username.get(msgfmt_passer)
+        if username is not None:
+            query[Words.DataParamKey.USERNAME] = username
+            query[Words.DataParamKey.RADIUS] = params.get(Words.DataParamKey.RADIUS, 2)
+        request_id = str(uuid.uuid4())
+        with self.pending_db_response_lock:
+            self.pending_db_response_dict[request_id] = (False, "", {})
+        self.send_to_database(request_id, Words.Collection.LEADERBOARD, Words.Action.QUERY, query)
+        # Wait for response
+        result, data = self.receive_from_database(request_id)
+        if result == Words.Result.FOUND:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LEADERBOARD, "", Words.Result.SUCCESS, data)
+        elif result == Words.Result.FAILURE:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LEADERBOARD, "", Words.Result.FAILURE, data)
+        else:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.LEADERBOARD, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "Database error."})
+
+    @staticmethod
+    def add_version_condition(query: dict, params: dict) -> bool:
+        """Pass a client's if_version_newer_than on to the database. A client that sends it, even as "", gets the
+        version token of the list it receives, or not_modified with its token when the list has not changed."""
+        condition = params.get(Words.DataParamKey.IF_VERSION_NEWER_THAN)
+        if not isinstance(condition, str):
+            return False
+        query[Words.DataParamKey.IF_VERSION_NEWER_THAN] = condition
+        return True
+
     def help_check_joinable_rooms(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_JOINABLE_ROOMS, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         request_id = str(uuid.uuid4())
         with self.pending_db_response_lock:
             self.pending_db_response_dict[request_id] = (False, "", {})
-        self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.QUERY, {})
+        # Rooms are deleted once empty, so a room with one user has a free seat.
+        query = {Words.DataParamKey.PRIVACY: "public", Words.DataParamKey.USERS: {Words.Operator.SIZE: 1}, Words.DataParamKey.FIELDS: [Words.DataParamKey.OWNER, Words.DataParamKey.USERS]}
+        conditional = self.add_version_condition(query, params)
+        self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.QUERY, query)
         # Wait for response
         result, data = self.receive_from_database(request_id)
-        if result == Words.Result.FOUND:
-            joinable_rooms = {room_id: room_info for room_id, room_info in data.items() if len(room_info.get("users", [])) < 2 and room_info.get("settings", {}).get(Words.DataParamKey.PRIVACY) == "public"}
+        if result == Words.Result.NOT_MODIFIED:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_JOINABLE_ROOMS, "", Words.Result.NOT_MODIFIED, data)
+        elif result == Words.Result.FOUND and conditional:
+            joinable_rooms = {Words.DataParamKey.VERSION: data[Words.DataParamKey.VERSION], Words.DataParamKey.ROOMS: data[Words.DataParamKey.RECORDS]}
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_JOINABLE_ROOMS, "", Words.Result.SUCCESS, joinable_rooms)
+        elif result == Words.Result.FOUND:
+            joinable_rooms = data
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_JOINABLE_ROOMS, "", Words.Result.SUCCESS, joinable_rooms)
         elif result == Words.Result.NOT_FOUND:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_JOINABLE_ROOMS, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Failed to retrieve joinable rooms."})
@@ -548,17 +828,24 @@ class LobbyServer:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_JOINABLE_ROOMS, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "Database error."})
 
     def help_check_spectatable_rooms(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_SPECTATABLE_ROOMS, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         request_id = str(uuid.uuid4())
         with self.pending_db_response_lock:
             self.pending_db_response_dict[request_id] = (False, "", {})
-        self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.QUERY, {})
+        query = {Words.DataParamKey.PRIVACY: "public", Words.DataParamKey.IS_PLAYING: False, Words.DataParamKey.FIELDS: [Words.DataParamKey.OWNER, Words.DataParamKey.USERS]}
+        conditional = self.add_version_condition(query, params)
+        self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.QUERY, query)
         # Wait for response
         result, data = self.receive_from_database(request_id)
-        if result == Words.Result.FOUND:
-            spectatable_rooms = {room_id: room_info for room_id, room_info in data.items() if room_info.get("settings", {}).get(Words.DataParamKey.PRIVACY) == "public" and room_info.get("is_playing") == False}
+        if result == Words.Result.NOT_MODIFIED:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_SPECTATABLE_ROOMS, "", Words.Result.NOT_MODIFIED, data)
+        elif result == Words.Result.FOUND and conditional:
+            spectatable_rooms = {Words.DataParamKey.VERSION: data[Words.DataParamKey.VERSION], Words.DataParamKey.ROOMS: data[Words.DataParamKey.RECORDS]}
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_SPECTATABLE_ROOMS, "", Words.Result.SUCCESS, spectatable_rooms)
+        elif result == Words.Result.FOUND:
+            spectatable_rooms = data
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_SPECTATABLE_ROOMS, "", Words.Result.SUCCESS, spectatable_rooms)
         elif result == Words.Result.NOT_FOUND:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_SPECTATABLE_ROOMS, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Failed to retrieve spectatable rooms."})
@@ -566,7 +853,7 @@ class LobbyServer:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.CHECK_SPECTATABLE_ROOMS, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "Database error."})
 
     def help_join_room(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.JOIN_ROOM, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         if self.mfpassers_username.get(msgfmt_passer) is None:
@@ -599,7 +886,7 @@ class LobbyServer:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.JOIN_ROOM, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "Database error."})
 
     def help_spectate_room(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.SPECTATE_ROOM, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         if self.mfpassers_username.get(msgfmt_passer) is None:
@@ -632,7 +919,7 @@ class LobbyServer:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.SPECTATE_ROOM, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "Database error."})
 
     def help_start_game(self, params: dict, msgfmt_passer: MessageFormatPasser) -> None:
-        if self.db_server_passer is None:
+        if not self.database_connected():
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "No database server connected."})
             return
         if self.mfpassers_username.get(msgfmt_passer) is None:
@@ -641,38 +928,12 @@ class LobbyServer:
         request_id = str(uuid.uuid4())
         with self.pending_db_response_lock:
             self.pending_db_response_dict[request_id] = (False, "", {})
-        self.send_to_database(request_id, Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: self.mfpassers_username[msgfmt_passer]})
+        # Check ownership and player count and mark the room as playing in one step, so the game starts only once
+        self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.START_MATCH, {Words.DataParamKey.USERNAME: self.mfpassers_username[msgfmt_passer]})
         # Wait for response
         result, data = self.receive_from_database(request_id)
-        if result == Words.Result.FOUND:
-            current_room_id = data.get("current_room_id")
-            if current_room_id is None:
-                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not in a room."})
-                return
-            
-            
-
-            
-            # Notify game server to start game
-            request_id = str(uuid.uuid4())
-            with self.pending_db_response_lock:
-                self.pending_db_response_dict[request_id] = (False, "", {})
-            self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.QUERY, {Words.DataParamKey.ROOM_ID: current_room_id})
-            # Wait for response
-            result, data = self.receive_from_database(request_id)
-            if result != Words.Result.FOUND:
-                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Room not found."})
-                return
-            owner = data.get(Words.DataParamKey.OWNER)
-            if owner != self.mfpassers_username[msgfmt_passer]:
-                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Only the room owner can start the game."})
-                return
-            
-            # if player < 2, cannot start game
-            users = data.get(Words.DataParamKey.USERS, [])
-            if len(users) < 2:
-                msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Not enough players to start the game."})
-                return
+        if result == Words.Result.SUCCESS:
+            current_room_id = data.get(Words.DataParamKey.ROOM_ID)
             # Here you would add logic to notify the game server to start the game
             # attempt to start a new game server for the room by tuning port numbers
             offset = 0
@@ -697,41 +958,75 @@ class LobbyServer:
                     break
 
             if not started:
+                # Give the room back so the owner can try again
+                request_id = str(uuid.uuid4())
+                with self.pending_db_response_lock:
+                    self.pending_db_response_dict[request_id] = (False, "", {})
+                self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.UPDATE, {Words.DataParamKey.ROOM_ID: current_room_id, Words.DataParamKey.IS_PLAYING: False})
+                self.receive_from_database(request_id)
                 msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Failed to start game server."})
                 return
 
-            request_id = str(uuid.uuid4())
-            with self.pending_db_response_lock:
-                self.pending_db_response_dict[request_id] = (False, "", {})
-            self.send_to_database(request_id, Words.Collection.ROOM, Words.Action.UPDATE, {Words.DataParamKey.ROOM_ID: current_room_id, Words.DataParamKey.IS_PLAYING: True})
-            # Wait for response
-            result, _ = self.receive_from_database(request_id)
-            if result != Words.Result.SUCCESS:
-                print(f"Warning: Failed to update room playing status for room {current_room_id}")
-
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.SUCCESS, {Words.DataParamKey.MESSAGE: "Game started successfully."})
             
+            with self.game_server_lock:
+                game_port = self.game_servers[current_room_id].port
             for user in data.get(Words.DataParamKey.USERS, []):
-                for passer, username in self.mfpassers_username.items():
-                    if username == user:
-                        with self.game_server_lock:
-                            passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.EVENT, "", Words.EventType.CONNECT_TO_GAME_SERVER, "", {Words.DataParamKey.PORT: self.game_servers[current_room_id].port})
+                self.send_event(user, Words.EventType.CONNECT_TO_GAME_SERVER, {Words.DataParamKey.PORT: game_port})
             for spectator in data.get(Words.DataParamKey.SPECTATORS, []):
-                for passer, username in self.mfpassers_username.items():
-                    if username == spectator:
-                        with self.game_server_lock:
-                            passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.EVENT, "", Words.EventType.CONNECT_TO_GAME_SERVER_AS_SPECTATOR, "", {Words.DataParamKey.PORT: self.game_servers[current_room_id].port})
-        elif result == Words.Result.NOT_FOUND:
-            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not found."})
+                self.send_event(spectator, Words.EventType.CONNECT_TO_GAME_SERVER_AS_SPECTATOR, {Words.DataParamKey.PORT: game_port})
+        elif result == Words.Result.FAILURE:
+            msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: data.get(Words.DataParamKey.MESSAGE, "Cannot start the game.")})
         else:
             msgfmt_passer.send_args(Protocols.LobbyToClient.MESSAGE, Words.MessageType.RESPONSE, Words.Command.START_GAME, "", Words.Result.ERROR, {Words.DataParamKey.MESSAGE: "Database error."})
     #def remove_client(self, msgfmt_passer: MessageFormatPasser) -> None:
         #self.clients.remove(msgfmt_passer)
         #del self.user_infos[msgfmt_passer]
 
+    def database_connected(self) -> bool:
+        if self.shard_router is not None:
+            return self.shard_router.connected()
+        return self.db_server_passer is not None
+
     def send_to_database(self, request_id: str, collection: str, action: str, data: dict) -> None:
-        if self.db_server_passer is not None:
-            self.db_server_passer.send_args(Protocols.LobbyToDB.REQUEST, request_id, collection, action, data)
+        if self.shard_router is not None:
+            self.metrics.db_request_sent(request_id, collection, action)
+            threading.Thread(target=self.run_sharded_request, args=(request_id, collection, action, data), daemon=True).start()
+            return
+        db_server_passer = self.db_server_passer
+        if db_server_passer is not None:
+            self.metrics.db_request_sent(request_id, collection, action)
+            replica = self.pick_replica(collection, action)
+            if replica is not None:
+                with self.replica_lock:
+                    self.replica_routed[request_id] = (replica, collection, action, data)
+                try:
+                    replica.send_args(Protocols.LobbyToDB.REQUEST, request_id, collection, action, data)
+                    return
+                except Exception as e:
+                    print(f"Error sending to database replica, using the primary: {e}")
+                    with self.replica_lock:
+                        self.replica_routed.pop(request_id, None)
+            db_server_passer.send_args(Protocols.LobbyToDB.REQUEST, request_id, collection, action, data)
+
+    def run_sharded_request(self, request_id: str, collection: str, action: str, data: dict) -> None:
+        try:
+            result, response = self.shard_router.execute(collection, action, data)
+        except Exception as e:
+            print(f"Error routing database request {request_id} ({collection} {action}): {e}")
+            result, response = Words.Result.ERROR, {Words.DataParamKey.MESSAGE: str(e)}
+        with self.pending_db_response_lock:
+            self.pending_db_response_dict[request_id] = (True, result, response)
+        self.metrics.db_response_arrived(request_id)
+
+    def pick_replica(self, collection: str, action: str) -> MessageFormatPasser | None:
+        if not self.replica_reads or action != Words.Action.QUERY or collection not in REPLICA_READ_COLLECTIONS:
+            return None
+        with self.replica_lock:
+            if not self.db_replica_passers:
+                return None
+            self.next_replica = (self.next_replica + 1) % len(self.db_replica_passers)
+            return self.db_replica_passers[self.next_replica]
 
     def receive_from_database(self, request_id: str) -> tuple[str, dict]:
         while True:
@@ -741,11 +1036,19 @@ class LobbyServer:
                     response_received, result, data = self.pending_db_response_dict[request_id]
                     if response_received:
                         del self.pending_db_response_dict[request_id]
+                        self.metrics.db_response_consumed(request_id)
                         print(f"Received response from database for request_id {request_id}: {result}, {data}")
                         return (result, data)
 
 
 
+    def game_output_queue_depth(self) -> int:
+        depth = 0
+        for game_server in list(self.game_servers.values()):
+            depth += game_server.player1_queue.qsize() + game_server.player2_queue.qsize()
+            depth += sum(spectator_queue.qsize() for _, _, spectator_queue in list(game_server.spectator_ptq_list))
+        return depth
+
     def start_server(self, host: str, port: int) -> None:
         self.host = host
         self.port = port
@@ -761,11 +1064,21 @@ class LobbyServer:
         server_thread.start()
         game_servers_manager_thread = threading.Thread(target=self.manage_game_servers)
         game_servers_manager_thread.start()
+        sessions_manager_thread = threading.Thread(target=self.manage_sessions)
+        sessions_manager_thread.start()
+        if self.metrics_server is not None:
+            try:
+                self.metrics_server.start()
+            except OSError as e:
+                print(f"Failed to start metrics endpoint: {e}")
+                self.metrics_server = None
         time.sleep(0.2)
         try:
             while True:
-                cmd = input("Enter 'stop' to stop the server: ")
-                if cmd == 'stop':
+                cmd = input("Enter 'stop' to stop the server, 'metrics' to print metrics: ")
+                if cmd == 'metrics':
+                    print(self.metrics.render())
+                elif cmd == 'stop':
                     self.shutdown_event.set()
                     with self.game_server_lock:
                         for game_server in self.game_servers.values():
@@ -780,4 +1093,7 @@ class LobbyServer:
                     game_server.stop()
 
         server_thread.join()
-        game_servers_manager_thread.join()
\ No newline at end of file
+        game_servers_manager_thread.join()
+        sessions_manager_thread.join()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
\ No newline at end of file
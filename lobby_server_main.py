@@ -1,4 +1,12 @@
+import argparse
 from lobby_server import LobbyServer
+from shard_map import ShardMap
 
-server = LobbyServer()
-server.start(host="0.0.0.0", port=21354)
\ No newline at end of file
+parser = argparse.ArgumentParser(description="Lobby server.")
+parser.add_argument("--host", default="0.0.0.0")
+parser.add_argument("--port", type=int, default=21354)
+parser.add_argument("--shard-map", default=None, metavar="PATH", help="split the database over the database shards in this shard map file")
+args = parser.parse_args()
+
+server = LobbyServer(shard_map=ShardMap.load(args.shard_map) if args.shard_map is not None else None)
+server.start(host=args.host, port=args.port)
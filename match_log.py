@@ -0,0 +1,174 @@
+from bisect import bisect_left, bisect_right
+from protocols import Words
+import json
+import os
+import threading
+import time
+
+MATCH_LOG_DIR = 'match_log'
+SEGMENT_PREFIX = 'matches-'
+SEGMENT_SUFFIX = '.log'
+INDEX_SUFFIX = '.idx'
+
+
+class MatchLog:
+    """Append-only history of finished matches, kept in numbered segment files of compact JSON lines.
+
+    Every match gets the next match id (1, 2, ...) and an ended_at timestamp that never goes backwards, so id order is
+    time order. In memory the log keeps, per match, where its line starts, its ended_at and, per username, the ids of
+    that user's matches. Queries binary search those lists and read only the lines they return.
+    When the active segment reaches segment_bytes it is sealed: its index is written next to it as
+    matches-NNNNNN.idx, so a restart reads the small index files and only scans the active segment."""
+    def __init__(self, directory: str = MATCH_LOG_DIR, segment_bytes: int = 1024 * 1024, fsync: bool = True) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.locations: list[tuple[int, int]] = []  # [match_id - 1] -> (segment number, byte offset)
+        self.ended_at: list[float] = []  # [match_id - 1] -> ended_at
+        self.by_user: dict[str, list[int]] = {}  # username -> match ids, ascending
+        self.segment_entries: list[list] = []  # index rows of the active segment: [offset, ended_at, players]
+        self.readers: dict[int, object] = {}
+        os.makedirs(directory, exist_ok=True)
+        segments = sorted(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory)
+                          if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        for segment in segments[:-1]:
+            self.load_sealed_segment(segment)
+        self.active_segment = segments[-1] if segments else 1
+        self.scan_active_segment()
+        self.file = open(self.segment_path(self.active_segment), 'ab')
+
+    def segment_path(self, segment: int, suffix: str = SEGMENT_SUFFIX) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment:06d}{suffix}")
+
+    def add_to_index(self, segment: int, offset: int, ended_at: float, players: list[str]) -> int:
+        self.locations.append((segment, offset))
+        self.ended_at.append(ended_at)
+        match_id = len(self.locations)
+        for username in players:
+            self.by_user.setdefault(username, []).append(match_id)
+        return match_id
+
+    def load_sealed_segment(self, segment: int) -> None:
+        index_path = self.segment_path(segment, INDEX_SUFFIX)
+        if not os.path.exists(index_path):
+            self.rebuild_segment_index(segment)
+        with open(index_path, 'r') as f:
+            rows = json.load(f)
+        for offset, ended_at, players in rows:
+            self.add_to_index(segment, offset, ended_at, players)
+
+    def read_segment_rows(self, segment: int) -> tuple[list[list], int]:
+        """Index rows of every complete line, and the length of the valid prefix."""
+        rows = []
+        valid_bytes = 0
+        with open(self.segment_path(segment), 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                rows.append([valid_bytes, entry[Words.DataParamKey.ENDED_AT], entry[Words.DataParamKey.PLAYERS]])
+                valid_bytes += len(line)
+        return rows, valid_bytes
+
+    def rebuild_segment_index(self, segment: int) -> None:
+        rows, _ = self.read_segment_rows(segment)
+        with open(self.segment_path(segment, INDEX_SUFFIX), 'w') as f:
+            json.dump(rows, f, separators=(",", ":"))
+
+    def scan_active_segment(self) -> None:
+        path = self.segment_path(self.active_segment)
+        if not os.path.exists(path):
+            return
+        rows, valid_bytes = self.read_segment_rows(self.active_segment)
+        if valid_bytes < os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(valid_bytes)  # drop a line torn by a crash mid-append
+        for offset, ended_at, players in rows:
+            self.add_to_index(self.active_segment, offset, ended_at, players)
+        self.segment_entries = rows
+
+    def append(self, record: dict) -> dict:
+        """Store a finished match. record holds players and whatever else describes the match; match_id and ended_at
+        are filled in here. Returns the stored entry."""
+        with self.lock:
+            entry = dict(record)
+            entry[Words.DataParamKey.MATCH_ID] = len(self.locations) + 1
+            entry[Words.DataParamKey.ENDED_AT] = max(time.time(), self.ended_at[-1] if self.ended_at else 0.0)
+            self.write_entry(entry)
+            return entry
+
+    def append_replicated(self, entry: dict) -> bool:
+        """Store a match copied from another server's log, keeping its match_id and ended_at. Returns False, storing
+        nothing, unless it is the next match (one already stored is skipped, one after a gap is refused)."""
+        with self.lock:
+            if entry[Words.DataParamKey.MATCH_ID] != len(self.locations) + 1:
+                return False
+            self.write_entry(entry)
+            return True
+
+    def write_entry(self, entry: dict) -> None:
+        """Append a complete entry. The caller holds self.lock."""
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+        offset = self.file.tell()
+        self.file.write(line)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        ended_at = entry[Words.DataParamKey.ENDED_AT]
+        self.add_to_index(self.active_segment, offset, ended_at, entry[Words.DataParamKey.PLAYERS])
+        self.segment_entries.append([offset, ended_at, entry[Words.DataParamKey.PLAYERS]])
+        if self.file.tell() >= self.segment_bytes:
+            self.seal_active_segment()
+
+    def seal_active_segment(self) -> None:
+        with open(self.segment_path(self.active_segment, INDEX_SUFFIX), 'w') as f:
+            json.dump(self.segment_entries, f, separators=(",", ":"))
+        self.file.close()
+        self.active_segment += 1
+        self.segment_entries = []
+        self.file = open(self.segment_path(self.active_segment), 'ab')
+
+    def read_entry(self, match_id: int) -> dict:
+        segment, offset = self.locations[match_id - 1]
+        reader = self.readers.get(segment)
+        if reader is None:
+            reader = open(self.segment_path(segment), 'rb')
+            self.readers[segment] = reader
+        reader.seek(offset)
+        return json.loads(reader.readline())
+
+    def get(self, match_id: int) -> dict:
+        with self.lock:
+            self.file.flush()
+            return self.read_entry(match_id)
+
+    def query(self, username: str | None = None, limit: int = 20, cursor: int | None = None,
+              since: float | None = None, until: float | None = None) -> tuple[list[dict], int | None]:
+        """Matches newest first, optionally only those of username, ended within [since, until], and older than the
+        match id cursor. Returns the entries and the cursor for the next page (None when there is none)."""
+        with self.lock:
+            ids = self.by_user.get(username, []) if username is not None else range(1, len(self.locations) + 1)
+            ended_at = lambda match_id: self.ended_at[match_id - 1]
+            low = bisect_left(ids, since, key=ended_at) if since is not None else 0
+            high = bisect_right(ids, until, key=ended_at) if until is not None else len(ids)
+            if cursor is not None:
+                high = min(high, bisect_left(ids, cursor))
+            first = max(low, high - max(limit, 0))
+            self.file.flush()
+            entries = [self.read_entry(ids[i]) for i in range(high - 1, first - 1, -1)]
+            next_cursor = ids[first] if first > low and entries else None
+            return entries, next_cursor
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+            for reader in self.readers.values():
+                reader.close()
+            self.readers = {}
@@ -1,5 +1,11 @@
 import json
 
+
+class EncodedJson(str):
+    """The JSON text of a field value, encoded in advance (e.g. a cached response). to_json() splices it into the
+    message as it is instead of encoding the value again; it stands in for a field of any type."""
+
+
 class MessageFormat:
     def __init__(self, format_dict: dict = {}) -> None:
         """format_dict: key is field name, value is type (str, int, float, bool)"""
@@ -7,15 +13,20 @@ class MessageFormat:
 
     def to_json(self, *args) -> str:
         result_dict = {}
+        encoded = False
         args_list = list(args)
         if len(args_list) != len(self.format):
             raise ValueError("Number of arguments does not match format")
         for key, tp in self.format.items():
             value = args_list.pop(0)
-            if not isinstance(value, tp):
+            if isinstance(value, EncodedJson):
+                encoded = True
+            elif not isinstance(value, tp):
                 raise TypeError(f"Expected {tp} for field '{key}', got {type(value)}")
             result_dict[key] = value
         #print(f"Formatted dict: {result_dict}")
+        if encoded:  # same text json.dumps(result_dict) would give, with the encoded fields copied in
+            return "{" + ", ".join(f"{json.dumps(key)}: {value if isinstance(value, EncodedJson) else json.dumps(value)}" for key, value in result_dict.items()) + "}"
         return json.dumps(result_dict)
     
     def to_arg_list(self, json_str: str) -> list:
@@ -0,0 +1,32 @@
+import argparse
+import os
+from json_storage_engine import JsonStorageEngine
+from storage_engine import META_COLLECTION, ROOM_ID_ALLOCATOR_KEY
+from sqlite_storage_engine import SqliteStorageEngine, SQLITE_DB_FILE
+
+parser = argparse.ArgumentParser(description="Copy the JSON database (snapshot plus write-ahead log) into an SQLite database.")
+parser.add_argument("--data-dir", default=".", help="directory with user_db.json, room_db.json and the write-ahead log")
+parser.add_argument("--sqlite-path", default=SQLITE_DB_FILE)
+parser.add_argument("--force", action="store_true", help="overwrite records that already exist in the SQLite database")
+args = parser.parse_args()
+
+if os.path.exists(args.sqlite_path) and not args.force:
+    print(f"{args.sqlite_path} already exists. Use --force to merge into it.")
+    raise SystemExit(1)
+
+source = JsonStorageEngine(args.data_dir)  # replays the log, so unsnapshotted writes are included
+target = SqliteStorageEngine(args.sqlite_path)
+users = 0
+rooms = 0
+with source.lock, target.lock:
+    for username, user_info in source.iter_users():
+        target.put_user(username, user_info)
+        users += 1
+    for room_id, room_info in source.iter_rooms():
+        target.put_room(room_id, room_info)
+        rooms += 1
+    target.room_ids.load(source.room_ids.state)
+    target.mark_dirty(META_COLLECTION, ROOM_ID_ALLOCATOR_KEY, target.room_ids.state)
+target.close()  # one commit for everything
+source.wal.close()
+print(f"Migrated {users} users and {rooms} rooms to {args.sqlite_path}.")
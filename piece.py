@@ -1,16 +1,81 @@
 # this class defines a piece in Tetris
 from __future__ import annotations
 
+KICKS = (0, -1, 1, -2, 2)  # column shifts tried, in order, when a piece rotates: in place first, then the wall kicks
+
+
+class PieceTemplate:
+    """The four rotation states of one piece type, computed once and shared by every piece of that type.
+
+    shapes[i] is the shape after i clockwise rotations of the spawn shape, as a tuple of tuples (immutable, so
+    pieces can share it), cells[i] the (row, col) offsets of its filled cells and bottoms[i] its bottom profile,
+    (col, lowest filled row) for each column it fills."""
+    def __init__(self, type_name: str, shape: list[list[int]]) -> None:
+        self.type_name = type_name
+        shapes = [tuple(tuple(row) for row in shape)]
+        for _ in range(3):
+            shapes.append(tuple(zip(*shapes[-1][::-1])))  # 90 degrees clockwise
+        self.shapes: tuple[tuple[tuple[int, ...], ...], ...] = tuple(shapes)
+        self.cells: tuple[tuple[tuple[int, int], ...], ...] = tuple(
+            tuple((r, c) for r in range(len(rotated)) for c in range(len(rotated[r])) if rotated[r][c] != 0) for rotated in self.shapes)
+        self.bottoms: tuple[tuple[tuple[int, int], ...], ...] = tuple(
+            tuple((c, max(r for r, cell_col in cells if cell_col == c)) for c in sorted({c for _, c in cells})) for cells in self.cells)
+        self.kicks = KICKS
+
+
+PIECE_TEMPLATES = {
+    "T": PieceTemplate("T", [[0, 1, 0],
+                             [1, 1, 1],
+                             [0, 0, 0]]),
+    "I": PieceTemplate("I", [[0, 0, 0, 0],
+                             [1, 1, 1, 1],
+                             [0, 0, 0, 0],
+                             [0, 0, 0, 0]]),
+    "O": PieceTemplate("O", [[1, 1],
+                             [1, 1]]),
+    "L": PieceTemplate("L", [[1, 0, 0],
+                             [1, 1, 1],
+                             [0, 0, 0]]),
+    "J": PieceTemplate("J", [[0, 0, 1],
+                             [1, 1, 1],
+                             [0, 0, 0]]),
+    "S": PieceTemplate("S", [[0, 1, 1],
+                             [1, 1, 0],
+                             [0, 0, 0]]),
+    "Z": PieceTemplate("Z", [[1, 1, 0],
+                             [0, 1, 1],
+                             [0, 0, 0]]),
+}
+
+
 class Piece:
-    def __init__(self, shape: list[list[int]], position: tuple[int, int], type_name: str) -> None:
-        self.shape = shape  # 2D list representing the piece shape, for example: [[1, 1, 1], [0, 1, 0]] for a T shape
-        self.position = position  # (row, col) position on the board, top-left corner of the piece
-        self.color = 1  # default color index; can be modified as needed
+    def __init__(self, type_name: str, position: tuple[int, int], rotation: int = 0, color: int = 1) -> None:
         self.type_name = type_name
+        self.template = PIECE_TEMPLATES[type_name]
+        self.rotation = rotation  # index into the template's rotation states
+        self.position = position  # (row, col) position on the board, top-left corner of the piece
+        self.color = color  # default color index; can be modified as needed
+
+    @property
+    def shape(self) -> tuple[tuple[int, ...], ...]:
+        # 2D tuple representing the piece shape, for example: ((0, 1, 0), (1, 1, 1), (0, 0, 0)) for a T shape
+        return self.template.shapes[self.rotation]
+
+    @property
+    def cells(self) -> tuple[tuple[int, int], ...]:
+        return self.template.cells[self.rotation]
+
+    @property
+    def bottoms(self) -> tuple[tuple[int, int], ...]:
+        return self.template.bottoms[self.rotation]
+
+    def rotated_cells(self) -> tuple[tuple[int, int], ...]:
+        """The cells of the piece once rotated, to probe a rotation without making it."""
+        return self.template.cells[(self.rotation + 1) % 4]
 
     def rotate(self) -> None:
         # Rotate the piece 90 degrees clockwise
-        self.shape = [list(row) for row in zip(*self.shape[::-1])]
+        self.rotation = (self.rotation + 1) % 4
 
     def move(self, direction: str) -> None:
         # Move the piece in the specified direction
@@ -22,33 +87,13 @@ class Piece:
             self.position = (self.position[0] + 1, self.position[1])
 
     def copy(self) -> Piece:
-        return Piece([row[:] for row in self.shape], self.position, self.type_name)
+        return Piece(self.type_name, self.position, self.rotation)
 
 class Pieces:
-    T = Piece([[0, 1, 0], 
-               [1, 1, 1],
-               [0, 0, 0]], (0, 4), "T")
-    
-    I = Piece([[0, 0, 0, 0], 
-               [1, 1, 1, 1], 
-               [0, 0, 0, 0], 
-               [0, 0, 0, 0]], (0, 4), "I")
-
-    O = Piece([[1, 1], 
-               [1, 1]], (0, 4), "O")
-
-    L = Piece([[1, 0, 0], 
-               [1, 1, 1], 
-               [0, 0, 0]], (0, 4), "L")
-
-    J = Piece([[0, 0, 1], 
-               [1, 1, 1], 
-               [0, 0, 0]], (0, 4), "J")
-
-    S = Piece([[0, 1, 1], 
-               [1, 1, 0], 
-               [0, 0, 0]], (0, 4), "S")
-
-    Z = Piece([[1, 1, 0], 
-               [0, 1, 1], 
-               [0, 0, 0]], (0, 4), "Z")
\ No newline at end of file
+    T = Piece("T", (0, 4))
+    I = Piece("I", (0, 4))
+    O = Piece("O", (0, 4))
+    L = Piece("L", (0, 4))
+    J = Piece("J", (0, 4))
+    S = Piece("S", (0, 4))
+    Z = Piece("Z", (0, 4))
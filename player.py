@@ -10,6 +10,7 @@ class Player:
         self.player_id: str = player_id
         self.death_count: int = 0
         self.score: int = 0
+        self.cleared_cells_total: list[int] = [0, 0, 0, 0] # same layout as process_cleared_cells' argument
     def is_alive(self) -> bool:
         return self.revive_time == 0.0
     def die(self) -> None:
@@ -39,6 +40,8 @@ class Player:
 
     def process_cleared_cells(self, cleared_cells: list[int], opponent: Player) -> None:
         # cleared_cells: [empty, score, heal, attack]
+        for i, count in enumerate(cleared_cells):
+            self.cleared_cells_total[i] += count
         self.add_score(cleared_cells[1])
         self.heal(cleared_cells[2])
         opponent.take_damage(cleared_cells[3])
@@ -6,7 +6,19 @@ class Protocols:
             "connection_type": str
         })
         """
-        connection_type: 'client', 'database_server', or 'game_server'
+        connection_type: 'client', 'database_server', 'database_replica', 'database_shard', or 'game_server'
+        """
+
+    class ShardToLobby:
+        HELLO = MessageFormat({
+            "shard_index": int,
+            "shard_count": int,
+            "room_shard": int
+        })
+        """
+        Sent by a database_shard right after its handshake, before the lobby answers it. \n
+        shard_index: which shard this server is \n
+        shard_count, room_shard: the shard map it was started with; the lobby refuses a shard whose map differs from its own
         """
 
     class LobbyToConnection:
@@ -45,6 +57,44 @@ class Protocols:
         data: additional data as a dictionary
         """
 
+    class ReplicaToPrimary:
+        SUBSCRIBE = MessageFormat({
+            "replica_id": str,
+            "source_id": str,
+            "applied_sequence": int,
+            "match_count": int
+        })
+        """
+        replica_id: name of the replica, for the primary's status \n
+        source_id: id of the primary run the replica last replicated from, '' if none \n
+        applied_sequence: last batch of that run the replica has applied \n
+        match_count: matches in the replica's gamelog
+        """
+        ACK = MessageFormat({
+            "applied_sequence": int,
+            "match_count": int
+        })
+
+    class PrimaryToReplica:
+        SUBSCRIBE_RESPONSE = MessageFormat({
+            "source_id": str,
+            "full_sync": bool
+        })
+        """
+        source_id: id of this primary run; sequences are only comparable within one run \n
+        full_sync: whether a full copy follows, instead of resuming after applied_sequence
+        """
+        REPLICATE = MessageFormat({
+            "kind": str,
+            "sequence": int,
+            "entries": list
+        })
+        """
+        kind: 'sync_begin', 'entries', 'sync_end', 'batch' or 'heartbeat' (see replication.py) \n
+        sequence: batch sequence number; for heartbeats the primary's latest \n
+        entries: [collection, key, value] records, value None for deleted
+        """
+
     class ClientToLobby:
         COMMAND = MessageFormat({
             "command": str,
@@ -127,10 +177,13 @@ class Protocols:
         player1: game state update for player 1 \n
         player2: game state update for player 2
         the dictionary mainly contains:
-            'board': string representing the game board, contains width * height chars \n
-            'now_piece': current piece shape (list) \n
+            'board': string representing the game board, contains width * height chars; full lines are cleared as
+                     the piece locks, so a board never shows a full row (it used to for one update) \n
+            'now_piece': current piece type, such as "T" \n
+            'rotation': rotation index of the current piece (piece.PIECE_TEMPLATES[type].shapes[rotation] is its shape) \n
             'color': current piece color \n
             'position': current piece position \n
+            'landing_row': row the current piece would land at if hard dropped (for the ghost piece) \n
             'next_pieces': list of next piece types (list[str]) \n
             'score': current score \n
             'health': current health \n
@@ -154,6 +207,8 @@ class Words:
         USER = "user"
         ROOM = "room"
         GAMELOG = "gamelog"
+        LEADERBOARD = "leaderboard"
+        REPLICATION = "replication" # replication status of the database server (query only)
     class Action:
         CREATE = "create"
         READ = "read"
@@ -165,6 +220,15 @@ class Words:
         REMOVE_USER = "remove_user"
         ADD_WIN = "add_win"
         ADD_GAME_PLAYED = "add_game_played"
+        LOGIN = "login" # check the password and set the user online, unless already online
+        LOGOUT_CLEANUP = "logout_cleanup" # leave the current room and set the user offline
+        START_MATCH = "start_match" # mark the owner's room as playing once it can start
+        RECORD_RESULT = "record_result" # count a finished match for every player and append it to the gamelog
+        CLAIM_ROOM = "claim_room" # set an online user's current room, unless they are already in one (sharded room actions)
+        RELEASE_ROOM = "release_room" # clear a user's current room if it is still the given one (sharded room actions)
+        BULK_CREATE = "bulk_create" # create many users in one request and one commit
+        BULK_UPDATE = "bulk_update" # update many users in one request and one commit
+        EXPORT = "export" # page through every user in username order, in pages that fit a message
     class Command:
         EXIT = "exit"
         CHECK_USERNAME = "check_username" # Check if a username is available to register
@@ -183,6 +247,9 @@ class Words:
         ACCEPT_INVITE = "accept_invite"
         DECLINE_INVITE = "decline_invite"
         START_GAME = "start_game"
+        RESUME_SESSION = "resume_session" # Reattach to a session kept alive after a dropped connection
+        MATCH_HISTORY = "match_history" # Page through a user's finished matches, newest first
+        LEADERBOARD = "leaderboard" # Top players by wins or win rate, and where a user stands
     class Result:
         SUCCESS = "success"
         FAILURE = "failure"
@@ -192,6 +259,7 @@ class Words:
         VALID = "valid"
         INVALID = "invalid"
         CONFIRMED = "confirmed"
+        NOT_MODIFIED = "not_modified" # a conditional query whose records have not changed since the given version
     class DataParamKey:
         USERNAME = "username"
         INVITER_USERNAME = "inviter_username"
@@ -218,11 +286,59 @@ class Words:
         HOST = "host"
         PORT = "port"
         SPECTATORS = "spectators"
+        SESSION_TOKEN = "session_token"
+        INVITERS = "inviters"
+        MATCH_ID = "match_id"
+        MATCHES = "matches"
+        WINNER = "winner"
+        SCORES = "scores"
+        DURATION = "duration"
+        SEED = "seed"
+        STATS = "stats"
+        ENDED_AT = "ended_at"
+        LIMIT = "limit"
+        CURSOR = "cursor"
+        NEXT_CURSOR = "next_cursor"
+        SINCE = "since"
+        UNTIL = "until"
+        BOARD = "board"
+        RANK = "rank"
+        WIN_RATE = "win_rate"
+        ENTRIES = "entries"
+        AROUND = "around"
+        RADIUS = "radius"
+        TOTAL = "total"
+        FIELDS = "fields"
+        EXCLUDE = "exclude"
+        SORT = "sort"
+        COUNT_ONLY = "count_only"
+        COUNT = "count"
+        CREATED = "created"
+        UPDATED = "updated"
+        SKIPPED = "skipped"
+        VERSION = "version"
+        IF_VERSION_NEWER_THAN = "if_version_newer_than"
+        RECORDS = "records"
+        ROOMS = "rooms"
+    class Operator:
+        """Query conditions: a criterion value like {"$gte": 10} instead of a plain value to compare equal."""
+        EQ = "$eq"
+        NE = "$ne"
+        GT = "$gt"
+        GTE = "$gte"
+        LT = "$lt"
+        LTE = "$lte"
+        IN = "$in"
+        NIN = "$nin"
+        SIZE = "$size" # length of a list field
     class Reason:
         INVALID_CREDENTIALS = "invalid_credentials"
         ROOM_FULL = "room_full"
         GAME_ALREADY_STARTED = "game_already_started"
         ACCOUNT_USING = "account_using"
+        READ_ONLY = "read_only" # a replica was sent a mutation
+        REPLICA_UNAVAILABLE = "replica_unavailable" # the replica is too far behind to answer; ask the primary
+        WRONG_SHARD = "wrong_shard" # the request's records belong to another database shard
     class Message:
         WELCOME_USER = "welcome_user"
     class MessageType:
@@ -239,6 +355,8 @@ class Words:
     class ConnectionType:
         CLIENT = "client"
         DATABASE_SERVER = "database_server"
+        DATABASE_REPLICA = "database_replica"
+        DATABASE_SHARD = "database_shard"
         GAME_SERVER = "game_server"
     class GameAction:
         MOVE_LEFT = "move_left"
@@ -0,0 +1,112 @@
+from contextlib import contextmanager
+import threading
+
+
+class ReadWriteLock:
+    """Many readers or one writer. Waiting writers block new readers, so a stream of reads cannot starve writes.
+
+    The write side is reentrant for its owner, and the owner may also take the read side."""
+    def __init__(self) -> None:
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.waiting_writers = 0
+        self.writer: int | None = None
+        self.write_depth = 0
+
+    def acquire_read(self) -> None:
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.write_depth += 1
+                return
+            while self.writer is not None or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_read(self) -> None:
+        with self.condition:
+            if self.writer == threading.get_ident():
+                self.write_depth -= 1
+                return
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self) -> None:
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.write_depth += 1
+                return
+            self.waiting_writers += 1
+            while self.writer is not None or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = me
+            self.write_depth = 1
+
+    def release_write(self) -> None:
+        with self.condition:
+            self.write_depth -= 1
+            if self.write_depth == 0:
+                self.writer = None
+                self.condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class CollectionLocks:
+    """One ReadWriteLock per collection, always taken in the order the collections were given to avoid deadlocks.
+
+    Entering the object itself (with locks:) write-locks every collection; that is the exclusive lock the flusher and
+    snapshots use, and what code that walks several collections takes."""
+    def __init__(self, collections: list[str]) -> None:
+        self.order = list(collections)
+        self.locks = {collection: ReadWriteLock() for collection in self.order}
+
+    def add(self, collection: str) -> None:
+        if collection not in self.locks:
+            self.order.append(collection)
+            self.locks[collection] = ReadWriteLock()
+
+    @contextmanager
+    def hold(self, read: tuple[str, ...] = (), write: tuple[str, ...] = ()):
+        taken = []
+        try:
+            for collection in self.order:
+                if collection in write:
+                    self.locks[collection].acquire_write()
+                    taken.append((collection, True))
+                elif collection in read:
+                    self.locks[collection].acquire_read()
+                    taken.append((collection, False))
+            yield
+        finally:
+            for collection, is_write in reversed(taken):
+                if is_write:
+                    self.locks[collection].release_write()
+                else:
+                    self.locks[collection].release_read()
+
+    def __enter__(self):
+        for collection in self.order:
+            self.locks[collection].acquire_write()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for collection in reversed(self.order):
+            self.locks[collection].release_write()
@@ -0,0 +1,54 @@
+import argparse
+import gc
+import random
+import tracemalloc
+from compact_records import CompactUserStore
+from protocols import Words
+
+
+def make_user(rng: random.Random) -> dict:
+    games_played = rng.randrange(200)
+    return {
+        Words.DataParamKey.PASSWORD: f"pw{rng.randrange(10 ** 8)}",
+        Words.DataParamKey.GAMES_PLAYED: games_played,
+        Words.DataParamKey.GAMES_WON: rng.randrange(games_played + 1),
+        Words.DataParamKey.ONLINE: rng.random() < 0.05,
+        Words.DataParamKey.CURRENT_ROOM_ID: str(rng.randrange(1000)) if rng.random() < 0.02 else None,
+    }
+
+
+def measure(layout: str, users: int) -> int:
+    """Bytes allocated to hold users user records in the given layout, usernames and passwords included."""
+    rng = random.Random(0)
+    gc.collect()
+    tracemalloc.start()
+    if layout == "compact":
+        store = CompactUserStore()
+        for i in range(users):
+            store[f"user{i}"] = make_user(rng)
+    else:
+        store = {}
+        for i in range(users):
+            store[f"user{i}"] = make_user(rng)
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del store
+    return allocated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory per user of the JSON engine's user table: dict of dicts vs CompactUserStore.")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f"{'layout':<8} {'users':>10} {'MiB':>9} {'bytes/user':>11}")
+    results = {}
+    for layout in ("dict", "compact"):
+        results[layout] = measure(layout, args.users)
+        print(f"{layout:<8} {args.users:>10} {results[layout] / 2 ** 20:>9.1f} {results[layout] / args.users:>11.1f}")
+    print(f"compact uses {100 * results['compact'] / results['dict']:.0f}% of the dict layout")
+
+
+if __name__ == "__main__":
+    main()
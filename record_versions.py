@@ -0,0 +1,52 @@
+import threading
+import uuid
+from protocols import Words
+
+VERSIONED_COLLECTIONS = (Words.Collection.USER, Words.Collection.ROOM)
+
+
+class RecordVersions:
+    """Version numbers of the collections and records of one database server run.
+
+    Every write to a collection increases its version, and the written record takes the new version as its own, so
+    both only ever grow. A record not written since startup has version 0, and a record that does not exist has the
+    collection's version: it was deleted, or never created, no later than that. Versions restart with the server, so
+    the tokens handed to readers carry a random epoch of the run; a token of another run, or of another server such
+    as a replica, never counts as current."""
+    def __init__(self) -> None:
+        self.epoch = uuid.uuid4().hex[:8]
+        self.collections = {collection: 0 for collection in VERSIONED_COLLECTIONS}
+        self.records: dict[str, dict[str, int]] = {collection: {} for collection in VERSIONED_COLLECTIONS}
+        self.lock = threading.Lock()
+
+    def bump(self, collection: str, key: str, deleted: bool = False) -> None:
+        if collection not in self.collections:
+            return
+        with self.lock:
+            version = self.collections[collection] + 1
+            self.collections[collection] = version
+            if deleted:
+                self.records[collection].pop(key, None)
+            else:
+                self.records[collection][key] = version
+
+    def of(self, collection: str) -> int:
+        return self.collections[collection]
+
+    def of_record(self, collection: str, key: str, exists: bool) -> int:
+        if not exists:
+            return self.collections[collection]
+        return self.records[collection].get(key, 0)
+
+    def token(self, version: int) -> str:
+        return f"{self.epoch}:{version}"
+
+    def unchanged(self, token, version: int) -> bool:
+        """Whether token, from an earlier response, already covers version."""
+        if not isinstance(token, str):
+            return False
+        epoch, _, number = token.partition(":")
+        return epoch == self.epoch and number.isdigit() and int(number) >= version
+
+    def stats(self) -> dict:
+        return {"epoch": self.epoch, "collections": dict(self.collections), "versioned_records": {collection: len(records) for collection, records in self.records.items()}}
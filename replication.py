@@ -0,0 +1,385 @@
+from collections import deque
+from message_format_passer import MessageFormatPasser
+from protocols import Protocols, Words
+from storage_engine import META_COLLECTION, ROOM_ID_ALLOCATOR_KEY
+from typing import Iterable, Iterator
+import copy
+import json
+import socket
+import threading
+import time
+import uuid
+
+REPLICATION_PORT = 21360
+HEARTBEAT_INTERVAL = 0.5
+RECONNECT_INTERVAL = 1.0
+ACK_INTERVAL = 0.1
+CHUNK_BYTES = 48 * 1024
+"""Encoded entries per REPLICATE message, leaving room under LENGTH_LIMIT for the envelope."""
+
+KIND_SYNC_BEGIN = "sync_begin"  # a full copy follows; sequence is the batch it is current to
+KIND_ENTRIES = "entries"  # records of a full copy, or of a batch too large for one message
+KIND_SYNC_END = "sync_end"  # the full copy is complete; records the replica has that were not in it are deleted
+KIND_BATCH = "batch"  # the (last part of the) batch with this sequence
+KIND_HEARTBEAT = "heartbeat"  # nothing new; sequence is the primary's latest
+
+ROLE_PRIMARY = "primary"
+ROLE_REPLICA = "replica"
+
+
+def chunk_entries(entries: Iterable[list]) -> Iterator[list[list]]:
+    """Group entries into lists whose encoding stays under CHUNK_BYTES (a larger single entry gets a list of its own)."""
+    chunk = []
+    size = 0
+    for entry in entries:
+        entry_size = len(json.dumps(entry)) + 2
+        if chunk and size + entry_size > CHUNK_BYTES:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(entry)
+        size += entry_size
+    if chunk:
+        yield chunk
+
+
+class ReplicationLog:
+    """The primary's recent batches, numbered 1, 2, ... within this run, as [collection, key, value] entries.
+
+    Storage batches arrive through the flusher: stage() copies the records under the storage lock, publish() makes them
+    visible once they are on disk, so replicas only ever see durable data. Matches are appended directly, their log
+    having synced them already. Only the last max_batches batches are kept; a replica further behind gets a full copy."""
+    def __init__(self, max_batches: int = 10_000) -> None:
+        self.batches: deque[tuple[int, float, list]] = deque(maxlen=max_batches)  # (sequence, written at, entries)
+        self.last_sequence = 0
+        self.staged: list | None = None
+        self.condition = threading.Condition()
+
+    def stage(self, entries: list) -> None:
+        self.staged = entries
+
+    def publish(self) -> None:
+        if self.staged is not None:
+            self.append(self.staged)
+            self.staged = None
+
+    def append(self, entries: list) -> int:
+        with self.condition:
+            self.last_sequence += 1
+            self.batches.append((self.last_sequence, time.time(), entries))
+            self.condition.notify_all()
+            return self.last_sequence
+
+    def since(self, sequence: int) -> list[tuple[int, float, list]] | None:
+        """Batches after sequence, or None when some of them are no longer kept."""
+        with self.condition:
+            if sequence >= self.last_sequence:
+                return []
+            first = self.batches[0][0] if self.batches else self.last_sequence + 1
+            if sequence + 1 < first:
+                return None
+            return list(self.batches)[sequence + 1 - first:]
+
+    def wait(self, sequence: int, timeout: float) -> None:
+        """Return once there is a batch after sequence, or after timeout seconds."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_sequence > sequence, timeout)
+
+    def written_at(self, sequence: int) -> float | None:
+        with self.condition:
+            if not self.batches or not self.batches[0][0] <= sequence <= self.last_sequence:
+                return None
+            return self.batches[sequence - self.batches[0][0]][1]
+
+
+class ReplicaLink:
+    """What the primary knows about one connected replica."""
+    def __init__(self, replica_id: str, address: str) -> None:
+        self.replica_id = replica_id
+        self.address = address
+        self.state = KIND_SYNC_BEGIN
+        self.acked_sequence = 0
+        self.match_count = 0
+
+
+class ReplicationSource:
+    """Primary side: listens for replicas and streams them the ReplicationLog.
+
+    A replica subscribes with the run and sequence it has applied. If this run still keeps every batch after that it
+    resumes there; otherwise it gets a full copy: the current sequence S, then every user, room, the room id counter and
+    the matches it lacks, read in chunks under short read locks, then every batch after S. Batches carry whole records,
+    so one applied twice, or over newer data from the copy, is overwritten by the later batches again. Replicas
+    acknowledge what they have applied, which is how stats() knows their lag."""
+    def __init__(self, server, host: str = "127.0.0.1", port: int = REPLICATION_PORT, max_batches: int = 10_000) -> None:
+        self.server = server
+        self.storage = server.storage
+        self.source_id = uuid.uuid4().hex
+        self.log = ReplicationLog(max_batches)
+        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listen_socket.bind((host, port))
+        self.listen_socket.listen()
+        self.listen_socket.settimeout(1.0)
+        self.host, self.port = self.listen_socket.getsockname()
+        self.links: dict[MessageFormatPasser, ReplicaLink] = {}
+        self.links_lock = threading.Lock()
+        self.shutdown_event = threading.Event()
+        self.accept_thread = threading.Thread(target=self.accept_replicas, daemon=True)
+
+    def start(self) -> None:
+        """Hook into the storage flusher and accept replicas."""
+        self.storage.flusher.add_listener(self.capture, self.log.publish)
+        self.accept_thread.start()
+        print(f"Replication source listening on {self.host}:{self.port}")
+
+    def capture(self, batch: list[tuple[str, str, dict | None]]) -> None:
+        """Flusher stage step, under the storage lock. Engines may mark records dirty without their value, so the
+        current records are read here, and copied as later requests may change them in place."""
+        entries = []
+        for collection, key, _ in batch:
+            if collection == Words.Collection.USER:
+                entries.append([collection, key, self.storage.get_user(key)])
+            elif collection == Words.Collection.ROOM:
+                entries.append([collection, key, self.storage.get_room(key)])
+            elif collection == META_COLLECTION and key == ROOM_ID_ALLOCATOR_KEY:
+                entries.append([collection, key, self.storage.room_ids.state])
+        self.log.stage(copy.deepcopy(entries))
+
+    def publish_match(self, entry: dict) -> None:
+        self.log.append([[Words.Collection.GAMELOG, str(entry[Words.DataParamKey.MATCH_ID]), entry]])
+
+    def accept_replicas(self) -> None:
+        while not self.shutdown_event.is_set():
+            try:
+                sock, address = self.listen_socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self.serve_replica, args=(MessageFormatPasser(sock), f"{address[0]}:{address[1]}"), daemon=True).start()
+
+    def serve_replica(self, msgfmt_passer: MessageFormatPasser, address: str) -> None:
+        link = None
+        try:
+            replica_id, source_id, applied_sequence, match_count = msgfmt_passer.receive_args(Protocols.ReplicaToPrimary.SUBSCRIBE)
+            resume = source_id == self.source_id and self.log.since(applied_sequence) is not None
+            msgfmt_passer.send_args(Protocols.PrimaryToReplica.SUBSCRIBE_RESPONSE, self.source_id, not resume)
+            link = ReplicaLink(replica_id, address)
+            link.match_count = match_count
+            with self.links_lock:
+                self.links[msgfmt_passer] = link
+            print(f"Replica {replica_id} subscribed from {address} ({'resuming after ' + str(applied_sequence) if resume else 'full sync'}).")
+            threading.Thread(target=self.receive_acks, args=(msgfmt_passer, link), daemon=True).start()
+            position = applied_sequence if resume else self.send_full_copy(msgfmt_passer, link)
+            link.state = KIND_BATCH
+            while not self.shutdown_event.is_set():
+                batches = self.log.since(position)
+                if batches is None:
+                    link.state = KIND_SYNC_BEGIN
+                    position = self.send_full_copy(msgfmt_passer, link)
+                    link.state = KIND_BATCH
+                elif batches:
+                    for sequence, _, entries in batches:
+                        self.send_batch(msgfmt_passer, sequence, entries)
+                        position = sequence
+                else:
+                    self.log.wait(position, HEARTBEAT_INTERVAL)
+                    if self.log.last_sequence == position:
+                        msgfmt_passer.send_args(Protocols.PrimaryToReplica.REPLICATE, KIND_HEARTBEAT, position, [])
+        except Exception as e:
+            if not self.shutdown_event.is_set():
+                print(f"Replica {link.replica_id if link else address} disconnected: {e}")
+        with self.links_lock:
+            self.links.pop(msgfmt_passer, None)
+        msgfmt_passer.close()
+
+    def receive_acks(self, msgfmt_passer: MessageFormatPasser, link: ReplicaLink) -> None:
+        while not self.shutdown_event.is_set():
+            try:
+                link.acked_sequence, link.match_count = msgfmt_passer.receive_args(Protocols.ReplicaToPrimary.ACK)
+            except TimeoutError:
+                continue
+            except Exception:
+                break
+
+    def send_batch(self, msgfmt_passer: MessageFormatPasser, sequence: int, entries: list) -> None:
+        chunks = list(chunk_entries(entries)) or [[]]
+        for chunk in chunks[:-1]:
+            msgfmt_passer.send_args(Protocols.PrimaryToReplica.REPLICATE, KIND_ENTRIES, sequence, chunk)
+        msgfmt_passer.send_args(Protocols.PrimaryToReplica.REPLICATE, KIND_BATCH, sequence, chunks[-1])
+
+    def send_full_copy(self, msgfmt_passer: MessageFormatPasser, link: ReplicaLink) -> int:
+        """Send every record and the matches the replica lacks. Returns the sequence the copy is current to."""
+        sequence = self.log.last_sequence
+        msgfmt_passer.send_args(Protocols.PrimaryToReplica.REPLICATE, KIND_SYNC_BEGIN, sequence, [])
+        for chunk in chunk_entries(self.full_copy_entries(link.match_count)):
+            msgfmt_passer.send_args(Protocols.PrimaryToReplica.REPLICATE, KIND_ENTRIES, sequence, chunk)
+        msgfmt_passer.send_args(Protocols.PrimaryToReplica.REPLICATE, KIND_SYNC_END, sequence, [])
+        return sequence
+
+    def full_copy_entries(self, match_count: int, keys_per_lock: int = 500) -> Iterator[list]:
+        """Records are listed by key first and then read a few hundred at a time, so writers are never held up for
+        the whole copy."""
+        with self.storage.lock.hold(read=(Words.Collection.USER,)):
+            usernames = [username for username, _ in self.storage.iter_users()]
+        with self.storage.lock.hold(read=(Words.Collection.ROOM,)):
+            room_ids = [room_id for room_id, _ in self.storage.iter_rooms()]
+            yield [META_COLLECTION, ROOM_ID_ALLOCATOR_KEY, copy.deepcopy(self.storage.room_ids.state)]
+        for collection, keys, get in ((Words.Collection.USER, usernames, self.storage.get_user), (Words.Collection.ROOM, room_ids, self.storage.get_room)):
+            for start in range(0, len(keys), keys_per_lock):
+                with self.storage.lock.hold(read=(collection,)):
+                    records = [[collection, key, copy.deepcopy(get(key))] for key in keys[start:start + keys_per_lock]]
+                yield from records
+        for match_id in range(match_count + 1, len(self.server.match_log) + 1):
+            yield [Words.Collection.GAMELOG, str(match_id), self.server.match_log.get(match_id)]
+
+    def stats(self) -> dict:
+        now = time.time()
+        replicas = []
+        with self.links_lock:
+            links = list(self.links.values())
+        for link in links:
+            behind = self.log.last_sequence - link.acked_sequence
+            written_at = self.log.written_at(link.acked_sequence + 1) if behind > 0 else None
+            replicas.append({
+                "replica_id": link.replica_id,
+                "address": link.address,
+                "state": "syncing" if link.state == KIND_SYNC_BEGIN else "streaming",
+                "acked_sequence": link.acked_sequence,
+                "lag_batches": behind,
+                "lag_seconds": now - written_at if written_at is not None else 0.0,
+            })
+        return {"role": ROLE_PRIMARY, "source_id": self.source_id, "sequence": self.log.last_sequence, "replicas": replicas}
+
+    def close(self) -> None:
+        self.shutdown_event.set()
+        self.listen_socket.close()
+        with self.links_lock:
+            links = list(self.links)
+        for msgfmt_passer in links:
+            msgfmt_passer.close()
+
+
+class ReplicaClient:
+    """Replica side: follows a primary's ReplicationSource and applies its stream through server.apply_replicated,
+    reconnecting (and resuming, or copying everything again) whenever the connection drops.
+
+    Lag is reported both in batches (primary's latest sequence minus the applied one) and in seconds: zero while the
+    replica has applied everything the primary has announced and heard from it within two heartbeats, otherwise the
+    time since that was last true. fresh() decides whether the replica may answer queries."""
+    def __init__(self, server, host: str, port: int, replica_id: str) -> None:
+        self.server = server
+        self.host = host
+        self.port = port
+        self.replica_id = replica_id
+        self.source_id = ""
+        self.applied_sequence = 0
+        self.primary_sequence = 0
+        self.connected = False
+        self.syncing = False
+        self.sync_keys: dict[str, set[str]] = {}
+        self.in_sync_at: float | None = None
+        self.last_message_at = 0.0
+        self.last_ack_at = 0.0
+        self.msgfmt_passer: MessageFormatPasser | None = None
+        self.shutdown_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def resume_after(self, previous: "ReplicaClient") -> None:
+        """Continue where a stopped client for the same primary left off."""
+        self.source_id = previous.source_id
+        self.applied_sequence = previous.applied_sequence
+        self.primary_sequence = previous.primary_sequence
+        self.in_sync_at = previous.in_sync_at
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.shutdown_event.set()
+        if self.msgfmt_passer is not None:
+            self.msgfmt_passer.close()
+        self.thread.join()
+
+    def run(self) -> None:
+        while not self.shutdown_event.is_set():
+            try:
+                self.follow()
+            except Exception as e:
+                if not self.shutdown_event.is_set():
+                    print(f"Replication from {self.host}:{self.port} interrupted: {e}")
+            self.connected = False
+            self.syncing = False
+            self.shutdown_event.wait(RECONNECT_INTERVAL)
+
+    def follow(self) -> None:
+        self.msgfmt_passer = MessageFormatPasser(timeout=HEARTBEAT_INTERVAL * 4)
+        self.msgfmt_passer.connect(self.host, self.port)
+        self.msgfmt_passer.send_args(Protocols.ReplicaToPrimary.SUBSCRIBE, self.replica_id, self.source_id, self.applied_sequence, len(self.server.match_log))
+        self.source_id, full_sync = self.msgfmt_passer.receive_args(Protocols.PrimaryToReplica.SUBSCRIBE_RESPONSE)
+        if full_sync:
+            self.applied_sequence = 0
+            self.primary_sequence = 0
+        self.connected = True
+        print(f"Replicating from {self.host}:{self.port} ({'full sync' if full_sync else 'resuming after ' + str(self.applied_sequence)}).")
+        while not self.shutdown_event.is_set():
+            kind, sequence, entries = self.msgfmt_passer.receive_args(Protocols.PrimaryToReplica.REPLICATE)
+            self.handle(kind, sequence, entries)
+
+    def handle(self, kind: str, sequence: int, entries: list) -> None:
+        if kind == KIND_SYNC_BEGIN:
+            self.syncing = True
+            self.sync_keys = {Words.Collection.USER: set(), Words.Collection.ROOM: set()}
+        elif kind in (KIND_ENTRIES, KIND_BATCH):
+            self.server.apply_replicated(entries)
+            if self.syncing:
+                for collection, key, _ in entries:
+                    if collection in self.sync_keys:
+                        self.sync_keys[collection].add(key)
+            if kind == KIND_BATCH:
+                self.applied_sequence = sequence
+        elif kind == KIND_SYNC_END:
+            self.drop_missing()
+            self.syncing = False
+            self.sync_keys = {}
+            self.applied_sequence = sequence
+        self.primary_sequence = max(self.primary_sequence, sequence)
+        now = time.time()
+        self.last_message_at = now
+        if not self.syncing and self.applied_sequence >= self.primary_sequence:
+            self.in_sync_at = now
+        if kind in (KIND_SYNC_END, KIND_HEARTBEAT) or (kind == KIND_BATCH and now - self.last_ack_at >= ACK_INTERVAL):
+            self.msgfmt_passer.send_args(Protocols.ReplicaToPrimary.ACK, self.applied_sequence, len(self.server.match_log))
+            self.last_ack_at = now
+
+    def drop_missing(self) -> None:
+        """After a full copy, delete the users and rooms it did not contain."""
+        storage = self.server.storage
+        with storage.lock.hold(read=(Words.Collection.USER, Words.Collection.ROOM)):
+            missing = [[Words.Collection.USER, username, None] for username, _ in storage.iter_users() if username not in self.sync_keys[Words.Collection.USER]]
+            missing += [[Words.Collection.ROOM, room_id, None] for room_id, _ in storage.iter_rooms() if room_id not in self.sync_keys[Words.Collection.ROOM]]
+        if missing:
+            self.server.apply_replicated(missing)
+
+    def lag_seconds(self) -> float:
+        now = time.time()
+        if self.connected and not self.syncing and self.applied_sequence >= self.primary_sequence and now - self.last_message_at <= 2 * HEARTBEAT_INTERVAL:
+            return 0.0
+        return now - self.in_sync_at if self.in_sync_at is not None else float("inf")
+
+    def fresh(self, max_lag: float) -> bool:
+        return self.lag_seconds() <= max_lag
+
+    def stats(self) -> dict:
+        lag_seconds = self.lag_seconds()
+        return {
+            "role": ROLE_REPLICA,
+            "primary": f"{self.host}:{self.port}",
+            "connected": self.connected,
+            "syncing": self.syncing,
+            "source_id": self.source_id,
+            "applied_sequence": self.applied_sequence,
+            "primary_sequence": self.primary_sequence,
+            "lag_batches": max(self.primary_sequence - self.applied_sequence, 0),
+            "lag_seconds": lag_seconds if lag_seconds != float("inf") else None,
+        }
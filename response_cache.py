@@ -0,0 +1,79 @@
+import json
+import threading
+from message_format import EncodedJson
+from protocols import Words
+from record_versions import RecordVersions
+
+CACHED_COLLECTIONS = (Words.Collection.USER, Words.Collection.ROOM)
+"""Collections whose QUERY responses are cached. Their answers depend on that collection's records only, and each
+has a version in RecordVersions."""
+
+
+class ResponseCache:
+    """Encoded responses of read queries, so a repeated query costs a dict lookup instead of a filter and a json.dumps.
+
+    Entries are keyed by (collection, action, normalized filter) and hold the response data already encoded as JSON,
+    which MessageFormat.to_json() splices into the response message. Every write to a collection bumps its version in
+    versions (DatabaseServer.put_user, put_room, delete_room); an entry remembers the version it was built at and is
+    served only while that is still the collection's version, so a write invalidates exactly the responses of its own
+    collection, and nothing has to be looked up or deleted on the write path.
+
+    A response must be built at the version read before the query ran, while the caller holds at least a read lock on
+    the collection; a write racing a lock-free reader then only leaves an entry that is never served."""
+    def __init__(self, versions: RecordVersions, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self.versions = versions
+        self.entries: dict[tuple[str, str, str], tuple[int, str, EncodedJson]] = {}  # {key: (version, result, data)}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_of(collection: str, action: str, data: dict) -> tuple[str, str, str] | None:
+        """The cache key of a request, or None if its response is not cached."""
+        if action != Words.Action.QUERY or collection not in CACHED_COLLECTIONS:
+            return None
+        try:
+            return collection, action, json.dumps(data, sort_keys=True, separators=(",", ":"))
+        except TypeError:  # keys of mixed types cannot be sorted
+            return None
+
+    def get(self, key: tuple[str, str, str]) -> tuple[str, EncodedJson] | None:
+        """The cached (result, encoded data) of a request, if still current."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == self.versions.of(key[0]):
+                self.hits += 1
+                return entry[1], entry[2]
+            if entry is not None:
+                del self.entries[key]
+                self.stale += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple[str, str, str], version: int, result: str, data: dict) -> EncodedJson:
+        """Encode a response built at version and cache it. Returns the encoding, to send in place of data."""
+        encoded = EncodedJson(json.dumps(data))
+        with self.lock:
+            if version != self.versions.of(key[0]) or self.max_entries <= 0:
+                return encoded  # a write got in while the response was built, or caching is off
+            if key not in self.entries and len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]  # the oldest entry
+                self.evictions += 1
+            self.entries[key] = (version, result, encoded)
+        return encoded
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "encoded_bytes": sum(len(entry[2]) for entry in self.entries.values()),
+            }
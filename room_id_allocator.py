@@ -0,0 +1,42 @@
+from typing import Callable
+
+
+class RoomIdAllocator:
+    """Hands out room ids in O(1).
+
+    New ids come from a monotonic counter. With reuse enabled, ids of deleted rooms go to a free-list and are handed
+    out again first (most recently freed first). Ids that already belong to a room, e.g. rooms imported from an older
+    database, are skipped, so two creations never get the same id. The caller must hold its storage lock across
+    allocate() and storing the new room.
+
+    self.state is the JSON form the engines persist. It is updated in place, so an engine can mark it dirty once per
+    change and serialize it when its batch is written rather than on every allocation."""
+    def __init__(self, reuse: bool = False) -> None:
+        self.reuse = reuse
+        self.state = {"next_id": 0, "free_ids": []}
+
+    def allocate(self, exists: Callable[[str], bool]) -> str:
+        free_ids = self.state["free_ids"]
+        while self.reuse and free_ids:
+            room_id = free_ids.pop()
+            if not exists(room_id):
+                return room_id
+        while True:
+            room_id = str(self.state["next_id"])
+            self.state["next_id"] += 1
+            if not exists(room_id):
+                return room_id
+
+    def release(self, room_id: str) -> bool:
+        """Returns whether the state changed."""
+        if not self.reuse:
+            return False
+        self.state["free_ids"].append(room_id)
+        return True
+
+    def load(self, state: dict | None) -> None:
+        if not state:
+            return
+        self.state["next_id"] = max(self.state["next_id"], state.get("next_id", 0))
+        if self.reuse:
+            self.state["free_ids"] = list(state.get("free_ids", []))
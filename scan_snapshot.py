@@ -0,0 +1,106 @@
+from secondary_index import record_matches
+from typing import Callable, Iterator, Mapping
+import heapq
+import sys
+import threading
+import time
+
+_ABSENT = object()
+
+
+class ScanSnapshot:
+    """A point-in-time view of one collection, for a scan that runs after the collection lock is released.
+
+    Opening one copies only the keys to scan (all of them, or those an index selected for the criteria). Writers then
+    copy on write: before a record is replaced or deleted, the engine hands its current value to every open snapshot
+    of the collection (preserve), and a snapshot keeps the first value it gets for each key. Reads return that value
+    if there is one and the live record otherwise, so a scan sees every record as it was when the snapshot opened
+    while writes go on. The engine must never change a live record in place while a snapshot is open."""
+    def __init__(self, collection: str, records: Mapping[str, dict], keys: list[str], field_getters: dict[str, Callable[[dict], object]]) -> None:
+        self.collection = collection
+        self.records = records
+        self.keys = keys
+        self.field_getters = field_getters
+        self.before: dict[str, dict | None] = {}  # {key: the record when the snapshot opened, None if it did not exist}
+        self.opened_at = time.monotonic()
+
+    def preserve(self, key: str, record: dict | None) -> None:
+        self.before.setdefault(key, record)
+
+    def get(self, key: str) -> dict | None:
+        # Live record first: a writer preserves before it replaces, so a replaced record is always in before by then.
+        live = self.records.get(key)
+        before = self.before.get(key, _ABSENT)
+        return live if before is _ABSENT else before
+
+    def items(self) -> Iterator[tuple[str, dict]]:
+        for key in self.keys:
+            record = self.get(key)
+            if record is not None:
+                yield key, record
+
+    def select(self, criteria: dict) -> dict[str, dict]:
+        return {key: record for key, record in self.items() if record_matches(record, criteria, self.field_getters)}
+
+    def after(self, cursor: str | None, limit: int) -> list[tuple[str, dict]]:
+        """As StorageEngine.users_after, on the snapshot."""
+        keys = heapq.nsmallest(limit, (key for key in self.keys if (cursor is None or key > cursor) and self.get(key) is not None))
+        return [(key, self.get(key)) for key in keys]
+
+    def overhead_bytes(self) -> int:
+        """Memory the snapshot holds beyond the collection: the key list and the preserved records (shallow sizes)."""
+        before = dict(self.before)
+        return sys.getsizeof(self.keys) + sys.getsizeof(before) + sum(sys.getsizeof(record) for record in before.values() if record is not None)
+
+
+class SnapshotRegistry:
+    """The open ScanSnapshots of an engine, per collection, and what they have cost."""
+    def __init__(self) -> None:
+        self.open: dict[str, list[ScanSnapshot]] = {}
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.keys_copied = 0
+        self.records_preserved = 0
+        self.peak_open = 0
+        self.peak_overhead_bytes = 0
+        self.longest_open_seconds = 0.0
+
+    def add(self, snapshot: ScanSnapshot) -> None:
+        with self.lock:
+            self.open[snapshot.collection] = self.open.get(snapshot.collection, []) + [snapshot]  # replaced, never changed: preserve() reads it unlocked
+            self.opened += 1
+            self.keys_copied += len(snapshot.keys)
+            self.peak_open = max(self.peak_open, sum(len(snapshots) for snapshots in self.open.values()))
+
+    def remove(self, snapshot: ScanSnapshot) -> None:
+        overhead = snapshot.overhead_bytes()
+        with self.lock:
+            self.open[snapshot.collection] = [other for other in self.open[snapshot.collection] if other is not snapshot]
+            self.records_preserved += len(snapshot.before)
+            self.peak_overhead_bytes = max(self.peak_overhead_bytes, overhead)
+            self.longest_open_seconds = max(self.longest_open_seconds, time.monotonic() - snapshot.opened_at)
+
+    def active(self, collection: str) -> bool:
+        return bool(self.open.get(collection))
+
+    def preserve(self, collection: str, key: str, records: Mapping[str, dict]) -> None:
+        """Called by a writer, before it replaces or deletes records[key]."""
+        snapshots = self.open.get(collection)
+        if snapshots:
+            record = records.get(key)
+            for snapshot in snapshots:
+                snapshot.preserve(key, record)
+
+    def stats(self) -> dict:
+        with self.lock:
+            open_snapshots = [snapshot for snapshots in self.open.values() for snapshot in snapshots]
+            return {
+                "open": len(open_snapshots),
+                "open_overhead_bytes": sum(snapshot.overhead_bytes() for snapshot in open_snapshots),
+                "opened": self.opened,
+                "keys_copied": self.keys_copied,
+                "records_preserved": self.records_preserved,
+                "peak_open": self.peak_open,
+                "peak_overhead_bytes": self.peak_overhead_bytes,
+                "longest_open_seconds": self.longest_open_seconds,
+            }
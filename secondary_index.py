@@ -0,0 +1,205 @@
+from protocols import Words
+from typing import Callable, Iterable, Mapping
+import threading
+
+
+def record_field(record: dict, field: str, field_getters: dict[str, Callable[[dict], object]]):
+    """Value a query criterion on field is compared with. Most fields are top-level keys; field_getters covers the rest."""
+    getter = field_getters.get(field)
+    return getter(record) if getter is not None else record.get(field)
+
+
+OPERATORS: dict[str, Callable[[object, object], bool]] = {
+    Words.Operator.EQ: lambda value, operand: value == operand,
+    Words.Operator.NE: lambda value, operand: value != operand,
+    Words.Operator.GT: lambda value, operand: value is not None and value > operand,
+    Words.Operator.GTE: lambda value, operand: value is not None and value >= operand,
+    Words.Operator.LT: lambda value, operand: value is not None and value < operand,
+    Words.Operator.LTE: lambda value, operand: value is not None and value <= operand,
+    Words.Operator.IN: lambda value, operand: value in operand,
+    Words.Operator.NIN: lambda value, operand: value not in operand,
+    Words.Operator.SIZE: lambda value, operand: isinstance(value, list) and len(value) == operand,
+}
+
+
+def is_condition(value) -> bool:
+    """Whether a criterion value is an operator condition such as {"$gt": 3} rather than a value to compare equal."""
+    return isinstance(value, dict) and bool(value) and all(key in OPERATORS for key in value)
+
+
+def value_matches(value, condition) -> bool:
+    if not is_condition(condition):
+        return value == condition
+    try:
+        return all(OPERATORS[operator](value, operand) for operator, operand in condition.items())
+    except TypeError:  # ordering values of different types, e.g. a string against a number
+        return False
+
+
+def record_matches(record: dict, criteria: dict, field_getters: dict[str, Callable[[dict], object]]) -> bool:
+    return all(value_matches(record_field(record, field, field_getters), condition) for field, condition in criteria.items())
+
+
+def is_indexable(value) -> bool:
+    return value is None or isinstance(value, (str, bool, int))
+
+
+def index_values(condition) -> list | None:
+    """Values an equality index can look a condition up by: a plain value, $eq or $in. None if it cannot."""
+    if not is_condition(condition):
+        values = [condition]
+    elif Words.Operator.EQ in condition:
+        values = [condition[Words.Operator.EQ]]
+    elif Words.Operator.IN in condition and isinstance(condition[Words.Operator.IN], list):
+        values = condition[Words.Operator.IN]
+    else:
+        return None
+    return values if all(is_indexable(value) for value in values) else None
+
+
+class SecondaryIndex:
+    """Maps the value of one field to the keys of the records holding it.
+
+    The index remembers the value it filed each key under, so records changed in place can be refiled by update()
+    without knowing their old contents. Values that are not hashable scalars are not indexed."""
+    def __init__(self, field: str, getter: Callable[[dict], object]) -> None:
+        self.field = field
+        self.getter = getter
+        self.buckets: dict[object, set[str]] = {}
+        self.filed_values: dict[str, object] = {}
+
+    def update(self, key: str, record: dict) -> None:
+        value = self.getter(record)
+        if not is_indexable(value):
+            self.remove(key)
+            return
+        if key in self.filed_values:
+            old_value = self.filed_values[key]
+            if old_value == value and type(old_value) is type(value):
+                return
+            self.remove(key)
+        self.buckets.setdefault(value, set()).add(key)
+        self.filed_values[key] = value
+
+    def remove(self, key: str) -> None:
+        if key not in self.filed_values:
+            return
+        value = self.filed_values.pop(key)
+        bucket = self.buckets[value]
+        bucket.discard(key)
+        if not bucket:
+            del self.buckets[value]
+
+    def lookup(self, value) -> set[str]:
+        return self.buckets.get(value, set())
+
+    def lookup_any(self, values: list) -> set[str]:
+        if len(values) == 1:
+            return self.lookup(values[0])
+        return set().union(*(self.lookup(value) for value in values))
+
+    def rebuild(self, records: Iterable[tuple[str, dict]]) -> None:
+        self.buckets = {}
+        self.filed_values = {}
+        for key, record in records:
+            self.update(key, record)
+
+
+class QueryPlanner:
+    """Answers queries on one collection, through the most selective matching index when there is one.
+
+    Indexes serve equality and $in conditions. Every candidate is still checked against the whole filter, so an index
+    only has to narrow the search down.
+
+    With build=False the indexes start empty and not ready, and queries scan until load() and mark_ready() have run;
+    that is how engines that read records lazily build them in the background."""
+    def __init__(self, records: Mapping[str, dict], indexed_fields: list[str], field_getters: dict[str, Callable[[dict], object]] | None = None,
+                 build: bool = True) -> None:
+        self.records = records
+        self.field_getters = field_getters or {}
+        self.indexed_fields = list(indexed_fields)
+        self.indexes = self.new_indexes()
+        self.ready = build
+        self.index_hits = 0
+        self.full_scans = 0
+        self.examined = 0
+        self.stats_lock = threading.Lock()
+        if build:
+            self.rebuild()
+
+    def new_indexes(self) -> dict[str, SecondaryIndex]:
+        return {field: SecondaryIndex(field, lambda record, field=field: record_field(record, field, self.field_getters)) for field in self.indexed_fields}
+
+    def rebuild(self) -> None:
+        for index in self.indexes.values():
+            index.rebuild(self.records.items())
+
+    def load(self, records: Iterable[tuple[str, dict]]) -> None:
+        """Index records into fresh indexes, then swap them in."""
+        indexes = self.new_indexes()
+        for key, record in records:
+            for index in indexes.values():
+                index.update(key, record)
+        self.indexes = indexes
+
+    def refresh(self, key: str, record: dict | None) -> None:
+        if record is None:
+            self.remove(key)
+        else:
+            self.update(key, record)
+
+    def mark_ready(self) -> None:
+        self.ready = True
+
+    def update(self, key: str, record: dict) -> None:
+        for index in self.indexes.values():
+            index.update(key, record)
+
+    def remove(self, key: str) -> None:
+        for index in self.indexes.values():
+            index.remove(key)
+
+    def candidate_keys(self, criteria: dict):
+        """Keys from the most selective index that serves the criteria, or None if a full scan is needed."""
+        best_keys = None
+        for field, condition in criteria.items():
+            values = index_values(condition) if self.ready and field in self.indexes else None
+            if values is not None:
+                keys = self.indexes[field].lookup_any(values)
+                if best_keys is None or len(keys) < len(best_keys):
+                    best_keys = keys
+        return best_keys
+
+    def count(self, indexed: bool, examined: int) -> None:
+        with self.stats_lock:
+            if indexed:
+                self.index_hits += 1
+            else:
+                self.full_scans += 1
+            self.examined += examined
+
+    def query(self, criteria: dict) -> dict[str, dict]:
+        best_keys = self.candidate_keys(criteria)
+        if best_keys is None:
+            candidates = self.records.items()
+        else:
+            candidates = ((key, self.records[key]) for key in best_keys)
+        result = {}
+        examined = 0
+        for key, record in candidates:
+            examined += 1
+            if record_matches(record, criteria, self.field_getters):
+                result[key] = record
+        self.count(best_keys is not None, examined)
+        return result
+
+    def stats(self) -> dict:
+        queries = self.index_hits + self.full_scans
+        return {
+            "index_hits": self.index_hits,
+            "full_scans": self.full_scans,
+            "hit_rate": self.index_hits / queries if queries else 0.0,
+            "records_examined": self.examined,
+            "index_buckets": {field: len(index.buckets) for field, index in self.indexes.items()},
+            "ready": self.ready,
+        }
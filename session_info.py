@@ -0,0 +1,32 @@
+from message_format_passer import MessageFormatPasser
+from collections import deque
+import time
+
+class SessionInfo:
+    """A logged-in lobby session. It outlives its connection for a grace period so the client can resume it.
+
+    Events for the user while it is detached are kept in pending_events, up to MAX_PENDING_EVENTS (the oldest are
+    dropped first), to be replayed once it is resumed."""
+    MAX_PENDING_EVENTS = 32
+
+    def __init__(self, token: str, username: str, msgfmt_passer: MessageFormatPasser | None) -> None:
+        self.token = token
+        self.username = username
+        self.msgfmt_passer = msgfmt_passer
+        self.disconnected_at: float | None = None  # None means the session is attached to a live connection
+        self.pending_events: deque[tuple[str, dict]] = deque(maxlen=SessionInfo.MAX_PENDING_EVENTS)  # (event_type, data)
+
+    def detach(self) -> None:
+        self.msgfmt_passer = None
+        self.disconnected_at = time.time()
+
+    def attach(self, msgfmt_passer: MessageFormatPasser) -> list[tuple[str, dict]]:
+        """Reattach to a new connection. Returns the events kept while detached, oldest first."""
+        self.msgfmt_passer = msgfmt_passer
+        self.disconnected_at = None
+        pending_events = list(self.pending_events)
+        self.pending_events.clear()
+        return pending_events
+
+    def is_expired(self, grace_period: float) -> bool:
+        return self.disconnected_at is not None and time.time() - self.disconnected_at >= grace_period
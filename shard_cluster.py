@@ -0,0 +1,140 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from message_format_passer import MessageFormatPasser
+from protocols import Protocols, Words
+from shard_map import ShardMap, SHARD_MAP_FILE
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_process(name: str, args: list[str], directory: str) -> subprocess.Popen:
+    log = open(os.path.join(directory, f"{name}.log"), 'w')
+    return subprocess.Popen([sys.executable, "-u", *args], cwd=HERE, stdin=subprocess.PIPE, stdout=log, stderr=subprocess.STDOUT, text=True)
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    try:
+        process.stdin.write("stop\n")
+        process.stdin.flush()
+        process.wait(timeout=15)
+    except (OSError, subprocess.TimeoutExpired):
+        process.kill()
+
+
+class Client:
+    """A lobby client without the UI: sends a command and returns its response, skipping events."""
+    def __init__(self, port: int) -> None:
+        self.msgfmt_passer = MessageFormatPasser(timeout=30.0)
+        self.msgfmt_passer.connect("127.0.0.1", port)
+        self.msgfmt_passer.send_args(Protocols.ConnectionToLobby.HANDSHAKE, Words.ConnectionType.CLIENT)
+        result, message = self.msgfmt_passer.receive_args(Protocols.LobbyToConnection.HANDSHAKE_RESPONSE)
+        if result != Words.Result.CONFIRMED:
+            raise ConnectionError(message)
+
+    def command(self, command: str, params: dict) -> tuple[str, dict]:
+        self.msgfmt_passer.send_args(Protocols.ClientToLobby.COMMAND, command, params)
+        while True:
+            message_type, responding_command, _, result, data = self.msgfmt_passer.receive_args(Protocols.LobbyToClient.MESSAGE)
+            if message_type == Words.MessageType.RESPONSE and responding_command == command:
+                return result, data
+
+    def close(self) -> None:
+        self.msgfmt_passer.send_args(Protocols.ClientToLobby.COMMAND, Words.Command.EXIT, {})
+        self.msgfmt_passer.close()
+
+
+def expect(description: str, outcome: tuple[str, dict], result: str) -> dict:
+    ok = outcome[0] == result
+    print(f"{'ok  ' if ok else 'FAIL'} {description}: {outcome[0]} {outcome[1].get(Words.DataParamKey.MESSAGE, '')}")
+    if not ok:
+        raise AssertionError(f"{description}: expected {result}, got {outcome}")
+    return outcome[1]
+
+
+def check(port: int, shard_map: ShardMap) -> None:
+    """Room flows whose players and room live on different shards, through a lobby, as the UI client drives them."""
+    deadline = time.time() + 30
+    while True:
+        probe = Client(port)
+        result, _ = probe.command(Words.Command.CHECK_USERNAME, {Words.DataParamKey.USERNAME: "probe"})
+        probe.close()
+        if result != Words.Result.ERROR:
+            break
+        if time.time() > deadline:
+            raise TimeoutError("The shards did not all connect to the lobby.")
+        time.sleep(0.5)
+
+    run = str(int(time.time()))
+    names = [f"player{i}_{run}" for i in range(4)]
+    print("users: " + ", ".join(f"{name} on shard {shard_map.shard_of(name)}" for name in names) + f"; rooms on shard {shard_map.room_shard}")
+    clients = {}
+    for name in names:
+        clients[name] = Client(port)
+        expect(f"register {name}", clients[name].command(Words.Command.REGISTER, {Words.DataParamKey.USERNAME: name, Words.DataParamKey.PASSWORD: "pw"}), Words.Result.SUCCESS)
+        expect(f"login {name}", clients[name].command(Words.Command.LOGIN, {Words.DataParamKey.USERNAME: name, Words.DataParamKey.PASSWORD: "pw"}), Words.Result.SUCCESS)
+    owner, guest, late, watcher = names
+    room_id = expect("create room", clients[owner].command(Words.Command.CREATE_ROOM, {Words.DataParamKey.PRIVACY: "public"}), Words.Result.SUCCESS)[Words.DataParamKey.ROOM_ID]
+    expect("join room", clients[guest].command(Words.Command.JOIN_ROOM, {Words.DataParamKey.ROOM_ID: room_id}), Words.Result.SUCCESS)
+    expect("join full room", clients[late].command(Words.Command.JOIN_ROOM, {Words.DataParamKey.ROOM_ID: room_id}), Words.Result.FAILURE)
+    expect("spectate room", clients[watcher].command(Words.Command.SPECTATE_ROOM, {Words.DataParamKey.ROOM_ID: room_id}), Words.Result.SUCCESS)
+    free = expect("online users outside rooms", clients[late].command(Words.Command.CHECK_ONLINE_USERS, {}), Words.Result.SUCCESS)[Words.DataParamKey.USERS]
+    if set(names) & set(free) != {late}:
+        raise AssertionError(f"Only {late} should be free after the refused join, got {free}")
+    expect("owner leaves", clients[owner].command(Words.Command.LEAVE_ROOM, {Words.DataParamKey.ROOM_ID: room_id}), Words.Result.SUCCESS)
+    expect("last player leaves", clients[guest].command(Words.Command.LEAVE_ROOM, {Words.DataParamKey.ROOM_ID: room_id}), Words.Result.SUCCESS)
+    free = expect("online users outside rooms", clients[late].command(Words.Command.CHECK_ONLINE_USERS, {}), Words.Result.SUCCESS)[Words.DataParamKey.USERS]
+    if not set(names) <= set(free):
+        raise AssertionError(f"Everyone, the spectator of the deleted room included, should be free, got {free}")
+    leaderboard = expect("leaderboard", clients[owner].command(Words.Command.LEADERBOARD, {}), Words.Result.SUCCESS)
+    if leaderboard.get(Words.DataParamKey.RANK) is None:
+        raise AssertionError(f"{owner} should have a rank on the merged leaderboard, got {leaderboard}")
+    for name in names:
+        expect(f"logout {name}", clients[name].command(Words.Command.LOGOUT, {}), Words.Result.SUCCESS)
+        clients[name].close()
+    print("All checks passed.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a sharded database on localhost: one database server process per shard, optionally with a lobby.")
+    parser.add_argument("--shards", type=int, default=3)
+    parser.add_argument("--room-shard", type=int, default=0)
+    parser.add_argument("--dir", default="shard_cluster", help="shard map, logs and each shard's data go here")
+    parser.add_argument("--engine", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--lobby-port", type=int, default=21354)
+    parser.add_argument("--lobby", action="store_true", help="also start a lobby using the shards")
+    parser.add_argument("--check", action="store_true", help="start a lobby, run cross-shard room flows through it, and stop")
+    args = parser.parse_args()
+
+    directory = os.path.abspath(args.dir)
+    os.makedirs(directory, exist_ok=True)
+    shard_map = ShardMap(args.shards, args.room_shard)
+    map_path = os.path.join(directory, SHARD_MAP_FILE)
+    shard_map.save(map_path)
+
+    processes = []
+    if args.lobby or args.check:
+        processes.append(start_process("lobby", ["lobby_server_main.py", "--host", "127.0.0.1", "--port", str(args.lobby_port), "--shard-map", map_path], directory))
+        time.sleep(1.0)  # the shards connect to the lobby, so it must be listening first
+    for shard_index in range(args.shards):
+        shard_dir = os.path.join(directory, f"shard{shard_index}")
+        os.makedirs(shard_dir, exist_ok=True)
+        processes.append(start_process(f"shard{shard_index}", ["database_server_main.py", "--port", str(args.lobby_port), "--engine", args.engine,
+                                                              "--shard-map", map_path, "--shard", str(shard_index), "--data-dir", shard_dir,
+                                                              "--match-log-dir", os.path.join(shard_dir, "match_log"),
+                                                              "--sqlite-path", os.path.join(shard_dir, "db.sqlite3")], directory))
+    print(f"Started {args.shards} shards (map: {map_path}, logs in {directory}).")
+    try:
+        if args.check:
+            check(args.lobby_port, shard_map)
+        else:
+            input("Press Enter to stop the shards.\n")
+    finally:
+        for process in reversed(processes):
+            stop_process(process)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import json
+import zlib
+
+SHARD_MAP_FILE = 'shard_map.json'
+
+
+class ShardMap:
+    """Which database server shard owns which records.
+
+    Users are spread over shard_count shards by a CRC-32 of the username. Python's hash() is salted per process, so
+    it cannot be used: the lobby and every shard must agree on the owner of a username. Rooms, the room id allocator
+    and the gamelog are not split; they all live on room_shard, which also holds its own share of the users.
+
+    The lobby and every shard are started with the same map file, e.g. {"shard_count": 3, "room_shard": 0}. Each
+    shard tells the lobby its map when it connects, and the lobby refuses a shard whose map differs from its own.
+    Changing shard_count moves most users to another shard, so it needs the data moved first (not done online)."""
+    def __init__(self, shard_count: int, room_shard: int = 0) -> None:
+        if shard_count < 1:
+            raise ValueError("A shard map needs at least one shard.")
+        if not 0 <= room_shard < shard_count:
+            raise ValueError(f"room_shard must be between 0 and {shard_count - 1}.")
+        self.shard_count = shard_count
+        self.room_shard = room_shard
+
+    @classmethod
+    def load(cls, path: str = SHARD_MAP_FILE) -> "ShardMap":
+        with open(path, 'r') as f:
+            config = json.load(f)
+        return cls(int(config["shard_count"]), int(config.get("room_shard", 0)))
+
+    def save(self, path: str = SHARD_MAP_FILE) -> None:
+        with open(path, 'w') as f:
+            json.dump({"shard_count": self.shard_count, "room_shard": self.room_shard}, f, indent=4)
+
+    def shard_of(self, username: str) -> int:
+        return zlib.crc32(username.encode("utf-8")) % self.shard_count
+
+    def matches(self, shard_count: int, room_shard: int) -> bool:
+        return (shard_count, room_shard) == (self.shard_count, self.room_shard)
@@ -0,0 +1,388 @@
+from message_format_passer import MessageFormatPasser
+from protocols import Protocols, Words
+from shard_map import ShardMap
+from db_query import Query
+from secondary_index import is_condition
+from storage_engine import USER_FIELD_GETTERS
+from leaderboard import Leaderboard, BOARD_WINS
+from database_server import DatabaseServer
+import json
+import threading
+import uuid
+
+
+class ShardRouter:
+    """The lobby's side of a sharded database: one DatabaseServer per shard of a ShardMap, each holding the users
+    whose username hashes to it, and the room shard also holding the rooms and the gamelog.
+
+    execute() takes a request as the lobby sends it to a single database server and returns the response that server
+    would give. Requests about one user go to that user's shard, and rooms and matches to the room shard. USER queries
+    without a username and the leaderboard ask every shard and merge the answers.
+
+    A room action that moves a user in or out of a room changes two shards, and runs as a short saga. Joining claims
+    the user on their shard first (CLAIM_ROOM checks they are online and in no room) and then adds them on the room
+    shard; if the room refuses, the claim is released again (RELEASE_ROOM only clears the room it was given, so it
+    cannot undo a concurrent join). Leaving changes the room first and then releases the users. Between the two steps
+    a user record can point at a room that does not list the user; a shard failing in between leaves it so until the
+    user logs out, which clears it.
+
+    Every method blocks until the shards answered, so the lobby calls execute() off its receiving threads."""
+    REQUEST_TIMEOUT = 30.0
+
+    def __init__(self, shard_map: ShardMap) -> None:
+        self.shard_map = shard_map
+        self.passers: list[MessageFormatPasser | None] = [None] * shard_map.shard_count
+        self.passer_lock = threading.Lock()
+        self.pending: dict[str, list] = {}  # {request_id: [event, shard, result, data]}, result None if the shard left
+        self.pending_lock = threading.Lock()
+        self.ranking = Leaderboard()
+        """Empty; orders merged leaderboard entries the way the shards' leaderboards do."""
+
+    def attach(self, shard_index: int, shard_count: int, room_shard: int, msgfmt_passer: MessageFormatPasser) -> str | None:
+        """Register a shard that connected. Returns why it is refused, or None."""
+        if not self.shard_map.matches(shard_count, room_shard):
+            return f"Shard map mismatch: the lobby has {self.shard_map.shard_count} shards with rooms on shard {self.shard_map.room_shard}."
+        if not 0 <= shard_index < self.shard_map.shard_count:
+            return f"No shard {shard_index} in the shard map."
+        with self.passer_lock:
+            if self.passers[shard_index] is not None:
+                return f"Database shard {shard_index} is already connected."
+            self.passers[shard_index] = msgfmt_passer
+        return None
+
+    def detach(self, shard_index: int) -> None:
+        """Forget a shard that disconnected, failing the requests it did not answer."""
+        with self.passer_lock:
+            self.passers[shard_index] = None
+        with self.pending_lock:
+            for slot in self.pending.values():
+                if slot[1] == shard_index and not slot[0].is_set():
+                    slot[0].set()
+
+    def connected(self) -> bool:
+        return all(msgfmt_passer is not None for msgfmt_passer in self.passers)
+
+    def deliver(self, request_id: str, result: str, data: dict) -> None:
+        with self.pending_lock:
+            slot = self.pending.get(request_id)
+        if slot is not None:
+            slot[2], slot[3] = result, data
+            slot[0].set()
+
+    def send(self, shard_index: int, collection: str, action: str, data: dict) -> str:
+        msgfmt_passer = self.passers[shard_index]
+        if msgfmt_passer is None:
+            raise ConnectionError(f"Database shard {shard_index} is not connected.")
+        request_id = str(uuid.uuid4())
+        with self.pending_lock:
+            self.pending[request_id] = [threading.Event(), shard_index, None, None]
+        try:
+            msgfmt_passer.send_args(Protocols.LobbyToDB.REQUEST, request_id, collection, action, data)
+        except Exception:
+            with self.pending_lock:
+                del self.pending[request_id]
+            raise
+        return request_id
+
+    def wait(self, request_id: str) -> tuple[str, dict]:
+        with self.pending_lock:
+            slot = self.pending[request_id]
+        answered = slot[0].wait(self.REQUEST_TIMEOUT)
+        with self.pending_lock:
+            del self.pending[request_id]
+        if not answered:
+            raise TimeoutError(f"Database shard {slot[1]} did not answer request {request_id}.")
+        if slot[2] is None:
+            raise ConnectionError(f"Database shard {slot[1]} disconnected.")
+        return slot[2], slot[3]
+
+    def call(self, shard_index: int, collection: str, action: str, data: dict) -> tuple[str, dict]:
+        return self.wait(self.send(shard_index, collection, action, data))
+
+    def call_many(self, requests: list[tuple[int, str, str, dict]]) -> list[tuple[str, dict]]:
+        """Send every (shard, collection, action, data) request before waiting for any, so shards work in parallel."""
+        request_ids = [self.send(*request) for request in requests]
+        return [self.wait(request_id) for request_id in request_ids]
+
+    def call_all(self, collection: str, action: str, data: dict) -> list[tuple[str, dict]]:
+        return self.call_many([(shard_index, collection, action, data) for shard_index in range(self.shard_map.shard_count)])
+
+    def user_shard(self, username) -> int:
+        # Requests without a proper username can go anywhere; the room shard answers them as a lone server would.
+        return self.shard_map.shard_of(username) if isinstance(username, str) else self.shard_map.room_shard
+
+    def execute(self, collection: str, action: str, data: dict) -> tuple[str, dict]:
+        room_shard = self.shard_map.room_shard
+        match collection:
+            case Words.Collection.USER:
+                match action:
+                    case Words.Action.QUERY:
+                        if Words.DataParamKey.USERNAME in data and not is_condition(data[Words.DataParamKey.USERNAME]):
+                            return self.call(self.user_shard(data[Words.DataParamKey.USERNAME]), collection, action, data)
+                        return self.query_users(data)
+                    case Words.Action.LOGOUT_CLEANUP:
+                        return self.logout_cleanup(data)
+                    case Words.Action.RECORD_RESULT:
+                        return self.record_result(data)
+                    case Words.Action.BULK_CREATE | Words.Action.BULK_UPDATE:
+                        return self.bulk_write(action, data)
+                    case Words.Action.EXPORT:
+                        return self.export_users(data)
+                    case _:
+                        return self.call(self.user_shard(data.get(Words.DataParamKey.USERNAME)), collection, action, data)
+            case Words.Collection.ROOM:
+                match action:
+                    case Words.Action.CREATE:
+                        return self.create_room(data)
+                    case Words.Action.ADD_USER | Words.Action.ADD_SPECTATOR:
+                        return self.join_room(action, data)
+                    case Words.Action.REMOVE_USER:
+                        return self.leave_room(data)
+                    case Words.Action.START_MATCH:
+                        return self.start_match(data)
+                    case _:
+                        return self.call(room_shard, collection, action, data)
+            case Words.Collection.LEADERBOARD if action == Words.Action.QUERY:
+                return self.query_leaderboard(data)
+            case _:
+                return self.call(room_shard, collection, action, data)
+
+    def query_users(self, data: dict) -> tuple[str, dict]:
+        """Ask every shard and shape the union as one server would. Each shard applies the limit too, which keeps the
+        right rows: the first n overall are among the first n of their shards.
+
+        A conditional query's version token joins the shards' tokens with commas. It is not modified only if no shard's
+        part is; otherwise the shards that answered not_modified are asked again for their records."""
+        conditional = Words.DataParamKey.IF_VERSION_NEWER_THAN in data
+        if conditional:
+            data = dict(data)
+            condition = data.pop(Words.DataParamKey.IF_VERSION_NEWER_THAN)
+            shard_tokens = condition.split(",") if isinstance(condition, str) else []
+            if len(shard_tokens) != self.shard_map.shard_count:
+                shard_tokens = [""] * self.shard_map.shard_count
+        try:
+            query = Query(data, Words.DataParamKey.USERNAME)
+        except ValueError as e:
+            return Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: str(e)}
+        shard_data = dict(data)
+        sort_fields = [field.lstrip("-") for field in query.sort if field.lstrip("-") != Words.DataParamKey.USERNAME]
+        if query.fields is not None:  # the shards must keep the fields the merge sorts by
+            shard_data[Words.DataParamKey.FIELDS] = query.fields + [field for field in sort_fields if field not in query.fields]
+        if query.exclude is not None:
+            shard_data[Words.DataParamKey.EXCLUDE] = [field for field in query.exclude if field not in sort_fields]
+        if not conditional:
+            responses = self.call_all(Words.Collection.USER, Words.Action.QUERY, shard_data)
+        else:
+            responses = self.call_many([(shard_index, Words.Collection.USER, Words.Action.QUERY, {**shard_data, Words.DataParamKey.IF_VERSION_NEWER_THAN: shard_tokens[shard_index]})
+                                        for shard_index in range(self.shard_map.shard_count)])
+            if all(result == Words.Result.NOT_MODIFIED for result, _ in responses):
+                return Words.Result.NOT_MODIFIED, {Words.DataParamKey.VERSION: condition}
+            stale = [shard_index for shard_index, (result, _) in enumerate(responses) if result == Words.Result.NOT_MODIFIED]
+            refetched = self.call_many([(shard_index, Words.Collection.USER, Words.Action.QUERY, {**shard_data, Words.DataParamKey.IF_VERSION_NEWER_THAN: ""}) for shard_index in stale])
+            for shard_index, response in zip(stale, refetched):
+                responses[shard_index] = response
+            for result, response in responses:
+                if result != Words.Result.FOUND:
+                    return result, response
+            token = ",".join(response[Words.DataParamKey.VERSION] for _, response in responses)
+            responses = [(result, response[Words.DataParamKey.RECORDS]) for result, response in responses]
+        for result, response in responses:
+            if result != Words.Result.FOUND:
+                return result, response
+        if query.count_only:
+            shaped = {Words.DataParamKey.COUNT: sum(response[Words.DataParamKey.COUNT] for _, response in responses)}
+        else:
+            merged = {}
+            for _, response in responses:
+                merged.update(response)
+            shaped = query.shape(merged, USER_FIELD_GETTERS)
+        if conditional:
+            return Words.Result.FOUND, {Words.DataParamKey.VERSION: token, Words.DataParamKey.RECORDS: shaped}
+        return Words.Result.FOUND, shaped
+
+    def bulk_write(self, action: str, data: dict) -> tuple[str, dict]:
+        """Split the chunk by shard; each shard applies its part in one commit."""
+        users = data.get(Words.DataParamKey.USERS)
+        if not isinstance(users, dict):
+            return self.call(self.shard_map.room_shard, Words.Collection.USER, action, data)
+        parts: dict[int, dict] = {}
+        for username, record in users.items():
+            parts.setdefault(self.user_shard(username), {})[username] = record
+        responses = self.call_many([(shard_index, Words.Collection.USER, action, {Words.DataParamKey.USERS: part}) for shard_index, part in parts.items()])
+        for result, response in responses:
+            if result != Words.Result.SUCCESS:
+                return result, response
+        count_key = Words.DataParamKey.CREATED if action == Words.Action.BULK_CREATE else Words.DataParamKey.UPDATED
+        applied = sum(response[count_key] for _, response in responses)
+        skipped = [username for _, response in responses for username in response[Words.DataParamKey.SKIPPED]]
+        return Words.Result.SUCCESS, {count_key: applied, Words.DataParamKey.SKIPPED: skipped, Words.DataParamKey.MESSAGE: f"{applied} users {count_key}."}
+
+    def export_users(self, data: dict) -> tuple[str, dict]:
+        """Merge one page from every shard. A shard with more to come bounds the page at its last user, since its
+        next users may sort before other shards' later ones."""
+        responses = self.call_all(Words.Collection.USER, Words.Action.EXPORT, data)
+        for result, response in responses:
+            if result != Words.Result.FOUND:
+                return result, response
+        bound = min((response[Words.DataParamKey.NEXT_CURSOR] for _, response in responses if response[Words.DataParamKey.NEXT_CURSOR] is not None), default=None)
+        rows = sorted((username, user_info) for _, response in responses for username, user_info in response[Words.DataParamKey.USERS].items()
+                      if bound is None or username <= bound)
+        limit = min(int(data.get(Words.DataParamKey.LIMIT, DatabaseServer.MAX_EXPORT_PAGE)), DatabaseServer.MAX_EXPORT_PAGE)
+        page = {}
+        size = 0
+        for username, user_info in rows[:limit]:
+            size += len(json.dumps(username)) + len(json.dumps(user_info)) + 4
+            if page and size > DatabaseServer.EXPORT_PAGE_BYTES:
+                break
+            page[username] = user_info
+        more = bound is not None or len(page) < len(rows)
+        return Words.Result.FOUND, {Words.DataParamKey.USERS: page, Words.DataParamKey.NEXT_CURSOR: next(reversed(page)) if more and page else None}
+
+    def release(self, room_id: str, usernames: list[str]) -> None:
+        requests = [(self.shard_map.shard_of(username), Words.Collection.USER, Words.Action.RELEASE_ROOM, {Words.DataParamKey.USERNAME: username, Words.DataParamKey.ROOM_ID: room_id})
+                    for username in usernames]
+        for (_, _, _, data), (result, response) in zip(requests, self.call_many(requests)):
+            if result != Words.Result.SUCCESS:
+                print(f"Failed to release {data[Words.DataParamKey.USERNAME]} from room {room_id}: {response.get(Words.DataParamKey.MESSAGE)}")
+
+    def users_to_release(self, username: str, room_info: dict) -> list[str]:
+        """Whoever left a room: the user, and all spectators once the last player is gone and the room deleted."""
+        users = [username]
+        if room_info.get(Words.DataParamKey.OWNER) is None:
+            users += [spectator for spectator in room_info.get(Words.DataParamKey.SPECTATORS, []) if spectator != username]
+        return users
+
+    def create_room(self, data: dict) -> tuple[str, dict]:
+        room_shard = self.shard_map.room_shard
+        result, response = self.call(room_shard, Words.Collection.ROOM, Words.Action.CREATE, data)
+        if result != Words.Result.SUCCESS:
+            return result, response
+        owner = data.get(Words.DataParamKey.OWNER)
+        room_id = response[Words.DataParamKey.ROOM_ID]
+        owner_result, owner_response = self.call(self.user_shard(owner), Words.Collection.USER, Words.Action.UPDATE, {Words.DataParamKey.USERNAME: owner, Words.DataParamKey.CURRENT_ROOM_ID: room_id})
+        if owner_result != Words.Result.SUCCESS:
+            self.call(room_shard, Words.Collection.ROOM, Words.Action.DELETE, {Words.DataParamKey.ROOM_ID: room_id})
+            return owner_result, owner_response
+        return result, response
+
+    def join_room(self, action: str, data: dict) -> tuple[str, dict]:
+        room_data = dict(data)
+        if Words.DataParamKey.ROOM_ID not in data:  # an accepted invite joins the inviter's room
+            inviter = data.get(Words.DataParamKey.INVITER_USERNAME)
+            result, inviter_info = self.call(self.user_shard(inviter), Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: inviter, Words.DataParamKey.FIELDS: [Words.DataParamKey.CURRENT_ROOM_ID]})
+            room_id = inviter_info.get(Words.DataParamKey.CURRENT_ROOM_ID) if result == Words.Result.FOUND else None
+            if room_id is None:
+                return Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "Room not found."}
+            room_data = {Words.DataParamKey.ROOM_ID: room_id, Words.DataParamKey.USERNAME: data.get(Words.DataParamKey.INVITEE_USERNAME), Words.DataParamKey.INVITER_USERNAME: inviter}
+        room_id = room_data[Words.DataParamKey.ROOM_ID]
+        username = room_data.get(Words.DataParamKey.USERNAME)
+        user_shard = self.user_shard(username)
+        claim = {Words.DataParamKey.USERNAME: username, Words.DataParamKey.ROOM_ID: room_id}
+        result, response = self.call(user_shard, Words.Collection.USER, Words.Action.CLAIM_ROOM, claim)
+        if result != Words.Result.SUCCESS:
+            return result, response
+        result, response = self.call(self.shard_map.room_shard, Words.Collection.ROOM, action, room_data)
+        if result != Words.Result.SUCCESS:
+            self.call(user_shard, Words.Collection.USER, Words.Action.RELEASE_ROOM, claim)
+        return result, response
+
+    def leave_room(self, data: dict) -> tuple[str, dict]:
+        result, response = self.call(self.shard_map.room_shard, Words.Collection.ROOM, Words.Action.REMOVE_USER, data)
+        if result == Words.Result.SUCCESS:
+            self.release(data[Words.DataParamKey.ROOM_ID], self.users_to_release(data[Words.DataParamKey.USERNAME], response[Words.DataParamKey.NOW_ROOM_INFO]))
+        return result, response
+
+    def logout_cleanup(self, data: dict) -> tuple[str, dict]:
+        username = data.get(Words.DataParamKey.USERNAME)
+        result, response = self.call(self.user_shard(username), Words.Collection.USER, Words.Action.LOGOUT_CLEANUP, data)
+        room_id = response.get(Words.DataParamKey.ROOM_ID) if result == Words.Result.SUCCESS else None
+        if room_id is None:
+            return result, response
+        room_result, room_response = self.call(self.shard_map.room_shard, Words.Collection.ROOM, Words.Action.REMOVE_USER, {Words.DataParamKey.ROOM_ID: room_id, Words.DataParamKey.USERNAME: username})
+        if room_result == Words.Result.SUCCESS:
+            room_info = room_response[Words.DataParamKey.NOW_ROOM_INFO]
+            self.release(room_id, self.users_to_release(username, room_info)[1:])  # the logout already cleared the user's room
+            response[Words.DataParamKey.NOW_ROOM_INFO] = room_info
+        else:
+            response[Words.DataParamKey.ROOM_ID] = None  # the room no longer listed the user
+        return result, response
+
+    def start_match(self, data: dict) -> tuple[str, dict]:
+        username = data.get(Words.DataParamKey.USERNAME)
+        result, user_info = self.call(self.user_shard(username), Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: username, Words.DataParamKey.FIELDS: [Words.DataParamKey.CURRENT_ROOM_ID]})
+        if result != Words.Result.FOUND:
+            return Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not found."}
+        room_id = user_info.get(Words.DataParamKey.CURRENT_ROOM_ID)
+        if room_id is None:
+            return Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "User not in a room."}
+        return self.call(self.shard_map.room_shard, Words.Collection.ROOM, Words.Action.START_MATCH, {Words.DataParamKey.USERNAME: username, Words.DataParamKey.ROOM_ID: room_id})
+
+    def record_result(self, data: dict) -> tuple[str, dict]:
+        """Count the match for each player on their shard, then log it on the room shard. Unlike on a single server
+        the steps are not atomic: a shard failing halfway leaves some players counted and the match unlogged."""
+        players = data.get(Words.DataParamKey.PLAYERS)
+        failure = (Words.Result.FAILURE, {Words.DataParamKey.MESSAGE: "A match needs a list of existing players."})
+        if not isinstance(players, list) or not players or not all(isinstance(player, str) for player in players):
+            return failure
+        lookups = self.call_many([(self.shard_map.shard_of(player), Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: player, Words.DataParamKey.FIELDS: []}) for player in players])
+        if any(result != Words.Result.FOUND for result, _ in lookups):
+            return failure
+        winner = data.get(Words.DataParamKey.WINNER)
+        self.call_many([(self.shard_map.shard_of(player), Words.Collection.USER, Words.Action.ADD_WIN if player == winner else Words.Action.ADD_GAME_PLAYED, {Words.DataParamKey.USERNAME: player})
+                        for player in players])
+        result, response = self.call(self.shard_map.room_shard, Words.Collection.GAMELOG, Words.Action.CREATE, data)
+        if result != Words.Result.SUCCESS:
+            return result, response
+        return Words.Result.SUCCESS, {Words.DataParamKey.MATCH_ID: response[Words.DataParamKey.MATCH_ID], Words.DataParamKey.MESSAGE: "Match result recorded successfully."}
+
+    def entry_key(self, board: str, entry: dict):
+        return self.ranking.keys_for(entry[Words.DataParamKey.USERNAME], entry[Words.DataParamKey.GAMES_WON], entry[Words.DataParamKey.GAMES_PLAYED])[board]
+
+    def query_leaderboard(self, data: dict) -> tuple[str, dict]:
+        """Merge the shards' boards. The top k overall are among the top k of every shard. A user's rank is one plus
+        the users ranked above them on each shard, and their neighbours overall are among the neighbours each shard
+        reports for the user's stats (see Leaderboard.rank and around)."""
+        board = data.get(Words.DataParamKey.BOARD, BOARD_WINS)
+        username = data.get(Words.DataParamKey.USERNAME)
+        shard_data = dict(data)
+        record = None
+        if username is not None:
+            result, user_info = self.call(self.user_shard(username), Words.Collection.USER, Words.Action.QUERY, {Words.DataParamKey.USERNAME: username, Words.DataParamKey.FIELDS: [Words.DataParamKey.GAMES_WON, Words.DataParamKey.GAMES_PLAYED]})
+            if result == Words.Result.FOUND:
+                record = (user_info[Words.DataParamKey.GAMES_WON], user_info[Words.DataParamKey.GAMES_PLAYED])
+                shard_data[Words.DataParamKey.GAMES_WON], shard_data[Words.DataParamKey.GAMES_PLAYED] = record
+            else:
+                del shard_data[Words.DataParamKey.USERNAME]
+        responses = self.call_all(Words.Collection.LEADERBOARD, Words.Action.QUERY, shard_data)
+        for result, response in responses:
+            if result != Words.Result.FOUND:
+                return result, response
+        limit = min(int(data.get(Words.DataParamKey.LIMIT, 10)), DatabaseServer.MAX_LEADERBOARD_PAGE)
+        entries = sorted((entry for _, response in responses for entry in response[Words.DataParamKey.ENTRIES]), key=lambda entry: self.entry_key(board, entry))[:limit]
+        for i, entry in enumerate(entries):
+            entry[Words.DataParamKey.RANK] = i + 1
+        merged = {Words.DataParamKey.BOARD: board, Words.DataParamKey.ENTRIES: entries, Words.DataParamKey.TOTAL: sum(response[Words.DataParamKey.TOTAL] for _, response in responses)}
+        if username is not None:
+            merged[Words.DataParamKey.RANK] = None
+            merged[Words.DataParamKey.AROUND] = []
+            ranks = [response.get(Words.DataParamKey.RANK) for _, response in responses]
+            if record is not None and None not in ranks:
+                rank = sum(shard_rank - 1 for shard_rank in ranks) + 1
+                radius = min(int(data.get(Words.DataParamKey.RADIUS, 2)), DatabaseServer.MAX_LEADERBOARD_PAGE // 2)
+                games_won, games_played = record
+                own_entry = {Words.DataParamKey.USERNAME: username, Words.DataParamKey.GAMES_WON: games_won, Words.DataParamKey.GAMES_PLAYED: games_played,
+                             Words.DataParamKey.WIN_RATE: games_won / games_played if games_played else 0.0}
+                own_key = self.entry_key(board, own_entry)
+                neighbours = {entry[Words.DataParamKey.USERNAME]: entry for _, response in responses for entry in response[Words.DataParamKey.AROUND]
+                              if entry[Words.DataParamKey.USERNAME] != username}
+                ordered = sorted(neighbours.values(), key=lambda entry: self.entry_key(board, entry))
+                above = [entry for entry in ordered if self.entry_key(board, entry) < own_key]
+                below = [entry for entry in ordered if self.entry_key(board, entry) > own_key]
+                above = above[max(len(above) - radius, 0):]
+                around = above + [own_entry] + below[:2 * radius - len(above)]  # near the top a server shows more below
+                first_rank = rank - len(above)
+                for i, entry in enumerate(around):
+                    entry[Words.DataParamKey.RANK] = first_rank + i
+                merged[Words.DataParamKey.RANK] = rank
+                merged[Words.DataParamKey.AROUND] = around
+        return Words.Result.FOUND, merged
@@ -0,0 +1,269 @@
+from __future__ import annotations
+from storage_engine import StorageEngine, USER_FIELD_GETTERS, ROOM_FIELD_GETTERS, META_COLLECTION, ROOM_ID_ALLOCATOR_KEY
+from secondary_index import record_matches, index_values
+from protocols import Words
+from database_flusher import DURABILITY_GROUP
+from leaderboard import BOARD_WINS, BOARD_WIN_RATE, MIN_RATED_GAMES, leaderboard_entry
+from typing import Iterator
+import sqlite3
+import threading
+import json
+
+SQLITE_DB_FILE = 'game_db.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    online INTEGER,
+    current_room_id TEXT,
+    games_won INTEGER NOT NULL DEFAULT 0,
+    games_played INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_online_room ON users (online, current_room_id);
+CREATE INDEX IF NOT EXISTS users_current_room ON users (current_room_id);
+CREATE TABLE IF NOT EXISTS rooms (
+    room_id TEXT PRIMARY KEY,
+    privacy TEXT,
+    is_playing INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rooms_privacy_playing ON rooms (privacy, is_playing);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+LEADERBOARD_SCHEMA = f"""
+CREATE INDEX IF NOT EXISTS users_wins ON users (games_won DESC, games_played, username);
+CREATE INDEX IF NOT EXISTS users_win_rate ON users (CAST(games_won AS REAL) / games_played DESC, games_played DESC, username)
+    WHERE games_played >= {MIN_RATED_GAMES};
+"""
+"""Indexes in leaderboard order, best first (see Leaderboard for the tie-breaks), so SqliteLeaderboard reads a page of
+a board as an index range instead of sorting the users table."""
+
+
+class SqliteStorageEngine(StorageEngine):
+    """Keeps both collections in an SQLite file.
+
+    Each record is stored whole as JSON in the data column; the fields the lobby filters on are copied into indexed
+    columns so query_users/query_rooms on them run as an indexed WHERE. Mutations are executed at once inside an open
+    transaction and the flusher commits it, so a batch of requests shares one commit (group commit). Engine metadata
+    such as the room id counter is written to the meta table as part of that commit."""
+    USER_COLUMNS = {Words.DataParamKey.ONLINE: "online", Words.DataParamKey.CURRENT_ROOM_ID: "current_room_id"}
+    ROOM_COLUMNS = {Words.DataParamKey.IS_PLAYING: "is_playing", Words.DataParamKey.PRIVACY: "privacy"}
+
+    def __init__(self, path: str = SQLITE_DB_FILE, synchronous: str = "FULL", durability: str = DURABILITY_GROUP,
+                 flush_interval: float = 0.01, max_dirty: int = 512, reuse_room_ids: bool = False) -> None:
+        super().__init__(durability, flush_interval, max_dirty, reuse_room_ids)
+        self.path = path
+        self.index_hits = 0
+        self.full_scans = 0
+        self.connection_lock = threading.RLock()
+        """Requests on different collections share the connection; each statement runs under this lock."""
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level="DEFERRED")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"PRAGMA synchronous={synchronous}")
+        self.connection.executescript(SCHEMA)
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(users)")}
+        for column in ("games_won", "games_played"):
+            if column not in columns:  # a file from before the leaderboard columns: add them, filled from data
+                self.connection.execute(f"ALTER TABLE users ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+                self.connection.execute(f"UPDATE users SET {column} = COALESCE(json_extract(data, ?), 0)", (f"$.{column}",))
+        self.connection.executescript(LEADERBOARD_SCHEMA)
+        self.connection.commit()
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (ROOM_ID_ALLOCATOR_KEY,)).fetchone()
+        self.room_ids.load(json.loads(row[0]) if row is not None else None)
+
+    def execute(self, sql: str, params: tuple | list = ()) -> list:
+        with self.connection_lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def fetch_one(self, sql: str, params: tuple | list = ()):
+        rows = self.execute(sql, params)
+        return rows[0] if rows else None
+
+    def get_user(self, username: str) -> dict | None:
+        row = self.fetch_one("SELECT data FROM users WHERE username = ?", (username,))
+        return json.loads(row[0]) if row is not None else None
+
+    def put_user(self, username: str, user_info: dict) -> None:
+        self.execute(
+            "INSERT INTO users (username, online, current_room_id, games_won, games_played, data) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (username) DO UPDATE SET online = excluded.online, current_room_id = excluded.current_room_id, "
+            "games_won = excluded.games_won, games_played = excluded.games_played, data = excluded.data",
+            (username, user_info.get(Words.DataParamKey.ONLINE), user_info.get(Words.DataParamKey.CURRENT_ROOM_ID),
+             user_info.get(Words.DataParamKey.GAMES_WON, 0), user_info.get(Words.DataParamKey.GAMES_PLAYED, 0), json.dumps(user_info)))
+        self.mark_dirty(Words.Collection.USER, username, None)
+
+    def delete_user(self, username: str) -> None:
+        self.execute("DELETE FROM users WHERE username = ?", (username,))
+        self.mark_dirty(Words.Collection.USER, username, None)
+
+    def iter_users(self) -> Iterator[tuple[str, dict]]:
+        for username, data in self.execute("SELECT username, data FROM users"):
+            yield username, json.loads(data)
+
+    def users_after(self, cursor: str | None, limit: int) -> list[tuple[str, dict]]:
+        if cursor is None:
+            rows = self.execute("SELECT username, data FROM users ORDER BY username LIMIT ?", (limit,))
+        else:
+            rows = self.execute("SELECT username, data FROM users WHERE username > ? ORDER BY username LIMIT ?", (cursor, limit))
+        return [(username, json.loads(data)) for username, data in rows]
+
+    def get_room(self, room_id: str) -> dict | None:
+        row = self.fetch_one("SELECT data FROM rooms WHERE room_id = ?", (room_id,))
+        return json.loads(row[0]) if row is not None else None
+
+    def put_room(self, room_id: str, room_info: dict) -> None:
+        self.execute(
+            "INSERT INTO rooms (room_id, privacy, is_playing, data) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (room_id) DO UPDATE SET privacy = excluded.privacy, is_playing = excluded.is_playing, data = excluded.data",
+            (room_id, ROOM_FIELD_GETTERS[Words.DataParamKey.PRIVACY](room_info), room_info.get(Words.DataParamKey.IS_PLAYING), json.dumps(room_info)))
+        self.mark_dirty(Words.Collection.ROOM, room_id, None)
+
+    def delete_room(self, room_id: str) -> None:
+        self.execute("DELETE FROM rooms WHERE room_id = ?", (room_id,))
+        self.mark_dirty(Words.Collection.ROOM, room_id, None)
+        self.release_room_id(room_id)
+
+    def iter_rooms(self) -> Iterator[tuple[str, dict]]:
+        for room_id, data in self.execute("SELECT room_id, data FROM rooms"):
+            yield room_id, json.loads(data)
+
+    def select(self, table: str, key_column: str, columns: dict[str, str], field_getters: dict, criteria: dict) -> dict[str, dict]:
+        """Run criteria on indexed columns as SQL and check the rest on the decoded records."""
+        clauses = []
+        params = []
+        for key, condition in criteria.items():
+            values = index_values(condition) if key in columns else None
+            if not values:
+                continue
+            if len(values) == 1:
+                clauses.append(f"{columns[key]} IS ?")
+            else:
+                clauses.append(f"({columns[key]} IN ({', '.join('?' * len(values))}) OR ({columns[key]} IS NULL AND ?))")
+                values = [*values, None in values]
+            params.extend(values)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        with self.connection_lock:
+            if clauses:
+                self.index_hits += 1
+            else:
+                self.full_scans += 1
+        rows = self.execute(f"SELECT {key_column}, data FROM {table}{where}", params)
+        result = {}
+        for key, data in rows:
+            record = json.loads(data)
+            if record_matches(record, criteria, field_getters):
+                result[key] = record
+        return result
+
+    def query_users(self, criteria: dict) -> dict[str, dict]:
+        return self.select("users", "username", self.USER_COLUMNS, USER_FIELD_GETTERS, criteria)
+
+    def query_rooms(self, criteria: dict) -> dict[str, dict]:
+        return self.select("rooms", "room_id", self.ROOM_COLUMNS, ROOM_FIELD_GETTERS, criteria)
+
+    def prepare_batch(self, batch: list[tuple[str, str, dict | None]]) -> None:
+        # Record statements already ran; committing here (under the lock) keeps other requests out of the transaction.
+        for collection, key, value in batch:
+            if collection == META_COLLECTION:
+                self.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                                        (key, json.dumps(value)))
+        with self.connection_lock:
+            self.connection.commit()
+
+    def indexed_leaderboard(self) -> SqliteLeaderboard:
+        return SqliteLeaderboard(self)
+
+    def close(self) -> None:
+        super().close()
+        self.connection.close()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["users"] = self.fetch_one("SELECT COUNT(*) FROM users")[0]
+        stats["rooms"] = self.fetch_one("SELECT COUNT(*) FROM rooms")[0]
+        queries = self.index_hits + self.full_scans
+        stats["index_hits"] = self.index_hits
+        stats["full_scans"] = self.full_scans
+        stats["hit_rate"] = self.index_hits / queries if queries else 0.0
+        return stats
+
+
+class SqliteLeaderboard:
+    """Leaderboard's queries answered from the users table through the users_wins and users_win_rate indexes, so no
+    board is held in memory or built at startup. put_user keeps the indexed columns current, which makes update,
+    remove, load and refresh no-ops. A rank is a count of the keys ahead of the user's, three index ranges, one per
+    part of the key."""
+    BOARDS = {
+        BOARD_WINS: {"where": "", "order": "games_won DESC, games_played, username",
+                     "ahead": ("games_won > ?", "games_won = ? AND games_played < ?", "games_won = ? AND games_played = ? AND username < ?")},
+        BOARD_WIN_RATE: {"where": f"games_played >= {MIN_RATED_GAMES}", "order": "CAST(games_won AS REAL) / games_played DESC, games_played DESC, username",
+                         "ahead": ("CAST(games_won AS REAL) / games_played > ?", "CAST(games_won AS REAL) / games_played = ? AND games_played > ?",
+                                   "CAST(games_won AS REAL) / games_played = ? AND games_played = ? AND username < ?")},
+    }
+
+    def __init__(self, storage: SqliteStorageEngine) -> None:
+        self.storage = storage
+        self.boards = self.BOARDS
+
+    def load(self, users) -> None:
+        pass
+
+    def refresh(self, username: str, user_info: dict | None) -> None:
+        pass
+
+    def update(self, username: str, user_info: dict) -> None:
+        pass
+
+    def remove(self, username: str) -> None:
+        pass
+
+    def select(self, board: str, columns: str, conditions: tuple[str, ...] = (), params: list | tuple = (), tail: str = "") -> list:
+        clauses = [clause for clause in (self.boards[board]["where"], *conditions) if clause]
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return self.storage.execute(f"SELECT {columns} FROM users{where}{tail}", params)
+
+    def page(self, board: str, start: int, limit: int) -> list[dict]:
+        rows = self.select(board, "username, games_won, games_played", params=(limit, start), tail=f" ORDER BY {self.boards[board]['order']} LIMIT ? OFFSET ?")
+        return [leaderboard_entry(username, start + i, games_won, games_played) for i, (username, games_won, games_played) in enumerate(rows)]
+
+    def top(self, board: str, limit: int) -> list[dict]:
+        return self.page(board, 0, limit)
+
+    def position(self, board: str, username: str, record: tuple[int, int] | None) -> int | None:
+        """0-based position of the user's key, as IndexableSkipList.rank: the number of keys ahead of it."""
+        if record is None:
+            rows = self.select(board, "games_won, games_played", ("username = ?",), (username,))
+            if not rows:
+                return None
+            record = rows[0]
+        games_won, games_played = record
+        if board == BOARD_WINS:
+            first = games_won
+        elif games_played >= MIN_RATED_GAMES:
+            first = games_won / games_played
+        else:
+            return None
+        ahead = self.boards[board]["ahead"]
+        return sum(self.select(board, "COUNT(*)", (condition,), params)[0][0]
+                   for condition, params in zip(ahead, ((first,), (first, games_played), (first, games_played, username))))
+
+    def rank(self, board: str, username: str, record: tuple[int, int] | None = None) -> int | None:
+        with self.storage.connection_lock:  # the counts see the same table
+            position = self.position(board, username, record)
+        return position + 1 if position is not None else None
+
+    def around(self, board: str, username: str, radius: int, record: tuple[int, int] | None = None) -> list[dict]:
+        with self.storage.connection_lock:
+            position = self.position(board, username, record)
+            if position is None:
+                return []
+            start = max(position - radius, 0)
+            return self.page(board, start, 2 * radius + 1)
+
+    def size(self, board: str) -> int:
+        return self.select(board, "COUNT(*)")[0][0]
@@ -0,0 +1,138 @@
+from database_flusher import DatabaseFlusher, DURABILITY_GROUP
+from protocols import Words
+from secondary_index import record_matches
+from room_id_allocator import RoomIdAllocator
+from read_write_lock import CollectionLocks
+from scan_snapshot import ScanSnapshot
+from typing import Callable, Iterator
+import heapq
+
+USER_FIELD_GETTERS: dict[str, Callable[[dict], object]] = {}
+ROOM_FIELD_GETTERS: dict[str, Callable[[dict], object]] = {
+    Words.DataParamKey.PRIVACY: lambda room_info: (room_info.get(Words.DataParamKey.SETTINGS) or {}).get(Words.DataParamKey.PRIVACY),
+}
+"""Query fields that are not top-level keys of the record. Rooms keep privacy inside settings."""
+
+META_COLLECTION = "meta"
+"""Engine bookkeeping that is persisted with the data, such as the room id counter. Not visible to the lobby."""
+ROOM_ID_ALLOCATOR_KEY = "room_id_allocator"
+
+
+class StorageEngine:
+    """Storage behind DatabaseServer.process_message.
+
+    Records are plain dicts shaped like the JSON files. A record returned by get_* may be a private copy, so callers
+    must put_* it back after changing it. Callers hold self.lock.hold(read=..., write=...) for the collections they
+    touch (room id allocation counts as a room write); "with self.lock:" locks everything, which the flusher does
+    while it prepares a batch."""
+    def __init__(self, durability: str = DURABILITY_GROUP, flush_interval: float = 0.01, max_dirty: int = 512, reuse_room_ids: bool = False) -> None:
+        self.lock = CollectionLocks([Words.Collection.USER, Words.Collection.ROOM])
+        self.flusher = DatabaseFlusher(self.prepare_batch, self.write_batch, self.lock, durability, flush_interval, max_dirty)
+        self.room_ids = RoomIdAllocator(reuse_room_ids)
+        """Engines load its state on startup and persist it under (META_COLLECTION, ROOM_ID_ALLOCATOR_KEY)."""
+
+    def get_user(self, username: str) -> dict | None:
+        raise NotImplementedError
+
+    def put_user(self, username: str, user_info: dict) -> None:
+        raise NotImplementedError
+
+    def delete_user(self, username: str) -> None:
+        raise NotImplementedError
+
+    def iter_users(self) -> Iterator[tuple[str, dict]]:
+        raise NotImplementedError
+
+    def get_room(self, room_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def put_room(self, room_id: str, room_info: dict) -> None:
+        raise NotImplementedError
+
+    def delete_room(self, room_id: str) -> None:
+        raise NotImplementedError
+
+    def iter_rooms(self) -> Iterator[tuple[str, dict]]:
+        raise NotImplementedError
+
+    def users_after(self, cursor: str | None, limit: int) -> list[tuple[str, dict]]:
+        """Up to limit users whose usernames sort after cursor (from the first if None), in username order: one page
+        of an export."""
+        usernames = heapq.nsmallest(limit, (username for username, _ in self.iter_users() if cursor is None or username > cursor))
+        return [(username, self.get_user(username)) for username in usernames]
+
+    def allocate_room_id(self) -> str:
+        room_id = self.room_ids.allocate(lambda room_id: self.get_room(room_id) is not None)
+        self.mark_dirty(META_COLLECTION, ROOM_ID_ALLOCATOR_KEY, self.room_ids.state)
+        return room_id
+
+    def release_room_id(self, room_id: str) -> None:
+        """Called by delete_room implementations."""
+        if self.room_ids.release(room_id):
+            self.mark_dirty(META_COLLECTION, ROOM_ID_ALLOCATOR_KEY, self.room_ids.state)
+
+    lazy_users = False
+    """True when users are read from disk on demand, so reading all of them is slow; views of every user are then
+    built in the background instead of at startup (see warm_user_view)."""
+
+    def warm_user_view(self, load: Callable[[Iterator[tuple[str, dict]]], None], refresh: Callable[[str, dict | None], None],
+                       done: Callable[[], None] | None = None) -> None:
+        """Build a view derived from every user, such as an index or the leaderboard. load gets all users; refresh then
+        gets the current record (None if deleted) of each user that changed while load ran; done is called once the
+        view is current. Here load runs under the user read lock, so nothing changes meanwhile."""
+        with self.lock.hold(read=(Words.Collection.USER,)):
+            load(self.iter_users())
+            if done is not None:
+                done()
+
+    def indexed_leaderboard(self):
+        """A leaderboard answered from the engine's own indexes, with the query methods of Leaderboard, or None for
+        the server to keep a Leaderboard in memory."""
+        return None
+
+    snapshot_scans = False
+    """True when open_snapshot() works, so scans can read a ScanSnapshot instead of holding the collection lock."""
+
+    def open_snapshot(self, collection: str, criteria: dict) -> ScanSnapshot:
+        """A point-in-time view of the records of collection that may match criteria. The caller holds the
+        collection's read lock while opening it, not while reading it, and must close_snapshot() it once done."""
+        raise NotImplementedError
+
+    def close_snapshot(self, snapshot: ScanSnapshot) -> None:
+        raise NotImplementedError
+
+    def query_users(self, criteria: dict) -> dict[str, dict]:
+        """Users matching every criterion: a value to compare equal, or an operator condition (see Words.Operator)."""
+        return {username: user_info for username, user_info in self.iter_users() if record_matches(user_info, criteria, USER_FIELD_GETTERS)}
+
+    def query_rooms(self, criteria: dict) -> dict[str, dict]:
+        """Rooms matching every criterion, as in query_users. privacy is matched against settings.privacy."""
+        return {room_id: room_info for room_id, room_info in self.iter_rooms() if record_matches(room_info, criteria, ROOM_FIELD_GETTERS)}
+
+    def prepare_batch(self, batch: list[tuple[str, str, dict | None]]):
+        """Flusher step run under self.lock."""
+        raise NotImplementedError
+
+    def write_batch(self, prepared) -> int:
+        """Flusher step run outside self.lock. Returns the bytes written."""
+        return 0
+
+    def after_durable(self, callback: Callable[[], None]) -> None:
+        self.flusher.after_durable(callback)
+
+    def mark_dirty(self, collection: str, key: str, value: dict | None) -> None:
+        self.flusher.mark_dirty(collection, key, value)
+
+    def start(self) -> None:
+        self.flusher.start()
+
+    def maintenance(self) -> None:
+        """Called by the server between requests and when idle."""
+        pass
+
+    def close(self) -> None:
+        """Flush everything and release files. The engine is unusable afterwards."""
+        self.flusher.stop()
+
+    def stats(self) -> dict:
+        return {"engine": type(self).__name__, **self.flusher.stats()}
@@ -0,0 +1,432 @@
+import os
+import shutil
+import threading
+import time
+import pytest
+from database_driver import DatabaseDriver
+from database_flusher import DURABILITY_IMMEDIATE
+from database_server import DatabaseServer
+from json_storage_engine import JsonStorageEngine
+from lobby_server import LobbyServer
+from match_log import MatchLog
+from protocols import Words
+from shard_map import ShardMap
+
+K = Words.DataParamKey
+TIMEOUT = 10.0
+
+
+class Harness:
+    """An in-process DatabaseServer on a temporary data directory, driven over its lobby connection."""
+    def __init__(self, data_dir: str, workers: int = 0, storage=None, expected_type: str = Words.ConnectionType.DATABASE_SERVER,
+                 **server_options) -> None:
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        self.storage = storage if storage is not None else JsonStorageEngine(data_dir, durability=DURABILITY_IMMEDIATE)
+        self.server = DatabaseServer(self.storage, workers=workers, match_log=MatchLog(os.path.join(data_dir, "match_log")), **server_options)
+        self.driver = DatabaseDriver()
+        accept_thread = threading.Thread(target=self.driver.accept, kwargs={"expected_type": expected_type})
+        accept_thread.start()
+        self.server.connect(self.driver.host, self.driver.port)
+        accept_thread.join()
+
+    def request(self, collection: str, action: str, data: dict) -> tuple[str, dict]:
+        return self.driver.request(collection, action, data, timeout=TIMEOUT)
+
+    def create_user(self, username: str) -> None:
+        assert self.request(Words.Collection.USER, Words.Action.CREATE, {K.USERNAME: username, K.PASSWORD: "pw"})[0] == Words.Result.SUCCESS
+
+    def close(self) -> None:
+        self.driver.close()
+        self.server.shutdown()
+
+
+@pytest.fixture(params=[0, 2], ids=["serial", "workers"])
+def db(request, tmp_path):
+    harness = Harness(str(tmp_path), workers=request.param)
+    yield harness
+    harness.close()
+
+
+def assert_alive(db: Harness) -> None:
+    """The server still answers: a crashed receiver would time the request out."""
+    result, _ = db.request(Words.Collection.USER, Words.Action.QUERY, {K.USERNAME: "nobody"})
+    assert result == Words.Result.NOT_FOUND
+
+
+def test_request_that_raises_is_answered_with_failure(db):
+    def broken_query(*args, **kwargs):
+        raise RuntimeError("disk on fire")
+    db.server.match_log.query = broken_query
+    result, data = db.request(Words.Collection.GAMELOG, Words.Action.QUERY, {})
+    assert result == Words.Result.FAILURE
+    assert "disk on fire" in data[K.MESSAGE]
+    assert_alive(db)
+
+
+def record_matches(db: Harness, count: int, players: list[str]) -> list[int]:
+    match_ids = []
+    for _ in range(count):
+        result, data = db.request(Words.Collection.GAMELOG, Words.Action.CREATE, {K.PLAYERS: players, K.WINNER: players[0]})
+        assert result == Words.Result.SUCCESS
+        match_ids.append(data[K.MATCH_ID])
+    return match_ids
+
+
+def test_match_history_pages_newest_first(db):
+    alice_matches = record_matches(db, 5, ["alice", "bob"])
+    record_matches(db, 2, ["carol", "dave"])
+    seen = []
+    cursor = None
+    while True:
+        result, data = db.request(Words.Collection.GAMELOG, Words.Action.QUERY, {K.USERNAME: "alice", K.LIMIT: 2, K.CURSOR: cursor})
+        assert result == Words.Result.FOUND
+        seen += [match[K.MATCH_ID] for match in data[K.MATCHES]]
+        cursor = data[K.NEXT_CURSOR]
+        if cursor is None:
+            break
+    assert seen == alice_matches[::-1]
+
+
+@pytest.mark.parametrize("bad", [{K.LIMIT: "x"}, {K.LIMIT: -1}, {K.LIMIT: True}, {K.CURSOR: "3"}, {K.CURSOR: [1]},
+                                 {K.SINCE: "yesterday"}, {K.UNTIL: {}}, {K.USERNAME: ["alice"]}])
+def test_match_history_rejects_malformed_parameters(db, bad):
+    record_matches(db, 1, ["alice", "bob"])
+    result, data = db.request(Words.Collection.GAMELOG, Words.Action.QUERY, {K.USERNAME: "alice", **bad})
+    assert result == Words.Result.FAILURE
+    assert K.MESSAGE in data
+    assert_alive(db)
+
+
+def test_match_with_malformed_players_is_refused(db):
+    result, _ = db.request(Words.Collection.GAMELOG, Words.Action.CREATE, {K.PLAYERS: [{"name": "alice"}]})
+    assert result == Words.Result.FAILURE
+    assert len(db.server.match_log) == 0
+
+
+def rank_users(db: Harness, wins: dict[str, int]) -> None:
+    for username, games_won in wins.items():
+        db.create_user(username)
+        for _ in range(games_won):
+            assert db.request(Words.Collection.USER, Words.Action.ADD_WIN, {K.USERNAME: username})[0] == Words.Result.SUCCESS
+
+
+def test_leaderboard_ranks_by_wins(db):
+    rank_users(db, {"alice": 3, "bob": 1, "carol": 2})
+    result, data = db.request(Words.Collection.LEADERBOARD, Words.Action.QUERY, {K.LIMIT: 2, K.USERNAME: "bob", K.RADIUS: 1})
+    assert result == Words.Result.FOUND
+    assert [entry[K.USERNAME] for entry in data[K.ENTRIES]] == ["alice", "carol"]
+    assert data[K.RANK] == 3
+    assert [entry[K.USERNAME] for entry in data[K.AROUND]] == ["carol", "bob"]
+
+
+@pytest.mark.parametrize("bad", [{K.LIMIT: "ten"}, {K.LIMIT: -5}, {K.RADIUS: "2"}, {K.RADIUS: 1.5}, {K.BOARD: ["wins"]},
+                                 {K.BOARD: "losses"}, {K.USERNAME: 7}, {K.GAMES_WON: "many"}, {K.GAMES_WON: 1, K.GAMES_PLAYED: [3]}])
+def test_leaderboard_rejects_malformed_parameters(db, bad):
+    rank_users(db, {"alice": 1})
+    result, data = db.request(Words.Collection.LEADERBOARD, Words.Action.QUERY, {K.USERNAME: "alice", **bad})
+    assert result == Words.Result.FAILURE
+    assert K.MESSAGE in data
+    assert_alive(db)
+
+
+def create_rooms(db: Harness, owner: str, count: int) -> list[str]:
+    db.create_user(owner)
+    room_ids = []
+    for i in range(count):
+        result, data = db.request(Words.Collection.ROOM, Words.Action.CREATE, {K.OWNER: owner, K.SETTINGS: {"speed": count - i}})
+        assert result == Words.Result.SUCCESS
+        room_ids.append(data[K.ROOM_ID])
+    return room_ids
+
+
+def test_rooms_sort_on_an_object_field(db):
+    room_ids = create_rooms(db, "alice", 3)
+    result, data = db.request(Words.Collection.ROOM, Words.Action.QUERY, {K.SORT: [K.SETTINGS], K.OWNER: "alice"})
+    assert result == Words.Result.FOUND
+    assert list(data) == room_ids[::-1]
+    result, data = db.request(Words.Collection.ROOM, Words.Action.QUERY, {K.SORT: ["-" + K.SETTINGS], K.LIMIT: 1, K.OWNER: "alice"})
+    assert list(data) == room_ids[:1]
+
+
+def test_rooms_sort_on_a_field_of_mixed_types(db):
+    room_ids = create_rooms(db, "alice", 5)
+    tags = ["b", [1], None, 2, "a"]
+    for room_id, tag in zip(room_ids, tags):
+        assert db.request(Words.Collection.ROOM, Words.Action.UPDATE, {K.ROOM_ID: room_id, "tag": tag})[0] == Words.Result.SUCCESS
+    result, data = db.request(Words.Collection.ROOM, Words.Action.QUERY, {K.SORT: ["tag"], K.OWNER: "alice"})
+    assert result == Words.Result.FOUND
+    assert [data[room_id].get("tag") for room_id in data] == [2, "a", "b", [1], None]
+    result, data = db.request(Words.Collection.ROOM, Words.Action.QUERY, {K.SORT: ["-tag"], K.LIMIT: 2, K.OWNER: "alice"})
+    assert [data[room_id].get("tag") for room_id in data] == [None, [1]]
+
+
+def test_users_export_in_pages(db):
+    usernames = [f"user{i:02}" for i in range(7)]
+    for username in usernames:
+        db.create_user(username)
+    exported = []
+    cursor = None
+    while True:
+        result, data = db.request(Words.Collection.USER, Words.Action.EXPORT, {K.LIMIT: 3, K.CURSOR: cursor})
+        assert result == Words.Result.FOUND
+        exported += list(data[K.USERS])
+        cursor = data[K.NEXT_CURSOR]
+        if cursor is None:
+            break
+    assert exported == usernames
+
+
+@pytest.mark.parametrize("bad", [{K.LIMIT: "all"}, {K.LIMIT: -1}, {K.LIMIT: None, K.CURSOR: 3}, {K.CURSOR: ["user00"]}])
+def test_users_export_rejects_malformed_parameters(db, bad):
+    db.create_user("user00")
+    result, data = db.request(Words.Collection.USER, Words.Action.EXPORT, bad)
+    assert result == Words.Result.FAILURE
+    assert K.MESSAGE in data
+    assert_alive(db)
+
+
+@pytest.mark.parametrize("bad", [{}, {K.USERNAME: None}, {K.USERNAME: ""}, {K.USERNAME: 42}, {K.USERNAME: ["alice"]}])
+def test_user_without_a_username_is_refused(db, bad):
+    result, data = db.request(Words.Collection.USER, Words.Action.CREATE, {K.PASSWORD: "pw", **bad})
+    assert result == Words.Result.FAILURE
+    assert K.MESSAGE in data
+    result, data = db.request(Words.Collection.USER, Words.Action.EXPORT, {})
+    assert data[K.USERS] == {}
+
+
+def usernames_matching(db: Harness, criteria: dict) -> set[str]:
+    result, data = db.request(Words.Collection.USER, Words.Action.QUERY, criteria)
+    assert result == Words.Result.FOUND
+    return set(data)
+
+
+def test_query_operators_and_options(db):
+    rank_users(db, {"alice": 3, "bob": 1, "carol": 2, "dave": 0})
+    assert usernames_matching(db, {K.GAMES_WON: {Words.Operator.GTE: 2}}) == {"alice", "carol"}
+    assert usernames_matching(db, {K.GAMES_WON: {Words.Operator.GT: 0, Words.Operator.LT: 3}}) == {"bob", "carol"}
+    assert usernames_matching(db, {K.GAMES_WON: {Words.Operator.NE: 0}}) == {"alice", "bob", "carol"}
+    assert usernames_matching(db, {K.USERNAME: {Words.Operator.IN: ["alice", "dave", "erin"]}}) == {"alice", "dave"}
+    assert usernames_matching(db, {K.USERNAME: {Words.Operator.NIN: ["alice", "dave"]}}) == {"bob", "carol"}
+    result, data = db.request(Words.Collection.USER, Words.Action.QUERY, {K.GAMES_WON: {Words.Operator.LTE: 3}, K.SORT: ["-" + K.GAMES_WON], K.LIMIT: 3, K.FIELDS: [K.GAMES_WON]})
+    assert result == Words.Result.FOUND
+    assert data == {"alice": {K.GAMES_WON: 3}, "carol": {K.GAMES_WON: 2}, "bob": {K.GAMES_WON: 1}}
+    result, data = db.request(Words.Collection.USER, Words.Action.QUERY, {K.USERNAME: "bob", K.EXCLUDE: [K.PASSWORD]})
+    assert result == Words.Result.FOUND and K.PASSWORD not in data and data[K.GAMES_WON] == 1
+    result, data = db.request(Words.Collection.USER, Words.Action.QUERY, {K.GAMES_PLAYED: {Words.Operator.GTE: 1}, K.COUNT_ONLY: True})
+    assert data == {K.COUNT: 3}
+
+
+def test_query_on_list_sizes(db):
+    room_ids = create_rooms(db, "alice", 1)
+    db.create_user("bob")
+    db.request(Words.Collection.USER, Words.Action.UPDATE, {K.USERNAME: "bob", K.ONLINE: True})
+    assert db.request(Words.Collection.ROOM, Words.Action.ADD_USER, {K.ROOM_ID: room_ids[0], K.USERNAME: "bob"})[0] == Words.Result.SUCCESS
+    result, data = db.request(Words.Collection.ROOM, Words.Action.QUERY, {K.USERS: {Words.Operator.SIZE: 2}})
+    assert result == Words.Result.FOUND and list(data) == room_ids
+    result, data = db.request(Words.Collection.ROOM, Words.Action.QUERY, {K.USERS: {Words.Operator.SIZE: 1}})
+    assert data == {}
+
+
+@pytest.mark.parametrize("bad", [{K.GAMES_WON: {"$between": [1, 2]}}, {K.USERNAME: {Words.Operator.IN: "alice"}}, {K.SORT: "games_won"},
+                                 {K.LIMIT: -1}, {K.FIELDS: [K.ONLINE], K.EXCLUDE: [K.PASSWORD]}, {K.FIELDS: "online"}])
+def test_query_rejects_malformed_requests(db, bad):
+    db.create_user("alice")
+    result, data = db.request(Words.Collection.USER, Words.Action.QUERY, bad)
+    assert result == Words.Result.FAILURE
+    assert K.MESSAGE in data
+
+
+def test_indexes_follow_updates(db):
+    for username in ("alice", "bob", "carol"):
+        db.create_user(username)
+    assert usernames_matching(db, {K.ONLINE: True}) == set()
+    for username in ("alice", "bob"):
+        db.request(Words.Collection.USER, Words.Action.UPDATE, {K.USERNAME: username, K.ONLINE: True})
+    assert usernames_matching(db, {K.ONLINE: True}) == {"alice", "bob"}
+    room_id = db.request(Words.Collection.ROOM, Words.Action.CREATE, {K.OWNER: "alice", K.SETTINGS: {}})[1][K.ROOM_ID]
+    assert db.request(Words.Collection.ROOM, Words.Action.ADD_USER, {K.ROOM_ID: room_id, K.USERNAME: "bob"})[0] == Words.Result.SUCCESS
+    assert usernames_matching(db, {K.CURRENT_ROOM_ID: room_id}) == {"alice", "bob"}
+    assert usernames_matching(db, {K.ONLINE: True, K.CURRENT_ROOM_ID: None}) == set()
+    assert db.request(Words.Collection.USER, Words.Action.LOGOUT_CLEANUP, {K.USERNAME: "bob"})[0] == Words.Result.SUCCESS
+    assert usernames_matching(db, {K.CURRENT_ROOM_ID: room_id}) == {"alice"}
+    assert usernames_matching(db, {K.ONLINE: {Words.Operator.IN: [False, None]}}) == {"bob", "carol"}
+    assert db.storage.user_planner.stats()["index_hits"] > 0
+
+
+def test_acknowledged_writes_survive_a_crash(tmp_path):
+    db = Harness(str(tmp_path / "live"))
+    try:
+        for username in ("alice", "bob"):
+            db.create_user(username)
+        db.request(Words.Collection.USER, Words.Action.UPDATE, {K.USERNAME: "alice", K.ONLINE: True})
+        room_id = db.request(Words.Collection.ROOM, Words.Action.CREATE, {K.OWNER: "alice", K.SETTINGS: {"speed": 3}})[1][K.ROOM_ID]
+        # What the disk holds if the process dies now: the log, but no snapshot with these records.
+        shutil.copytree(db.data_dir, tmp_path / "crashed", ignore=shutil.ignore_patterns("match_log*"))
+    finally:
+        db.close()
+    with open(tmp_path / "crashed" / "db_wal.log", "a") as wal:
+        wal.write('{"lsn": 999, "collection": "user", "key": "torn"')  # an append cut short by the crash
+    recovered = JsonStorageEngine(str(tmp_path / "crashed"), durability=DURABILITY_IMMEDIATE)
+    try:
+        assert recovered.get_user("alice")[K.CURRENT_ROOM_ID] == room_id
+        assert recovered.get_user("bob") is not None
+        assert recovered.get_user("torn") is None
+        assert recovered.get_room(room_id)[K.SETTINGS] == {"speed": 3}
+        assert set(recovered.query_users({K.ONLINE: True})) == {"alice"}
+        assert recovered.allocate_room_id() != room_id
+    finally:
+        recovered.close()
+
+
+def test_data_survives_a_restart(tmp_path):
+    db = Harness(str(tmp_path))
+    db.create_user("alice")
+    match_id = record_matches(db, 1, ["alice", "bob"])[0]
+    db.close()
+    db = Harness(str(tmp_path))
+    try:
+        assert db.request(Words.Collection.USER, Words.Action.QUERY, {K.USERNAME: "alice"})[0] == Words.Result.FOUND
+        result, data = db.request(Words.Collection.GAMELOG, Words.Action.QUERY, {K.USERNAME: "bob"})
+        assert [match[K.MATCH_ID] for match in data[K.MATCHES]] == [match_id]
+    finally:
+        db.close()
+
+
+def wait_until(condition, timeout: float = TIMEOUT) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise TimeoutError("Condition not reached in time.")
+        time.sleep(0.05)
+
+
+def test_replica_follows_and_takes_over(tmp_path):
+    primary = Harness(str(tmp_path / "primary"), replication_port=0)
+    replica = Harness(str(tmp_path / "replica"), expected_type=Words.ConnectionType.DATABASE_REPLICA,
+                      primary=("127.0.0.1", primary.server.replication_source.port))
+    try:
+        primary.create_user("alice")
+        record_matches(primary, 1, ["alice", "bob"])
+        wait_until(lambda: replica.request(Words.Collection.USER, Words.Action.QUERY, {K.USERNAME: "alice"})[0] == Words.Result.FOUND)
+        result, data = replica.request(Words.Collection.USER, Words.Action.CREATE, {K.USERNAME: "bob", K.PASSWORD: "pw"})
+        assert result == Words.Result.FAILURE and data[K.REASON] == Words.Reason.READ_ONLY
+
+        primary.close()  # the primary fails; the replica takes over as the lobby's database server
+        accept_thread = threading.Thread(target=replica.driver.accept)
+        accept_thread.start()
+        assert replica.server.promote()
+        accept_thread.join()
+        replica.create_user("bob")
+        assert replica.request(Words.Collection.USER, Words.Action.QUERY, {K.USERNAME: "alice"})[0] == Words.Result.FOUND
+        result, data = replica.request(Words.Collection.GAMELOG, Words.Action.QUERY, {K.USERNAME: "alice"})
+        assert len(data[K.MATCHES]) == 1
+    finally:
+        replica.close()
+
+
+class ShardedDatabase:
+    """A lobby's ShardRouter with a DatabaseServer per shard, each on its own data directory."""
+    def __init__(self, data_dir: str, shard_map: ShardMap) -> None:
+        self.lobby = LobbyServer(metrics_port=None, shard_map=shard_map)
+        self.lobby.server_sock.bind(("127.0.0.1", 0))
+        self.lobby.server_sock.listen(5)
+        self.lobby.server_sock.settimeout(1.0)
+        self.accept_thread = threading.Thread(target=self.lobby.accept_connections)
+        self.accept_thread.start()
+        self.shards = []
+        for shard_index in range(shard_map.shard_count):
+            shard_dir = os.path.join(data_dir, f"shard{shard_index}")
+            os.makedirs(shard_dir)
+            server = DatabaseServer(JsonStorageEngine(shard_dir, durability=DURABILITY_IMMEDIATE), match_log=MatchLog(os.path.join(shard_dir, "match_log")),
+                                    shard_map=shard_map, shard_index=shard_index)
+            server.connect(*self.lobby.server_sock.getsockname())
+            self.shards.append(server)
+        wait_until(self.lobby.shard_router.connected)
+        self.router = self.lobby.shard_router
+
+    def request(self, collection: str, action: str, data: dict) -> tuple[str, dict]:
+        return self.router.execute(collection, action, data)
+
+    def login(self, username: str) -> None:
+        assert self.request(Words.Collection.USER, Words.Action.CREATE, {K.USERNAME: username, K.PASSWORD: "pw"})[0] == Words.Result.SUCCESS
+        assert self.request(Words.Collection.USER, Words.Action.UPDATE, {K.USERNAME: username, K.ONLINE: True})[0] == Words.Result.SUCCESS
+
+    def spread_names(self, count: int) -> list[str]:
+        """count usernames whose shards alternate, so every flow crosses shards."""
+        shard_map = self.router.shard_map
+        candidates = (f"player{i}" for i in range(1000))
+        return [next(name for name in candidates if shard_map.shard_of(name) == i % shard_map.shard_count) for i in range(count)]
+
+    def room_of(self, username: str):
+        return self.request(Words.Collection.USER, Words.Action.QUERY, {K.USERNAME: username})[1][K.CURRENT_ROOM_ID]
+
+    def close(self) -> None:
+        for server in self.shards:
+            server.shutdown()
+        self.lobby.shutdown_event.set()
+        self.accept_thread.join()
+        self.lobby.server_sock.close()
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    cluster = ShardedDatabase(str(tmp_path), ShardMap(2, room_shard=0))
+    yield cluster
+    cluster.close()
+
+
+def test_users_live_on_their_shard(sharded):
+    names = sharded.spread_names(6)
+    for name in names:
+        sharded.login(name)
+    shard_map = sharded.router.shard_map
+    for name in names:
+        for shard_index, server in enumerate(sharded.shards):
+            assert (server.storage.get_user(name) is not None) == (shard_index == shard_map.shard_of(name))
+    result, data = sharded.router.call(1 - shard_map.shard_of(names[0]), Words.Collection.USER, Words.Action.QUERY, {K.USERNAME: names[0]})
+    assert result == Words.Result.FAILURE and data[K.REASON] == Words.Reason.WRONG_SHARD
+    assert set(sharded.request(Words.Collection.USER, Words.Action.QUERY, {K.ONLINE: True})[1]) == set(names)
+
+
+def test_room_sagas_across_shards(sharded):
+    names = sharded.spread_names(4)
+    for name in names:
+        sharded.login(name)
+    owner, guest, late, watcher = names
+    result, data = sharded.request(Words.Collection.ROOM, Words.Action.CREATE, {K.OWNER: owner, K.SETTINGS: {}})
+    assert result == Words.Result.SUCCESS
+    room_id = data[K.ROOM_ID]
+    assert sharded.room_of(owner) == room_id
+    assert sharded.request(Words.Collection.ROOM, Words.Action.ADD_USER, {K.ROOM_ID: room_id, K.USERNAME: guest})[0] == Words.Result.SUCCESS
+    assert sharded.room_of(guest) == room_id
+    # The room is full: the claim on the user's shard is released again.
+    assert sharded.request(Words.Collection.ROOM, Words.Action.ADD_USER, {K.ROOM_ID: room_id, K.USERNAME: late})[0] == Words.Result.FAILURE
+    assert sharded.room_of(late) is None
+    assert sharded.request(Words.Collection.ROOM, Words.Action.ADD_SPECTATOR, {K.ROOM_ID: room_id, K.USERNAME: watcher})[0] == Words.Result.SUCCESS
+    assert sharded.room_of(watcher) == room_id
+    assert sharded.request(Words.Collection.ROOM, Words.Action.REMOVE_USER, {K.ROOM_ID: room_id, K.USERNAME: owner})[0] == Words.Result.SUCCESS
+    assert sharded.room_of(owner) is None
+    # The last player leaving deletes the room and frees its spectators.
+    assert sharded.request(Words.Collection.ROOM, Words.Action.REMOVE_USER, {K.ROOM_ID: room_id, K.USERNAME: guest})[0] == Words.Result.SUCCESS
+    assert [sharded.room_of(name) for name in names] == [None] * 4
+    assert sharded.request(Words.Collection.ROOM, Words.Action.QUERY, {K.ROOM_ID: room_id})[0] == Words.Result.NOT_FOUND
+
+
+def test_match_results_and_leaderboard_across_shards(sharded):
+    names = sharded.spread_names(4)
+    for name in names:
+        sharded.login(name)
+    for winner, loser in [(names[0], names[1]), (names[0], names[2]), (names[3], names[1])]:
+        result, _ = sharded.request(Words.Collection.USER, Words.Action.RECORD_RESULT, {K.PLAYERS: [winner, loser], K.WINNER: winner})
+        assert result == Words.Result.SUCCESS
+    result, data = sharded.request(Words.Collection.USER, Words.Action.RECORD_RESULT, {K.PLAYERS: [names[0], "nobody"], K.WINNER: names[0]})
+    assert result == Words.Result.FAILURE
+    result, data = sharded.request(Words.Collection.LEADERBOARD, Words.Action.QUERY, {K.USERNAME: names[1], K.LIMIT: 2})
+    assert result == Words.Result.FOUND
+    assert [entry[K.USERNAME] for entry in data[K.ENTRIES]] == [names[0], names[3]]
+    assert data[K.RANK] == 4
+    result, data = sharded.request(Words.Collection.GAMELOG, Words.Action.QUERY, {K.USERNAME: names[1]})
+    assert len(data[K.MATCHES]) == 2
+    result, data = sharded.request(Words.Collection.LEADERBOARD, Words.Action.QUERY, {K.LIMIT: "two"})
+    assert result == Words.Result.FAILURE
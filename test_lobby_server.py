@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+import types
+import pytest
+from database_flusher import DURABILITY_IMMEDIATE
+from database_server import DatabaseServer
+from json_storage_engine import JsonStorageEngine
+from lobby_server import LobbyServer
+from match_log import MatchLog
+from protocols import Protocols, Words
+from session_info import SessionInfo
+from shard_cluster import Client
+
+K = Words.DataParamKey
+TIMEOUT = 10.0
+
+
+def wait_until(condition, timeout: float = TIMEOUT) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise TimeoutError("Condition not reached in time.")
+        time.sleep(0.05)
+
+
+class Lobby:
+    """An in-process LobbyServer with a DatabaseServer on a temporary data directory, and clients without the UI."""
+    def __init__(self, data_dir: str, session_grace_period: float = 30.0) -> None:
+        self.server = LobbyServer(session_grace_period=session_grace_period, metrics_port=None)
+        self.server.server_sock.bind(("127.0.0.1", 0))
+        self.server.server_sock.listen(5)
+        self.server.server_sock.settimeout(1.0)
+        self.port = self.server.server_sock.getsockname()[1]
+        self.threads = [threading.Thread(target=self.server.accept_connections), threading.Thread(target=self.server.manage_sessions)]
+        for thread in self.threads:
+            thread.start()
+        self.database = DatabaseServer(JsonStorageEngine(data_dir, durability=DURABILITY_IMMEDIATE), match_log=MatchLog(os.path.join(data_dir, "match_log")))
+        self.database.connect("127.0.0.1", self.port)
+        wait_until(self.server.database_connected)
+        self.clients: list[Client] = []
+
+    def client(self) -> Client:
+        client = Client(self.port)
+        self.clients.append(client)
+        return client
+
+    def login(self, username: str) -> tuple[Client, str]:
+        client = self.client()
+        assert client.command(Words.Command.REGISTER, {K.USERNAME: username, K.PASSWORD: "pw"})[0] == Words.Result.SUCCESS
+        result, data = client.command(Words.Command.LOGIN, {K.USERNAME: username, K.PASSWORD: "pw"})
+        assert result == Words.Result.SUCCESS
+        return client, data[K.SESSION_TOKEN]
+
+    def drop(self, client: Client, token: str) -> None:
+        """Cut the connection without EXIT, as a network failure would, and wait for the lobby to suspend the session."""
+        self.clients.remove(client)
+        client.msgfmt_passer.close()
+        wait_until(lambda: token not in self.server.sessions or self.server.sessions[token].msgfmt_passer is None)
+
+    def user(self, username: str) -> dict:
+        return self.database.storage.get_user(username)
+
+    def close(self) -> None:
+        for client in self.clients:
+            client.close()
+        wait_until(lambda: not any(self.server.mfpassers_username))
+        self.database.shutdown()
+        self.server.shutdown_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.server.server_sock.close()
+
+
+@pytest.fixture
+def lobby(tmp_path):
+    lobby = Lobby(str(tmp_path))
+    yield lobby
+    lobby.close()
+
+
+def receive_message(client: Client) -> tuple[str, str, str, str, dict]:
+    return client.msgfmt_passer.receive_args(Protocols.LobbyToClient.MESSAGE)
+
+
+def test_resumed_session_keeps_its_room(lobby):
+    client, token = lobby.login("alice")
+    room_id = client.command(Words.Command.CREATE_ROOM, {K.PRIVACY: "public"})[1][K.ROOM_ID]
+    lobby.drop(client, token)
+    assert lobby.user("alice")[K.ONLINE] is True  # suspended, not logged out
+    result, data = lobby.client().command(Words.Command.RESUME_SESSION, {K.SESSION_TOKEN: token})
+    assert result == Words.Result.SUCCESS
+    assert data[K.USERNAME] == "alice"
+    assert data[K.ROOM_ID] == room_id
+    assert data[K.NOW_ROOM_INFO][K.USERS] == ["alice"]
+
+
+def test_unknown_session_is_refused(lobby):
+    result, _ = lobby.client().command(Words.Command.RESUME_SESSION, {K.SESSION_TOKEN: "no-such-token"})
+    assert result == Words.Result.FAILURE
+    result, _ = lobby.client().command(Words.Command.RESUME_SESSION, {K.SESSION_TOKEN: ["not", "a", "token"]})
+    assert result == Words.Result.FAILURE
+
+
+def test_game_events_are_replayed_on_resume(lobby):
+    client, token = lobby.login("alice")
+    lobby.drop(client, token)
+    lobby.server.game_servers["7"] = types.SimpleNamespace(port=30001)
+    try:
+        lobby.server.send_event("alice", Words.EventType.CONNECT_TO_GAME_SERVER, {K.PORT: 30001})
+        lobby.server.send_event("alice", Words.EventType.CONNECT_TO_GAME_SERVER, {K.PORT: 30002})  # that game is over by now
+        client = lobby.client()
+        assert client.command(Words.Command.RESUME_SESSION, {K.SESSION_TOKEN: token})[0] == Words.Result.SUCCESS
+        message_type, _, event_type, _, data = receive_message(client)
+        assert (message_type, event_type, data) == (Words.MessageType.EVENT, Words.EventType.CONNECT_TO_GAME_SERVER, {K.PORT: 30001})
+        client.msgfmt_passer.send_args(Protocols.ClientToLobby.COMMAND, Words.Command.CHECK_USERNAME, {K.USERNAME: "bob"})
+        assert receive_message(client)[0] == Words.MessageType.RESPONSE  # nothing else was replayed
+        lobby.server.send_event("alice", Words.EventType.CONNECT_TO_GAME_SERVER, {K.PORT: 30001})
+        assert receive_message(client)[0] == Words.MessageType.EVENT  # attached again: sent right away
+    finally:
+        del lobby.server.game_servers["7"]
+
+
+def test_login_takes_over_a_suspended_session(lobby):
+    client, token = lobby.login("alice")
+    lobby.drop(client, token)
+    result, data = lobby.client().command(Words.Command.LOGIN, {K.USERNAME: "alice", K.PASSWORD: "pw"})
+    assert result == Words.Result.SUCCESS
+    assert data[K.SESSION_TOKEN] != token
+    assert lobby.client().command(Words.Command.RESUME_SESSION, {K.SESSION_TOKEN: token})[0] == Words.Result.FAILURE
+
+
+def test_expired_session_logs_the_user_out(tmp_path):
+    lobby = Lobby(str(tmp_path), session_grace_period=0.5)
+    try:
+        client, token = lobby.login("alice")
+        client.command(Words.Command.CREATE_ROOM, {K.PRIVACY: "public"})
+        lobby.drop(client, token)
+        wait_until(lambda: token not in lobby.server.sessions)
+        wait_until(lambda: lobby.user("alice")[K.ONLINE] is False)
+        assert lobby.user("alice")[K.CURRENT_ROOM_ID] is None
+        assert lobby.client().command(Words.Command.RESUME_SESSION, {K.SESSION_TOKEN: token})[0] == Words.Result.FAILURE
+    finally:
+        lobby.close()
+
+
+def test_without_a_grace_period_a_drop_logs_out(tmp_path):
+    lobby = Lobby(str(tmp_path), session_grace_period=0)
+    try:
+        client, token = lobby.login("alice")
+        lobby.drop(client, token)
+        wait_until(lambda: lobby.user("alice")[K.ONLINE] is False)
+    finally:
+        lobby.close()
+
+
+def test_pending_events_keep_the_newest():
+    session = SessionInfo("token", "alice", None)
+    session.detach()
+    for i in range(SessionInfo.MAX_PENDING_EVENTS + 5):
+        session.pending_events.append((Words.EventType.CONNECT_TO_GAME_SERVER, {K.PORT: i}))
+    pending = session.attach(object())
+    assert [data[K.PORT] for _, data in pending] == list(range(5, SessionInfo.MAX_PENDING_EVENTS + 5))
+    assert not session.pending_events and not session.is_expired(0)
@@ -0,0 +1,42 @@
+import unittest
+from bitboard_tetris import BitboardTetris
+from tetris import Tetris
+from tetris_engine_check import verify, CLEARING_ACTIONS
+
+
+class LateClearTetris(Tetris):
+    """Clears lines on the next update instead of at the lock, as the engine did before: must be told apart."""
+    def lock_piece(self) -> None:
+        clear_full_lines = self.clear_full_lines
+        self.clear_full_lines = lambda rows=None: None
+        super().lock_piece()
+        self.clear_full_lines = clear_full_lines
+
+    def update(self, delta_time: float) -> None:
+        super().update(delta_time)
+        self.clear_full_lines()
+
+
+class TetrisEnginesTest(unittest.TestCase):
+    """Random games, with garbage rows so that lines clear, compared step by step with the frozen reference engine;
+    the column heights, drop distance and landing row are checked against a brute-force drop as well."""
+    GAMES = 20
+    STEPS = 1000
+
+    def test_tetris_matches_reference(self) -> None:
+        self.assertEqual(verify(Tetris, self.GAMES, self.STEPS), self.GAMES * self.STEPS)
+
+    def test_bitboard_matches_reference(self) -> None:
+        self.assertEqual(verify(BitboardTetris, self.GAMES, self.STEPS), self.GAMES * self.STEPS)
+
+    def test_heights_after_line_clears(self) -> None:
+        for engine in (Tetris, BitboardTetris):
+            self.assertEqual(verify(engine, self.GAMES, self.STEPS, CLEARING_ACTIONS), self.GAMES * self.STEPS)
+
+    def test_divergence_fails(self) -> None:
+        with self.assertRaises(AssertionError):
+            verify(LateClearTetris, self.GAMES, self.STEPS)
+
+
+if __name__ == "__main__":
+    unittest.main()
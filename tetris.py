@@ -1,4 +1,5 @@
 from piece import Piece, Pieces
+from typing import Iterable
 import random
 
 class Tetris:
@@ -6,6 +7,8 @@ class Tetris:
     PIECE_LIST = [Pieces.T, Pieces.I, Pieces.O, Pieces.L, Pieces.J, Pieces.S, Pieces.Z]
     def __init__(self, gravity_time: float, seed: int) -> None:
         self.board = [[0 for _ in range(Tetris.SIZE[1])] for _ in range(Tetris.SIZE[0])] # self.board[<row>][<col>]; 0 means empty cell, 1 means score cell, 2 means heal cell, 3 means attack cell
+        self.row_fill = [0 for _ in range(Tetris.SIZE[0])] # filled cells per row; a row is full when it reaches Tetris.SIZE[1]
+        self.column_heights = [0 for _ in range(Tetris.SIZE[1])] # per column, rows from the bottom up to and including its top filled cell
         self.seed = seed
         self.rng = random.Random(seed)
         self.now_piece: Piece = self.rng.choice(Tetris.PIECE_LIST).copy()
@@ -21,11 +24,82 @@ class Tetris:
         for row in range(Tetris.SIZE[0]):
             for col in range(Tetris.SIZE[1]):
                 self.board[row][col] = 0
+            self.row_fill[row] = 0
+        self.column_heights = [0 for _ in range(Tetris.SIZE[1])]
+
+    def set_board(self, board: list[list[int]]) -> None:
+        """Replace the whole board, recounting the filled cells of each row."""
+        self.board = board
+        self.row_fill = [sum(1 for cell in row if cell != 0) for row in board]
+        self.recount_heights()
+
+    def recount_heights(self) -> None:
+        for col in range(Tetris.SIZE[1]):
+            self.column_heights[col] = next((Tetris.SIZE[0] - row for row in range(Tetris.SIZE[0]) if self.board[row][col] != 0), 0)
+
+    def raise_heights(self, cells: tuple[tuple[int, int], ...], position: tuple[int, int]) -> None:
+        """Update the column heights for cells just filled at position."""
+        for r, c in cells:
+            board_row = position[0] + r
+            board_col = position[1] + c
+            if 0 <= board_row < Tetris.SIZE[0] and 0 <= board_col < Tetris.SIZE[1]:
+                self.column_heights[board_col] = max(self.column_heights[board_col], Tetris.SIZE[0] - board_row)
+
+    def lower_heights(self, cells: tuple[tuple[int, int], ...], position: tuple[int, int]) -> None:
+        """Update the column heights for cells just emptied at position (a colour 0 lock): a column changes only if its
+        top cell was emptied, and is rescanned from its old top down."""
+        for col in {position[1] + c for _, c in cells}:
+            if 0 <= col < Tetris.SIZE[1]:
+                self.column_heights[col] = self.column_height_from(col, Tetris.SIZE[0] - self.column_heights[col])
+
+    def drop_heights(self, full_rows: list[int]) -> None:
+        """Update the column heights once full_rows (sorted) are cleared. A full row has a cell in every column, so a
+        column's top was either above the cleared rows, and moved down with them, or in the first of them; only the
+        latter are rescanned, below it."""
+        cleared_top = Tetris.SIZE[0] - full_rows[0]
+        for col in range(Tetris.SIZE[1]):
+            if self.column_heights[col] > cleared_top:
+                self.column_heights[col] -= len(full_rows)
+            else:
+                self.column_heights[col] = self.column_height_from(col, full_rows[0])
+
+    def column_height_from(self, col: int, row: int) -> int:
+        """Height of column col counting only its cells from row down."""
+        return next((Tetris.SIZE[0] - r for r in range(row, Tetris.SIZE[0]) if self.board[r][col] != 0), 0)
+
+    def drop_distance(self) -> int:
+        """Rows the piece can fall before it lands, from the column heights and the piece's bottom profile: O(piece
+        width). A piece already below the top of one of its columns (slid under an overhang) is probed row by row."""
+        if self.now_piece is None:
+            return 0
+        row, col = self.now_piece.position
+        distance = Tetris.SIZE[0]
+        for c, bottom in self.now_piece.bottoms:
+            board_col = col + c
+            if not 0 <= board_col < Tetris.SIZE[1]:
+                return 0
+            free = Tetris.SIZE[0] - self.column_heights[board_col] - (row + bottom) - 1
+            if free < 0:
+                return self.probe_drop_distance()
+            distance = min(distance, free)
+        return distance
+
+    def probe_drop_distance(self) -> int:
+        row, col = self.now_piece.position
+        distance = 0
+        while self.now_piece_fits_at(row + distance + 1, col):
+            distance += 1
+        return distance
+
+    def landing_row(self) -> int | None:
+        """Row the piece would lock at if hard dropped, for the ghost piece."""
+        if self.now_piece is None:
+            return None
+        return self.now_piece.position[0] + self.drop_distance()
 
     def hard_drop_piece(self) -> None:
         if self.now_piece is not None:
-            while self.now_piece_can_move("down"):
-                self.now_piece.move("down")
+            self.now_piece.position = (self.landing_row(), self.now_piece.position[1])
             self.lock_piece()
 
     def drop_piece_one_step(self) -> None:
@@ -42,42 +116,42 @@ class Tetris:
     def check_collide(self, piece: Piece) -> bool:
         if piece is None:
             return False
-        for r in range(len(piece.shape)):
-            for c in range(len(piece.shape[0])):
-                if piece.shape[r][c] != 0:
-                    board_row = piece.position[0] + r
-                    board_col = piece.position[1] + c
-                    if (board_row < 0 or board_row >= Tetris.SIZE[0] or
-                        board_col < 0 or board_col >= Tetris.SIZE[1] or
-                        self.board[board_row][board_col] != 0):
-                        return True
+        return self.cells_collide(piece.cells, piece.position)
+
+    def cells_collide(self, cells: tuple[tuple[int, int], ...], position: tuple[int, int]) -> bool:
+        for r, c in cells:
+            board_row = position[0] + r
+            board_col = position[1] + c
+            if (board_row < 0 or board_row >= Tetris.SIZE[0] or
+                board_col < 0 or board_col >= Tetris.SIZE[1] or
+                self.board[board_row][board_col] != 0):
+                return True
         return False
 
     def now_piece_can_rotate(self) -> bool:
-        temp_piece = Piece([row[:] for row in self.now_piece.shape], self.now_piece.position, self.now_piece.type_name) # fix here
-        temp_piece.rotate()
-        return not self.check_collide(temp_piece)
-    
-    def try_rotate_now_piece(self) -> None:
-        temp_piece = Piece([row[:] for row in self.now_piece.shape], self.now_piece.position, self.now_piece.type_name)
-        temp_piece.rotate()
-        if not self.check_collide(temp_piece):
-            self.now_piece.rotate()
-        else:
-            # Try wall kicks
-            temp_pos = temp_piece.position
-            for shift in [-1, 1, -2, 2]:
-                temp_piece.position = (temp_pos[0], temp_pos[1] + shift)
-                if not self.check_collide(temp_piece):
-                    self.now_piece.position = (self.now_piece.position[0], self.now_piece.position[1] + shift)
-                    self.now_piece.rotate()
-                    break
+        return not self.cells_collide(self.now_piece.rotated_cells(), self.now_piece.position)
 
+    def try_rotate_now_piece(self) -> None:
+        cells = self.now_piece.rotated_cells()
+        row, col = self.now_piece.position
+        for shift in self.now_piece.template.kicks:
+            if not self.cells_collide(cells, (row, col + shift)):
+                self.now_piece.position = (row, col + shift)
+                self.now_piece.rotate()
+                break
 
     def now_piece_can_move(self, direction: str) -> bool:
-        temp_piece = Piece([row[:] for row in self.now_piece.shape], self.now_piece.position, self.now_piece.type_name)
-        temp_piece.move(direction)
-        return not self.check_collide(temp_piece)
+        row, col = self.now_piece.position
+        if direction == "left":
+            col -= 1
+        elif direction == "right":
+            col += 1
+        elif direction == "down":
+            row += 1
+        return self.now_piece_fits_at(row, col)
+
+    def now_piece_fits_at(self, row: int, col: int) -> bool:
+        return not self.cells_collide(self.now_piece.cells, (row, col))
 
     def try_move_now_piece(self, direction: str) -> None:
         if self.now_piece is not None and self.now_piece_can_move(direction):
@@ -86,13 +160,19 @@ class Tetris:
     def lock_piece(self) -> None:
         if self.now_piece is not None:
             pre_color = self.now_piece.color
-            for r in range(len(self.now_piece.shape)):
-                for c in range(len(self.now_piece.shape[0])):
-                    if self.now_piece.shape[r][c] != 0:
-                        board_row = self.now_piece.position[0] + r
-                        board_col = self.now_piece.position[1] + c
-                        if 0 <= board_row < Tetris.SIZE[0] and 0 <= board_col < Tetris.SIZE[1]:
-                            self.board[board_row][board_col] = self.now_piece.shape[r][c] * pre_color
+            touched_rows = set()
+            for r, c in self.now_piece.cells:
+                board_row = self.now_piece.position[0] + r
+                board_col = self.now_piece.position[1] + c
+                if 0 <= board_row < Tetris.SIZE[0] and 0 <= board_col < Tetris.SIZE[1]:
+                    self.row_fill[board_row] += (pre_color != 0) - (self.board[board_row][board_col] != 0)
+                    self.board[board_row][board_col] = pre_color
+                    touched_rows.add(board_row)
+            if pre_color != 0:
+                self.raise_heights(self.now_piece.cells, self.now_piece.position)
+            else:
+                self.lower_heights(self.now_piece.cells, self.now_piece.position) # colour 0 emptied the cells
+            self.clear_full_lines(touched_rows) # only the rows of the locked piece can have become full
             self.now_piece = self.next_piece_list.pop(0)
             self.now_piece.color = pre_color
             self.next_piece_list.append(self.rng.choice(Tetris.PIECE_LIST).copy())
@@ -100,30 +180,22 @@ class Tetris:
                 self.board_dead = True
             self.gravity_timer = 0.0
 
-    def clear_full_lines(self) -> None:
-        """Clears full lines from the board and updates the recent cleared cells."""
-        each_total_cells_cleared = [0, 0, 0, 0] # index 0: empty, 1: score, 2: heal, 3: attack
-        row_index = Tetris.SIZE[0] - 1 # start from bottom row, go up, to avoid skipping rows after deletion
-        for row in range(Tetris.SIZE[0] - 1, -1, -1):
-            temp_cell_list = [0, 0, 0, 0] # index 0: empty, 1: score, 2: heal, 3: attack
-            is_full_line = True
+    def clear_full_lines(self, rows: Iterable[int] | None = None) -> None:
+        """Clears the full lines among rows (all rows by default) and adds their cells to the recent cleared cells."""
+        full_rows = sorted(row for row in (range(Tetris.SIZE[0]) if rows is None else rows) if self.row_fill[row] == Tetris.SIZE[1])
+        if not full_rows:
+            return
+        for row in full_rows:
             for cell in self.board[row]:
-                if cell == 0:
-                    is_full_line = False
-                    break
-                else:
-                    temp_cell_list[cell] += 1
-            if is_full_line:
-                for i in range(1, 4): # only count score, heal, attack cells
-                    each_total_cells_cleared[i] += temp_cell_list[i]
-                self.board[row] = [0 for _ in range(Tetris.SIZE[1])]
-            else:
-                self.board[row_index] = self.board[row].copy() # move down non-full line, use copy to avoid reference issue
-                row_index -= 1
-        for r in range(row_index, -1, -1):
-            self.board[r] = [0 for _ in range(Tetris.SIZE[1])] # fill the top empty rows
-        self.recent_cleared_cells = each_total_cells_cleared
-    
+                if 1 <= cell <= 3: # only count score, heal, attack cells
+                    self.recent_cleared_cells[cell] += 1
+        for row in reversed(full_rows): # bottom up, so the indexes of the rows still to delete do not move
+            del self.board[row]
+            del self.row_fill[row]
+        self.board[0:0] = [[0 for _ in range(Tetris.SIZE[1])] for _ in full_rows] # the rows above moved down; refill the top
+        self.row_fill[0:0] = [0 for _ in full_rows]
+        self.drop_heights(full_rows)
+
     def update(self, delta_time: float) -> None:
         if self.paused:
             return
@@ -131,7 +203,6 @@ class Tetris:
         if self.gravity_timer >= self.gravity_time:
             self.drop_piece_one_step()
             self.gravity_timer = 0.0
-        self.clear_full_lines()
 
     def get_recent_cleared_cells(self) -> list[int]:
         return self.recent_cleared_cells
@@ -139,6 +210,9 @@ class Tetris:
     def clear_recent_cleared_cells(self) -> None:
         self.recent_cleared_cells = [0, 0, 0, 0]
 
+    def board_string(self) -> str:
+        return Tetris.to_board_string(self.board)
+
     @staticmethod
     def to_board_string(board: list[list[int]]) -> str:
         """Convert the board to a string representation."""
@@ -0,0 +1,188 @@
+import argparse
+import random
+import time
+import tetris_reference
+from bitboard_tetris import BitboardTetris
+from tetris import Tetris
+
+ACTIONS = ["left", "right", "rotate", "soft_drop", "hard_drop", "color", "tick", "tick", "tick", "garbage"]
+"""What a game does to a board, weighted roughly like play: gravity ticks between the player's moves. garbage
+fills the bottom rows but for one column, so that random play clears lines too."""
+CLEARING_ACTIONS = ["rotate", "soft_drop", "hard_drop", "hard_drop", "color", "tick", "garbage", "well", "well"]
+"""well fills the bottom rows but for the cells the piece would land in, and clears the way down, so that most drops
+clear one to four lines below whatever else is on the board."""
+
+
+class BaselineTetris(tetris_reference.Tetris):
+    """The frozen engine, given set_board and board_string so that play() can drive it like the others."""
+    def set_board(self, board: list[list[int]]) -> None:
+        self.board = board
+
+    def board_string(self) -> str:
+        return self.to_board_string(self.board)
+
+
+class ReferenceTetris(BaselineTetris):
+    """The frozen engine with the one rule changed on purpose since: full lines clear as the piece locks, before the
+    next piece spawns, and the cleared cells add up until the game collects them (they were counted on the next
+    update and overwritten by every update). The state every engine must reach."""
+    def lock_piece(self) -> None:
+        if self.now_piece is not None:
+            pre_color = self.now_piece.color
+            for r in range(len(self.now_piece.shape)):
+                for c in range(len(self.now_piece.shape[0])):
+                    if self.now_piece.shape[r][c] != 0:
+                        board_row = self.now_piece.position[0] + r
+                        board_col = self.now_piece.position[1] + c
+                        if 0 <= board_row < Tetris.SIZE[0] and 0 <= board_col < Tetris.SIZE[1]:
+                            self.board[board_row][board_col] = self.now_piece.shape[r][c] * pre_color
+            self.clear_full_lines()
+            self.now_piece = self.next_piece_list.pop(0)
+            self.now_piece.color = pre_color
+            self.next_piece_list.append(self.rng.choice(tetris_reference.Tetris.PIECE_LIST).copy())
+            if self.check_collide(self.now_piece):
+                self.board_dead = True
+            self.gravity_timer = 0.0
+
+    def clear_full_lines(self) -> None:
+        cleared = self.recent_cleared_cells
+        super().clear_full_lines()
+        self.recent_cleared_cells = [total + new for total, new in zip(cleared, self.recent_cleared_cells)]
+
+
+def play(tetris, action: str, rng: random.Random) -> None:
+    """One step of a game, as Game.handle_player_action and Game.update would do it."""
+    match action:
+        case "left" | "right":
+            tetris.try_move_now_piece(action)
+        case "rotate":
+            tetris.try_rotate_now_piece()
+        case "soft_drop":
+            tetris.drop_piece_one_step()
+        case "hard_drop":
+            tetris.hard_drop_piece()
+        case "color":
+            tetris.change_now_piece_color(rng.choice([0, 1, 2, 3]))
+        case "tick":
+            tetris.update(rng.choice([0.016, 0.25, 1.0]))
+        case "garbage":
+            board = [list(row) for row in tetris.board]
+            hole = rng.randrange(Tetris.SIZE[1])
+            for row in range(Tetris.SIZE[0] - rng.randint(1, 4), Tetris.SIZE[0]):
+                board[row] = [0 if col == hole else rng.randint(1, 3) for col in range(Tetris.SIZE[1])]
+            tetris.set_board(board)
+        case "well":
+            board = [list(row) for row in tetris.board]
+            row, col = tetris.now_piece.position
+            cells = [(r, c) for r, shape_row in enumerate(tetris.now_piece.shape) for c, cell in enumerate(shape_row) if cell != 0]
+            landing = Tetris.SIZE[0] - 1 - max(r for r, _ in cells)
+            for drop_row in range(row, landing + 1):
+                for r, c in cells:
+                    board[drop_row + r][col + c] = 0
+            for r in {r for r, _ in cells}:
+                board[landing + r] = [rng.randint(1, 3) for _ in range(Tetris.SIZE[1])]
+            for r, c in cells:
+                board[landing + r][col + c] = 0
+            tetris.set_board(board)
+    if tetris.board_dead:  # the player dies and revives on a cleared board
+        tetris.clear_board()
+        tetris.board_dead = False
+
+
+def state(tetris) -> tuple:
+    """Everything a game can observe of an engine, in a form every engine, the frozen one included, can give."""
+    piece = tetris.now_piece
+    return ([list(row) for row in tetris.board], piece.type_name, tuple(tuple(row) for row in piece.shape), piece.position, piece.color,
+            [next_piece.type_name for next_piece in tetris.next_piece_list], list(tetris.recent_cleared_cells), tetris.gravity_timer, tetris.board_dead)
+
+
+def brute_heights(board: list[list[int]]) -> list[int]:
+    return [next((len(board) - row for row in range(len(board)) if board[row][col] != 0), 0) for col in range(len(board[0]))]
+
+
+def brute_drop(reference: ReferenceTetris) -> int:
+    """Rows the reference engine's piece falls before it lands, moving a copy down one row at a time."""
+    piece = reference.now_piece.copy()
+    distance = 0
+    piece.move("down")
+    while not reference.check_collide(piece):
+        distance += 1
+        piece.move("down")
+    return distance
+
+
+def actions(seed: int, steps: int, choices: list[str] = ACTIONS) -> list[tuple[str, float]]:
+    """A random game: (action, seed of the action's own random choices) per step."""
+    rng = random.Random(seed)
+    return [(rng.choice(choices), rng.random()) for _ in range(steps)]
+
+
+def verify(engine: type, games: int, steps: int, choices: list[str] = ACTIONS) -> int:
+    """Play the same random games on ReferenceTetris and engine and compare their whole state after every step, and
+    the engine's column heights, drop distance and landing row with ones found by brute force on the reference.
+    Returns the number of steps compared; raises AssertionError at the first difference."""
+    compared = 0
+    for game in range(games):
+        reference = ReferenceTetris(gravity_time=1.0, seed=game)
+        candidate = engine(gravity_time=1.0, seed=game)
+        assert state(reference) == state(candidate), f"game {game}: initial states differ"
+        for step, (action, action_seed) in enumerate(actions(game, steps, choices)):
+            for tetris in (reference, candidate):
+                play(tetris, action, random.Random(action_seed))
+            expected, actual = state(reference), state(candidate)
+            assert expected == actual, f"game {game}, step {step} ({action}):\n{expected}\n!=\n{actual}"
+            assert candidate.board_string() == Tetris.to_board_string(expected[0]), f"game {game}, step {step}: board_string() differs from board"
+            assert candidate.column_heights == brute_heights(expected[0]), f"game {game}, step {step} ({action}): column heights {candidate.column_heights}"
+            drop = brute_drop(reference)
+            assert candidate.drop_distance() == drop, f"game {game}, step {step} ({action}): drop_distance() {candidate.drop_distance()} != {drop}"
+            assert candidate.landing_row() == reference.now_piece.position[0] + drop, f"game {game}, step {step} ({action}): landing_row()"
+            compared += 1
+    return compared
+
+
+def benchmark(engines: list[type], games: int, steps: int, repeat: int = 3) -> dict[type, dict[str, float]]:
+    """Mean microseconds per action of the same random games, by engine and action. The engines take turns, repeat
+    times, and each keeps its fastest run of every action, so warm-up and the order they run in do not count."""
+    scripts = [[(action, action_seed) for action, action_seed in actions(game, steps)] for game in range(games)]
+    results = {engine: {} for engine in engines}
+    for _ in range(repeat):
+        for engine in engines:
+            totals = dict.fromkeys(ACTIONS, 0.0)
+            counts = dict.fromkeys(ACTIONS, 0)
+            for game, script in enumerate(scripts):
+                tetris = engine(gravity_time=1.0, seed=game)
+                for action, action_seed in script:
+                    rng = random.Random(action_seed)
+                    start_time = time.perf_counter()
+                    play(tetris, action, rng)
+                    totals[action] += time.perf_counter() - start_time
+                    counts[action] += 1
+            for action in totals:
+                if counts[action]:
+                    mean = 1_000_000 * totals[action] / counts[action]
+                    results[engine][action] = min(mean, results[engine].get(action, mean))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check that Tetris and BitboardTetris behave like the frozen reference engine, and compare their speed.")
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=2000, help="actions per game")
+    parser.add_argument("--bench-only", action="store_true")
+    args = parser.parse_args()
+
+    if not args.bench_only:
+        for engine in (Tetris, BitboardTetris):
+            compared = verify(engine, args.games, args.steps) + verify(engine, args.games, args.steps, CLEARING_ACTIONS)
+            print(f"{engine.__name__}: {2 * args.games} games, {compared} steps, same states as the reference.")
+    results = benchmark([BaselineTetris, Tetris, BitboardTetris], args.games, args.steps)
+    baseline = results[BaselineTetris]
+    print(f"{'action':<10} {'baseline us':>12} {'Tetris us':>10} {'speedup':>8} {'Bitboard us':>12} {'speedup':>8}")
+    for action in baseline:
+        if action == "garbage":
+            continue  # a test fixture, not something a game does
+        tetris, bitboard = results[Tetris][action], results[BitboardTetris][action]
+        print(f"{action:<10} {baseline[action]:>12.2f} {tetris:>10.2f} {baseline[action] / tetris:>7.1f}x {bitboard:>12.2f} {baseline[action] / bitboard:>7.1f}x")
+
+if __name__ == "__main__":
+    main()